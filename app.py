@@ -1,10 +1,15 @@
 import os
 import logging
+import click
 from flask import Flask
 from flask_login import LoginManager
 from flask_mail import Mail
 from werkzeug.middleware.proxy_fix import ProxyFix
 from models import db
+import metrics
+import profiler
+import user_cache
+import outbox
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -17,20 +22,68 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
-    "connect_args": {"sslmode": "require"}
 }
+if (app.config["SQLALCHEMY_DATABASE_URI"] or '').startswith('postgres'):
+    # Local Postgres for development and benchmarks usually runs without TLS
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {"sslmode": os.environ.get('DATABASE_SSLMODE', 'require')}
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Mail configuration
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 
+# Email outbox configuration
+app.config['EMAIL_BACKGROUND_SENDER'] = os.environ.get('EMAIL_BACKGROUND_SENDER', 'true').lower() == 'true'
+app.config['EMAIL_BATCH_SIZE'] = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+app.config['EMAIL_MAX_ATTEMPTS'] = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 5))
+app.config['EMAIL_RETRY_BASE'] = int(os.environ.get('EMAIL_RETRY_BASE', 60))  # seconds, doubled per attempt
+app.config['EMAIL_POLL_INTERVAL'] = int(os.environ.get('EMAIL_POLL_INTERVAL', 30))  # seconds
+app.config['EMAIL_DIGEST'] = os.environ.get('EMAIL_DIGEST', 'false').lower() == 'true'  # merge a batch per recipient
+
 # Upload configuration
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['UPLOAD_TMP_FOLDER'] = os.environ.get('UPLOAD_TMP_FOLDER', os.path.join(app.instance_path, 'uploads_tmp'))  # staging, not served; same filesystem as UPLOAD_FOLDER
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))  # image processes per app worker
+app.config['UPLOAD_MAX_SIZE'] = int(os.environ.get('UPLOAD_MAX_SIZE', 64 * 1024 * 1024))  # resumable uploads; chunks stay under MAX_CONTENT_LENGTH
+app.config['UPLOAD_EXPIRY_HOURS'] = int(os.environ.get('UPLOAD_EXPIRY_HOURS', 24))  # unfinished uploads are dropped after this
+
+# Geofencing configuration
+app.config['GEOFENCE_RADIUS'] = int(os.environ.get('GEOFENCE_RADIUS', 100))  # meters, per-obra override
+app.config['GEO_INDEX_TTL'] = int(os.environ.get('GEO_INDEX_TTL', 300))  # seconds before rebuilding the site index
+app.config['MAP_REPORT_MONTHS'] = int(os.environ.get('MAP_REPORT_MONTHS', 2))  # report layer: current + previous month
+
+# Offline sync: reports per batch; photos still count toward MAX_CONTENT_LENGTH
+app.config['SYNC_MAX_ITEMS'] = int(os.environ.get('SYNC_MAX_ITEMS', 50))
+
+# PDF rendering queue configuration
+app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', 2))  # render processes per app worker
+app.config['PDF_MAX_QUEUED'] = int(os.environ.get('PDF_MAX_QUEUED', 20))  # active jobs across all workers
+app.config['PDF_JOB_TIMEOUT'] = int(os.environ.get('PDF_JOB_TIMEOUT', 300))  # seconds
+app.config['PDF_CACHE_FOLDER'] = os.environ.get('PDF_CACHE_FOLDER', os.path.join(app.instance_path, 'pdf_cache'))
+app.config['LIVRO_JOB_TIMEOUT'] = int(os.environ.get('LIVRO_JOB_TIMEOUT', 1800))  # seconds; whole-obra books
+app.config['LIVRO_SECTION_REPORTS'] = int(os.environ.get('LIVRO_SECTION_REPORTS', 25))  # reports laid out per flush
+
+# Metrics: each process writes its values under METRICS_DIR, summed by /metrics
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))  # seconds
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # bearer token for scrapers; admins may always read
+
+# Profiling: off unless enabled; admins can profile one request with the X-Profile header
+app.config['PROFILE_ENABLED'] = os.environ.get('PROFILE_ENABLED', 'false').lower() == 'true'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))  # fraction of requests profiled
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PROFILE_SLOW_MS', 0))  # sampled requests faster than this are dropped
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))  # stack sampling period
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 200))  # newest profiles kept
+
+# Login user cache: users' rows kept per worker; any committed user change clears every worker's copy
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 30))  # seconds; 0 disables the cache
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1000))  # users per worker
+app.config['USER_CACHE_DIR'] = os.environ.get('USER_CACHE_DIR', os.path.join(app.instance_path, 'user_cache'))
 
 # Initialize extensions
 db.init_app(app)
@@ -39,80 +92,70 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, faça login para acessar esta página.'
 mail = Mail(app)
+metrics.init_app(app)
+profiler.init_app(app)
+user_cache.init_app(app)
+outbox.init_app(app)
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    return user_cache.load_user(int(user_id))
 
 # Import routes after app initialization
 from routes import *
 
-with app.app_context():
-    # Import all models to ensure tables are created
-    from models import User, Checklist, Obra, Relatorio, Contato, Foto, Alerta
-    
-    db.create_all()
-    
-    # Create default admin user if none exists
-    admin_user = User.query.filter_by(email='admin@elp.com').first()
-    if not admin_user:
-        from werkzeug.security import generate_password_hash
-        admin_user = User()
-        admin_user.nome = 'Administrador'
-        admin_user.email = 'admin@elp.com'
-        admin_user.senha_hash = generate_password_hash('admin123')
-        admin_user.role = 'admin'
-        db.session.add(admin_user)
-        db.session.commit()
-        print("Admin user created: admin@elp.com / admin123")
-    
-    # Create default construction audit checklist if none exists
-    if not Checklist.query.filter_by(nome='Auditoria de Obra').first():
-        checklist = Checklist()
-        checklist.nome = 'Auditoria de Obra'
-        checklist.campos = [
-            'Equipamentos de Segurança (EPIs)',
-            'Sinalização de Segurança',
-            'Andaimes e Proteções',
-            'Estado dos Equipamentos',
-            'Organização do Canteiro',
-            'Gestão de Resíduos',
-            'Documentação Técnica',
-            'Qualidade dos Materiais',
-            'Cronograma de Execução',
-            'Normas Técnicas (NBRs)',
-            'Licenças e Alvarás',
-            'Capacitação da Equipe'
-        ]
-        checklist.obrigatorios = [
-            'Equipamentos de Segurança (EPIs)',
-            'Sinalização de Segurança',
-            'Andaimes e Proteções',
-            'Documentação Técnica'
-        ]
-        checklist.ativo = True
-        db.session.add(checklist)
-        db.session.commit()
-        print("Default construction audit checklist created")
-    
-    # Create a sample construction project if none exists
-    try:
-        sample_obra_exists = Obra.query.first()
-    except:
-        sample_obra_exists = None
-    
-    if not sample_obra_exists:
-        sample_obra = Obra()
-        sample_obra.nome = 'Edifício Comercial - Centro'
-        sample_obra.tipo = 'Edifício Comercial'
-        sample_obra.responsavel_id = admin_user.id
-        sample_obra.endereco = 'Rua Principal, 123 - Centro'
-        sample_obra.descricao = 'Construção de edifício comercial de 5 andares'
-        sample_obra.status = 'ativa'
-        db.session.add(sample_obra)
-        db.session.commit()
-        print("Sample construction project created")
+@app.cli.command('migrate')
+def migrate_command():
+    """Bring the database schema up to date"""
+    import bootstrap
+    bootstrap.migrate()
+    print("Schema up to date")
+
+@app.cli.command('seed')
+def seed_command():
+    """Create the default admin, checklist and sample project where missing"""
+    import bootstrap
+    bootstrap.seed()
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Migrate and seed; run once per deploy, before starting the workers"""
+    import bootstrap
+    bootstrap.run()
+    print("Bootstrap complete")
+
+@app.cli.command('send-emails')
+@click.option('--once', is_flag=True, help='Drain the outbox once and exit.')
+def send_emails_command(once):
+    """Deliver queued emails from the outbox"""
+    from outbox import run_sender
+    run_sender(once=once)
+
+@app.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Recompute the aggregate counters from the source tables"""
+    import counters
+    counters.rebuild()
+    print("Counters rebuilt")
+
+@app.cli.command('rebuild-map-clusters')
+def rebuild_map_clusters_command():
+    """Recompute the precomputed map clusters from obras and relatorios"""
+    import map_clusters
+    with db.engine.begin() as conn:
+        total = map_clusters.rebuild(conn)
+    print(f"Map clusters rebuilt from {total} points")
+
+@app.cli.command('migrate-uploads')
+def migrate_uploads_command():
+    """Move flat uploads into content-addressed storage"""
+    from storage import migrate_legacy_uploads
+    migrated = migrate_legacy_uploads()
+    print(f"{migrated} uploads migrated")
 
 if __name__ == '__main__':
+    # The development server prepares its own database
+    import bootstrap
+    with app.app_context():
+        bootstrap.run()
     app.run(host='0.0.0.0', port=5000, debug=True)
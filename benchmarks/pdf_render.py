@@ -0,0 +1,112 @@
+"""Time report PDF rendering and measure its allocations per report.
+
+Usage:
+    python benchmarks/pdf_render.py [--renders N] [--photos N]
+
+Seeds a throwaway SQLite database with one report holding a checklist and
+photos (full-size originals plus their 'pdf' derivatives), then renders it
+repeatedly into a spooled buffer two ways: as generate_pdf_report used to,
+with a new ReportRenderer per report (rebuilding the style sheet and table
+styles) and ASCII85-encoded streams, and with the process-wide renderer
+writing binary streams. Timings
+run without tracing; a second pass under tracemalloc reports the memory
+allocated at the peak of each render.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from PIL import Image as PILImage
+from reportlab import rl_config
+
+from models import db, User, Obra, Relatorio, Foto, FotoDerivado
+from migrations import upgrade
+from pdf_renderer import ReportRenderer, binary_streams, get_renderer
+
+def create_app(database_url, upload_folder):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['UPLOAD_FOLDER'] = upload_folder
+    db.init_app(app)
+    return app
+
+def seed(upload_folder, photos):
+    usuario = User(nome='Benchmark', email=f'pdf-{time.time_ns()}@bench.elp', senha_hash='-')
+    db.session.add(usuario)
+    db.session.flush()
+    obra = Obra(nome='Obra de benchmark', tipo='Edifício', responsavel_id=usuario.id)
+    db.session.add(obra)
+    db.session.flush()
+    relatorio = Relatorio(obra_id=obra.id, usuario_id=usuario.id, numero_seq=1, codigo_relatorio='BENCH-1',
+                          atividades='Concretagem da laje do 3º pavimento. ' * 20, status='aprovado',
+                          latitude=-23.55, longitude=-46.63)
+    relatorio.checklist_data = {f'Item_{i}_de_seguranca': 'on' for i in range(15)}
+    for i in range(photos):
+        original, derivado = f'original_{i}.jpg', f'pdf_{i}.jpg'
+        imagem = PILImage.effect_noise((3000, 2000), 40).convert('RGB')
+        imagem.save(os.path.join(upload_folder, original), quality=85)
+        imagem.resize((1200, 800)).save(os.path.join(upload_folder, derivado), quality=80)
+        relatorio.fotos.append(Foto(caminho_arquivo=original, tipo_servico='Estrutura', descricao=f'Foto {i}',
+                                    derivados=[FotoDerivado(variante='pdf', caminho_arquivo=derivado,
+                                                            largura=1200, altura=800)]))
+    db.session.add(relatorio)
+    db.session.commit()
+    return relatorio
+
+def render_before(relatorio):
+    renderer = ReportRenderer()
+    rl_config.useA85 = 1
+    renderer.render_to_buffer(relatorio).close()
+
+def render_shared(relatorio):
+    binary_streams()
+    get_renderer().render_to_buffer(relatorio).close()
+
+def measure(fn, relatorio, renders):
+    fn(relatorio)  # warm-up: imports, fonts, the shared renderer
+    timings = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        fn(relatorio)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    picos = []
+    for _ in range(min(renders, 10)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(relatorio)
+        picos.append((tracemalloc.get_traced_memory()[1] - base) / 1024)
+    tracemalloc.stop()
+    return statistics.mean(timings), statistics.median(timings), statistics.mean(picos)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--renders', type=int, default=50)
+    parser.add_argument('--photos', type=int, default=4)
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp()
+    upload_folder = os.path.join(pasta, 'uploads')
+    os.makedirs(upload_folder)
+    app = create_app('sqlite:///' + os.path.join(pasta, 'pdf.db'), upload_folder)
+
+    with app.app_context():
+        upgrade()
+        relatorio = seed(upload_folder, args.photos)
+        print(f"{args.renders} renders, {args.photos} fotos por relatório")
+        print(f"{'modo':<32}{'média ms':>10}{'mediana ms':>12}{'pico KiB':>10}")
+        for nome, fn in [('antes: por relatório, ASCII85', render_before),
+                         ('renderer compartilhado', render_shared)]:
+            media, mediana, pico = measure(fn, relatorio, args.renders)
+            print(f"{nome:<32}{media:>10.1f}{mediana:>12.1f}{pico:>10.0f}")
+
+if __name__ == '__main__':
+    main()
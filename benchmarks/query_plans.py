@@ -0,0 +1,162 @@
+"""Seed a large dataset and compare query plans before and after the index migration.
+
+Usage:
+    python benchmarks/query_plans.py [--database-url URL] [--reports N]
+
+Without --database-url (or DATABASE_URL) a throwaway SQLite file is used.
+The target database must be empty: the script applies migration 1, seeds,
+prints EXPLAIN output and timings for each hot query shape, applies the
+remaining migrations and prints them again.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, User, Obra, Relatorio, Contato, Foto, Alerta, HistoricoAprovacao
+from migrations import upgrade
+
+# Each shape mirrors a query issued by routes.py
+QUERY_SHAPES = [
+    ('sequences: último numero_seq da obra (primeiro uso)',
+     "SELECT * FROM relatorios WHERE obra_id = :obra_id ORDER BY numero_seq DESC LIMIT 1"),
+    ('admin_reports: status + data_criacao',
+     "SELECT * FROM relatorios WHERE status = :status ORDER BY data_criacao DESC, id DESC LIMIT 26"),
+    ('dashboard: reprovados do usuário',
+     "SELECT count(*) FROM relatorios WHERE usuario_id = :usuario_id AND status = 'reprovado' "
+     "AND prazo_revisao >= :agora"),
+    ('dashboard: alertas das obras',
+     "SELECT * FROM alertas WHERE obra_id = :obra_id AND data_alerta >= :agora ORDER BY data_alerta LIMIT 5"),
+    ('fotos do relatório',
+     "SELECT * FROM fotos WHERE relatorio_id = :relatorio_id"),
+    ('contatos da obra',
+     "SELECT * FROM contatos WHERE obra_id = :obra_id"),
+    ('histórico do relatório',
+     "SELECT * FROM historico_aprovacoes WHERE relatorio_id = :relatorio_id ORDER BY data_acao DESC"),
+    ('obras do responsável',
+     "SELECT * FROM obras WHERE responsavel_id = :usuario_id"),
+]
+
+def create_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    return app
+
+def insert_chunked(conn, table, rows, chunk=5000):
+    for start in range(0, len(rows), chunk):
+        conn.execute(table.insert(), rows[start:start + chunk])
+
+def seed(conn, users, obras, reports):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    insert_chunked(conn, User.__table__, [
+        {'id': i, 'nome': f'Usuário {i}', 'email': f'usuario{i}@bench.elp',
+         'senha_hash': '-', 'role': 'user', 'data_criacao': now}
+        for i in range(1, users + 1)])
+    insert_chunked(conn, Obra.__table__, [
+        {'id': i, 'nome': f'Obra {i}', 'tipo': 'Edifício', 'responsavel_id': rng.randint(1, users),
+         'status': 'ativa', 'data_criacao': now}
+        for i in range(1, obras + 1)])
+
+    seq = {}
+    report_rows = []
+    for i in range(1, reports + 1):
+        obra_id = rng.randint(1, obras)
+        seq[obra_id] = seq.get(obra_id, 0) + 1
+        status = rng.choice(('pendente', 'aprovado', 'aprovado', 'aprovado', 'reprovado'))
+        criado = now - timedelta(minutes=rng.randint(0, 60 * 24 * 730))
+        report_rows.append({
+            'id': i, 'obra_id': obra_id, 'usuario_id': rng.randint(1, users),
+            'numero_seq': seq[obra_id], 'codigo_relatorio': f'ELP-{criado.year}-{seq[obra_id]:03d}-v1',
+            'versao': 1, 'data': criado.date(), 'atividades': 'Concretagem da laje',
+            'status': status, 'data_criacao': criado,
+            'prazo_revisao': criado + timedelta(days=7) if status == 'reprovado' else None})
+    insert_chunked(conn, Relatorio.__table__, report_rows)
+
+    insert_chunked(conn, Foto.__table__, [
+        {'relatorio_id': rng.randint(1, reports), 'tipo_servico': 'Geral',
+         'caminho_arquivo': f'foto_{i}.jpg', 'tamanho': 1024, 'data_upload': now}
+        for i in range(reports)])
+    insert_chunked(conn, Contato.__table__, [
+        {'nome': f'Contato {i}', 'obra_id': rng.randint(1, obras), 'data_criacao': now}
+        for i in range(obras * 4)])
+    insert_chunked(conn, Alerta.__table__, [
+        {'obra_id': rng.randint(1, obras), 'descricao': 'Prazo de revisão',
+         'data_alerta': now + timedelta(days=rng.randint(-60, 60)), 'status': 'pendente', 'data_criacao': now}
+        for i in range(reports // 5)])
+    insert_chunked(conn, HistoricoAprovacao.__table__, [
+        {'relatorio_id': rng.randint(1, reports), 'aprovador_id': 1, 'acao': 'aprovado',
+         'data_acao': now - timedelta(minutes=rng.randint(0, 60 * 24 * 730))}
+        for i in range(reports // 2)])
+
+def explain(conn, sql, params):
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute(text(f"EXPLAIN ANALYZE {sql}"), params)
+        return [row[0] for row in rows]
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)
+    return [row[-1] for row in rows]
+
+def time_query(conn, sql, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def report(conn, label, params, repeat):
+    conn.execute(text("ANALYZE"))
+    print(f"\n===== {label} =====")
+    timings = {}
+    for name, sql in QUERY_SHAPES:
+        timings[name] = time_query(conn, sql, params, repeat)
+        print(f"\n-- {name}: {timings[name]:.3f} ms (mediana de {repeat})")
+        for line in explain(conn, sql, params):
+            print(f"   {line}")
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--obras', type=int, default=1000)
+    parser.add_argument('--reports', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app(database_url)
+
+    with app.app_context():
+        upgrade(target=1)
+        with db.engine.begin() as conn:
+            start = time.perf_counter()
+            seed(conn, args.users, args.obras, args.reports)
+            print(f"Seeded {args.reports} relatórios in {time.perf_counter() - start:.1f}s ({database_url})")
+
+        params = {'obra_id': 1, 'status': 'pendente', 'usuario_id': 1, 'relatorio_id': 1,
+                  'agora': datetime.utcnow()}
+        with db.engine.connect() as conn:
+            before = report(conn, 'Antes da migração', params, args.repeat)
+
+        upgrade()
+        with db.engine.connect() as conn:
+            after = report(conn, 'Depois da migração', params, args.repeat)
+
+    print("\n===== Resumo (ms) =====")
+    for name, _ in QUERY_SHAPES:
+        print(f"{before[name]:10.3f} -> {after[name]:10.3f}  {name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Measure worker startup and the cost of loading the PDF and image stacks on first use.
+
+Usage:
+    python benchmarks/startup.py [--runs N]
+
+Each run starts a fresh interpreter, imports app (which imports routes, as a
+gunicorn worker does) and then loads PIL and the report renderer the way
+the first photo or PDF request does. Importing app must not touch the
+database and must leave ReportLab and PIL unloaded; the medians are checked
+against BUDGET_MS. The exit status is 1 if any check fails.
+
+Schema migration and default data are not part of startup: they run once per
+deploy with 'flask bootstrap'.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measured medians were about 355, 8 and 62 ms
+BUDGET_MS = {
+    'import app': 600,
+    'PIL (primeira foto)': 50,
+    'ReportLab (primeiro PDF)': 200,
+}
+
+# Loaded on first use only
+LAZY_MODULES = ('reportlab', 'PIL', 'pdf_renderer', 'livro_layout')
+
+PROBE = """
+import json, sys, time
+inicio = time.perf_counter()
+import app
+depois_app = time.perf_counter()
+carregados = [m for m in %r if m in sys.modules]
+from PIL import Image
+depois_pil = time.perf_counter()
+import pdf_renderer
+pdf_renderer.get_renderer()
+depois_pdf = time.perf_counter()
+print(json.dumps({'tempos': {
+    'import app': (depois_app - inicio) * 1000,
+    'PIL (primeira foto)': (depois_pil - depois_app) * 1000,
+    'ReportLab (primeiro PDF)': (depois_pdf - depois_pil) * 1000,
+}, 'carregados': carregados}))
+""" % (LAZY_MODULES,)
+
+def probe(env):
+    saida = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True)
+    if saida.returncode != 0:
+        raise RuntimeError(saida.stderr)
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp()
+    # A database that does not exist: importing app must not connect
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(pasta, 'inexistente', 'startup.db'),
+               METRICS_DIR=os.path.join(pasta, 'metrics'), PDF_CACHE_FOLDER=os.path.join(pasta, 'pdf_cache'))
+    probe(env)  # warm-up: bytecode caches
+    resultados = [probe(env) for _ in range(args.runs)]
+
+    ok = True
+    print(f"{args.runs} execuções")
+    print(f"{'etapa':<28}{'mediana ms':>12}{'máx ms':>10}{'orçamento':>11}")
+    for etapa, orcamento in BUDGET_MS.items():
+        tempos = [r['tempos'][etapa] for r in resultados]
+        mediana = statistics.median(tempos)
+        marca = '' if mediana <= orcamento else '  ACIMA'
+        ok = ok and not marca
+        print(f"{etapa:<28}{mediana:>12.1f}{max(tempos):>10.1f}{orcamento:>11}{marca}")
+
+    carregados = sorted({m for r in resultados for m in r['carregados']})
+    if carregados:
+        ok = False
+        print(f"\nCarregados ao importar app: {', '.join(carregados)}")
+    print('OK' if ok else 'FALHOU')
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
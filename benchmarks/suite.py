@@ -0,0 +1,310 @@
+"""Time the hot request paths against a seeded database and keep a history of the results.
+
+Usage:
+    python benchmarks/suite.py [--database-url URL] [--escala pequena|media|grande]
+                               [--repeat N] [--threads N] [--only NOME,...]
+                               [--output PATH] [--limite PCT]
+
+Without --database-url (or DATABASE_URL) a throwaway SQLite file is used; a
+local Postgres works too (set DATABASE_SSLMODE=disable if it has no TLS). A
+database without seeded users is filled by tools/seed_data.py at the chosen
+scale first; one that was already seeded is reused as is, so a large
+dataset only has to be built once.
+
+The real app serves every request through Flask's test client, so routing,
+login, templates and SQL are all measured, but no network or WSGI server.
+Uploads, PDF caches and metrics go to a temporary folder.
+
+Each run is appended as one JSON line to --output with the commit, database
+and data volumes, and compared with the previous run on the same kind of
+database and scale: benchmarks whose median grew more than --limite percent are
+flagged, and the exit status is 1.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import seed_data
+
+DEFAULT_OUTPUT = os.path.join(ROOT, 'benchmarks', 'results', 'historico.jsonl')
+
+def load_app(database_url, pasta):
+    """Import the app configured for a benchmark run"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['PDF_CACHE_FOLDER'] = os.path.join(pasta, 'pdf_cache')
+    os.environ['METRICS_DIR'] = os.path.join(pasta, 'metrics')
+    os.environ['UPLOAD_TMP_FOLDER'] = os.path.join(pasta, 'uploads_tmp')
+    os.environ['EMAIL_BACKGROUND_SENDER'] = 'false'
+    os.chdir(ROOT)
+    import logging
+    from app import app
+    import bootstrap
+    logging.disable(logging.WARNING)
+    with app.app_context():
+        bootstrap.migrate()
+    app.config['UPLOAD_FOLDER'] = os.path.join(pasta, 'uploads')
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return app
+
+def ensure_data(app, escala):
+    """Seed the database unless an earlier run already did"""
+    from models import db, User
+    import counters
+
+    with app.app_context():
+        if User.query.filter(User.email.like('%@seed.elp')).first() is None:
+            volumes = dict(zip(('usuarios', 'obras', 'relatorios', 'imagens'), seed_data.ESCALAS[escala]))
+            start = time.perf_counter()
+            with db.engine.begin() as conn:
+                seed_data.seed(conn, app.config['UPLOAD_FOLDER'], **volumes)
+            counters.rebuild()
+            print(f"Dados sintéticos ({escala}) criados em {time.perf_counter() - start:.1f}s")
+        return volume_counts()
+
+def volume_counts():
+    from sqlalchemy import func, select
+    from models import db, User, Obra, Relatorio, Foto
+
+    return {model.__tablename__: db.session.execute(select(func.count()).select_from(model)).scalar()
+            for model in (User, Obra, Relatorio, Foto)}
+
+def fixtures(app, threads):
+    """Users, reports and obras the benchmarks act on"""
+    from sqlalchemy import func, select
+    from models import db, User, Obra, Relatorio, Foto, Checklist
+
+    rng = random.Random(7)
+    with app.app_context():
+        admin = User.query.filter(User.email.like('%@seed.elp'), User.role == 'admin').first()
+        # Authors with the most reports make the list pages realistic
+        autores = db.session.execute(
+            select(Relatorio.usuario_id).join(User, User.id == Relatorio.usuario_id)
+            .where(User.role == 'user', User.email.like('%@seed.elp'))
+            .group_by(Relatorio.usuario_id).order_by(func.count().desc()).limit(threads)).scalars().all()
+        pares = [(db.session.get(User, usuario_id).email,
+                  Obra.query.filter_by(responsavel_id=usuario_id).first()) for usuario_id in autores]
+        pares = [(email, obra.id) for email, obra in pares if obra is not None]
+        maximo = db.session.execute(select(func.max(Relatorio.id))).scalar()
+        relatorio_ids = [rng.randint(1, maximo) for _ in range(200)]
+        # The report with the most photos, for the PDF
+        com_fotos = db.session.execute(select(Foto.relatorio_id).group_by(Foto.relatorio_id)
+                                       .order_by(func.count().desc()).limit(1)).scalar()
+        checklist = Checklist.query.filter_by(ativo=True).first()
+        return {
+            'admin': admin.email,
+            'usuario': pares[0][0],
+            'pares': pares,
+            'relatorio_ids': relatorio_ids,
+            'relatorio_pdf': com_fotos,
+            'checklist_id': checklist.id,
+            'campos': checklist.campos,
+        }
+
+def client_as(app, email):
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': seed_data.SENHA})
+    assert response.status_code == 302, f"login de {email} falhou"
+    return client
+
+def expect(response, *status):
+    if response.status_code not in status:
+        raise RuntimeError(f"{response.request.path}: status {response.status_code}")
+    return response
+
+def jpeg(rng):
+    from PIL import Image
+
+    imagem = Image.effect_noise((1600, 1200), rng.randint(20, 60)).convert('RGB')
+    buffer = io.BytesIO()
+    imagem.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+def measure(fn, repeat, warmup=3):
+    for _ in range(warmup):
+        fn()
+    amostras = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        amostras.append((time.perf_counter() - start) * 1000)
+    return summary(amostras)
+
+def summary(amostras):
+    ordenadas = sorted(amostras)
+    return {
+        'n': len(amostras),
+        'mediana_ms': round(statistics.median(ordenadas), 3),
+        'p95_ms': round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))], 3),
+        'media_ms': round(statistics.mean(ordenadas), 3),
+    }
+
+def benchmarks(app, dados, args):
+    """Yield (nome, callable returning a summary)"""
+    rng = random.Random(11)
+    admin = client_as(app, dados['admin'])
+    usuario = client_as(app, dados['usuario'])
+    relatorio_ids = iter(dados['relatorio_ids'] * (args.repeat + 10))
+
+    def get(client, url):
+        return lambda: expect(client.get(url), 200)
+
+    def login():
+        expect(app.test_client().post('/login', data={'email': dados['usuario'], 'password': seed_data.SENHA}),
+               302)
+
+    yield 'login', lambda: measure(login, args.repeat)
+    yield 'dashboard_admin', lambda: measure(get(admin, '/dashboard'), args.repeat)
+    yield 'dashboard_usuario', lambda: measure(get(usuario, '/dashboard'), args.repeat)
+    yield 'reports_admin', lambda: measure(get(admin, '/reports'), args.repeat)
+    yield 'reports_usuario', lambda: measure(get(usuario, '/reports'), args.repeat)
+    yield 'admin_reports_all', lambda: measure(get(admin, '/admin/reports?status=all'), args.repeat)
+    yield 'admin_reports_pending', lambda: measure(get(admin, '/admin/reports/pending'), args.repeat)
+    yield 'projects', lambda: measure(get(admin, '/projects'), args.repeat)
+    yield 'contacts', lambda: measure(get(admin, '/contacts'), args.repeat)
+    yield 'api_report', lambda: measure(
+        lambda: expect(admin.get(f'/api/reports/{next(relatorio_ids)}'), 200, 404), args.repeat)
+
+    def upload_photo():
+        imagens = iter([jpeg(rng) for _ in range(args.repeat + 3)])
+        relatorio_id = dados['relatorio_ids'][0]
+        return measure(lambda: expect(admin.post(f'/upload_photo/{relatorio_id}', data={
+            'file': (io.BytesIO(next(imagens)), 'foto.jpg'), 'tipo_servico': 'Estrutura'}), 200), args.repeat)
+    yield 'upload_photo', upload_photo
+
+    def pdf():
+        from models import db, Relatorio
+        from utils import generate_pdf_report
+
+        def render():
+            with app.test_request_context():
+                buffer = generate_pdf_report(db.session.get(Relatorio, dados['relatorio_pdf']))
+                assert buffer is not None, 'PDF não gerado'
+                buffer.close()
+                db.session.remove()
+        return measure(render, args.repeat)
+    yield 'generate_pdf_report', pdf
+
+    def create_report():
+        from checklist_responses import field_key
+
+        form = {'atividades': 'Benchmark de criação concorrente', 'checklist_id': dados['checklist_id'],
+                **{f"checklist_{field_key(campo)}": 'on' for campo in dados['campos']}}
+        clientes = [(client_as(app, email), obra_id)
+                    for email, obra_id in (dados['pares'] * args.threads)[:args.threads]]
+
+        def worker(par):
+            client, obra_id = par
+            amostras = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                expect(client.post('/reports/create', data=dict(form, obra_id=obra_id)), 302)
+                amostras.append((time.perf_counter() - start) * 1000)
+            return amostras
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            amostras = [a for parte in executor.map(worker, clientes) for a in parte]
+        resultado = summary(amostras)
+        resultado['por_segundo'] = round(len(amostras) / (time.perf_counter() - start), 1)
+        resultado['threads'] = args.threads
+        return resultado
+    yield 'create_report_concorrente', create_report
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        alterado = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                       capture_output=True, text=True, check=True).stdout.strip())
+        return commit, alterado
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def previous_run(path, banco, escala):
+    anterior = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for linha in f:
+                registro = json.loads(linha)
+                if registro['banco'] == banco and registro['escala'] == escala:
+                    anterior = registro
+    return anterior
+
+def compare(anterior, resultados, limite):
+    """Print the medians next to the previous run's; return the names that regressed"""
+    regressoes = []
+    if anterior is None:
+        print("\nSem execução anterior com o mesmo banco e escala para comparar")
+        return regressoes
+    print(f"\nComparado com {anterior['commit']}{' (alterado)' if anterior['alterado'] else ''} "
+          f"de {anterior['data']}")
+    for nome, resultado in resultados.items():
+        antes = anterior['resultados'].get(nome)
+        if antes is None:
+            continue
+        variacao = (resultado['mediana_ms'] / antes['mediana_ms'] - 1) * 100 if antes['mediana_ms'] else 0
+        marca = ''
+        if variacao > limite:
+            marca = '  REGRESSÃO'
+            regressoes.append(nome)
+        print(f"{nome:<28}{antes['mediana_ms']:>10.2f} -> {resultado['mediana_ms']:>10.2f} ms "
+              f"{variacao:>+7.1f}%{marca}")
+    return regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--escala', choices=seed_data.ESCALAS, default='pequena')
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--only', help='comma-separated benchmark names')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--limite', type=float, default=15.0,
+                        help='percent increase of a median reported as a regression')
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp()
+    database_url = args.database_url or 'sqlite:///' + os.path.join(pasta, 'suite.db')
+    app = load_app(database_url, pasta)
+    volumes = ensure_data(app, args.escala)
+    dados = fixtures(app, args.threads)
+    selecionados = set(args.only.split(',')) if args.only else None
+
+    banco = database_url.split(':', 1)[0].split('+', 1)[0]
+    print(f"{banco}: " + ', '.join(f"{n} {tabela}" for tabela, n in volumes.items()))
+    print(f"{'benchmark':<28}{'mediana ms':>12}{'p95 ms':>10}{'média ms':>10}")
+    resultados = {}
+    for nome, run in benchmarks(app, dados, args):
+        if selecionados and nome not in selecionados:
+            continue
+        resultados[nome] = run()
+        r = resultados[nome]
+        extra = f"  {r['por_segundo']}/s com {r['threads']} threads" if 'por_segundo' in r else ''
+        print(f"{nome:<28}{r['mediana_ms']:>12.2f}{r['p95_ms']:>10.2f}{r['media_ms']:>10.2f}{extra}")
+
+    commit, alterado = git_commit()
+    registro = {'data': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'alterado': alterado,
+                'banco': banco, 'escala': args.escala, 'volumes': volumes, 'python': sys.version.split()[0],
+                'resultados': resultados}
+    regressoes = compare(previous_run(args.output, banco, args.escala), resultados, args.limite)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+    print(f"\nResultados gravados em {args.output}")
+    sys.exit(1 if regressoes else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Checklist, Obra
+from migrations import upgrade
+import counters
+
+# Schema migration and default data, run once per deploy through the
+# 'flask migrate', 'flask seed' and 'flask bootstrap' commands rather than
+# by every worker at import. Each step is idempotent.
+
+ADMIN_EMAIL = 'admin@elp.com'
+ADMIN_PASSWORD = 'admin123'
+
+DEFAULT_CHECKLIST = 'Auditoria de Obra'
+DEFAULT_CHECKLIST_CAMPOS = [
+    'Equipamentos de Segurança (EPIs)',
+    'Sinalização de Segurança',
+    'Andaimes e Proteções',
+    'Estado dos Equipamentos',
+    'Organização do Canteiro',
+    'Gestão de Resíduos',
+    'Documentação Técnica',
+    'Qualidade dos Materiais',
+    'Cronograma de Execução',
+    'Normas Técnicas (NBRs)',
+    'Licenças e Alvarás',
+    'Capacitação da Equipe'
+]
+DEFAULT_CHECKLIST_OBRIGATORIOS = [
+    'Equipamentos de Segurança (EPIs)',
+    'Sinalização de Segurança',
+    'Andaimes e Proteções',
+    'Documentação Técnica'
+]
+
+def migrate():
+    """Bring the schema up to date"""
+    upgrade()
+
+def create_admin():
+    """Create the default admin user if it does not exist; return it"""
+    admin_user = User.query.filter_by(email=ADMIN_EMAIL).first()
+    if admin_user:
+        return admin_user
+    admin_user = User()
+    admin_user.nome = 'Administrador'
+    admin_user.email = ADMIN_EMAIL
+    admin_user.senha_hash = generate_password_hash(ADMIN_PASSWORD)
+    admin_user.role = 'admin'
+    db.session.add(admin_user)
+    counters.increment('usuarios')
+    db.session.commit()
+    print(f"Admin user created: {ADMIN_EMAIL} / {ADMIN_PASSWORD}")
+    return admin_user
+
+def create_default_checklist():
+    """Create the construction audit checklist if it does not exist"""
+    if Checklist.query.filter_by(nome=DEFAULT_CHECKLIST).first():
+        return
+    checklist = Checklist()
+    checklist.nome = DEFAULT_CHECKLIST
+    checklist.campos = DEFAULT_CHECKLIST_CAMPOS
+    checklist.obrigatorios = DEFAULT_CHECKLIST_OBRIGATORIOS
+    checklist.ativo = True
+    db.session.add(checklist)
+    counters.increment('checklists')
+    db.session.commit()
+    print("Default construction audit checklist created")
+
+def create_sample_obra(responsavel):
+    """Create a sample construction project if there are none"""
+    if Obra.query.first():
+        return
+    sample_obra = Obra()
+    sample_obra.nome = 'Edifício Comercial - Centro'
+    sample_obra.tipo = 'Edifício Comercial'
+    sample_obra.responsavel_id = responsavel.id
+    sample_obra.endereco = 'Rua Principal, 123 - Centro'
+    sample_obra.descricao = 'Construção de edifício comercial de 5 andares'
+    sample_obra.status = 'ativa'
+    db.session.add(sample_obra)
+    counters.increment('obras')
+    db.session.commit()
+    print("Sample construction project created")
+
+def seed():
+    """Create the default admin, checklist and sample project where missing"""
+    admin_user = create_admin()
+    create_default_checklist()
+    create_sample_obra(admin_user)
+
+def run():
+    """Migrate, then seed"""
+    migrate()
+    seed()
@@ -0,0 +1,116 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import case, func, select
+
+from models import db, Checklist, Obra, RespostaChecklist
+
+# Checklist answers are kept twice: Relatorio.checklist_json, which templates
+# and the PDF render, and one RespostaChecklist row per checklist item, which
+# analytics aggregate in SQL. Items of the report's checklist that were left
+# unchecked are stored as non-conforming rows, so failures can be counted.
+
+CONFORME_VALUES = {'on', 'true', '1', 'sim', 'ok', 'conforme'}
+
+def field_key(campo):
+    """Form key create_report.html uses for a checklist item"""
+    return re.sub(r'\s+', '_', campo.strip())
+
+def is_conforme(valor):
+    return valor is not None and str(valor).strip().lower() in CONFORME_VALUES
+
+def infer_checklist(respostas, checklists):
+    """Return the single (id, campos) of checklists covering every answered field, or (None, None)"""
+    answered = {field_key(chave) for chave in respostas}
+    candidatos = [(checklist_id, campos) for checklist_id, campos in checklists
+                  if answered <= {field_key(campo) for campo in campos}]
+    return candidatos[0] if len(candidatos) == 1 else (None, None)
+
+def response_rows(respostas, campos=None):
+    """Return (campo, valor, conforme) per item; with campos, unanswered items are failures"""
+    if campos is None:
+        # Unknown checklist: only the answers themselves are available
+        return [(chave.replace('_', ' '), str(valor), is_conforme(valor)) for chave, valor in respostas.items()]
+    valores = {field_key(chave): valor for chave, valor in respostas.items()}
+    rows = []
+    for campo in campos:
+        valor = valores.get(field_key(campo))
+        rows.append((campo, None if valor is None else str(valor), is_conforme(valor)))
+    return rows
+
+def record_responses(relatorio, checklist=None):
+    """Replace a report's response rows from its checklist_data; the caller commits"""
+    respostas = relatorio.checklist_data
+    if checklist is None and relatorio.id and respostas:
+        # Editing without picking a checklist again keeps the previous one
+        previous_id = db.session.execute(select(RespostaChecklist.checklist_id).where(
+            RespostaChecklist.relatorio_id == relatorio.id,
+            RespostaChecklist.checklist_id.isnot(None)
+        ).limit(1)).scalar()
+        checklist = db.session.get(Checklist, previous_id) if previous_id else None
+
+    if checklist is not None:
+        checklist_id, campos = checklist.id, checklist.campos
+    elif respostas:
+        checklist_id, campos = infer_checklist(respostas, [(c.id, c.campos) for c in Checklist.query.all()])
+    else:
+        checklist_id, campos = None, None
+
+    data = relatorio.data or datetime.utcnow().date()
+    relatorio.respostas = [
+        RespostaChecklist(checklist_id=checklist_id, campo=campo, valor=valor, conforme=conforme,
+                          obra_id=relatorio.obra_id, usuario_id=relatorio.usuario_id, data=data)
+        for campo, valor, conforme in (response_rows(respostas, campos) if respostas else [])
+    ]
+
+# Compliance analytics: pass/fail counts per checklist item, optionally split
+# by obra, report author, obra responsible and month, computed by one
+# GROUP BY over respostas_checklist.
+
+GROUPINGS = ('obra', 'usuario', 'responsavel', 'mes')
+
+def _month(column):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+def compliance_rates(agrupar=(), obra_id=None, usuario_id=None, responsavel_id=None,
+                     checklist_id=None, campo=None, inicio=None, fim=None):
+    """Return one dict per item and group with total, conformes, nao_conformes and taxa_conformidade"""
+    colunas = {
+        'obra': RespostaChecklist.obra_id.label('obra_id'),
+        'usuario': RespostaChecklist.usuario_id.label('usuario_id'),
+        'responsavel': Obra.responsavel_id.label('responsavel_id'),
+        'mes': _month(RespostaChecklist.data).label('mes'),
+    }
+    grupos = [RespostaChecklist.campo.label('campo')] + [colunas[nome] for nome in agrupar]
+    conformes = func.sum(case((RespostaChecklist.conforme == True, 1), else_=0))
+
+    stmt = select(*grupos, func.count().label('total'), conformes.label('conformes'))
+    if 'responsavel' in agrupar or responsavel_id is not None:
+        stmt = stmt.join(Obra, Obra.id == RespostaChecklist.obra_id)
+
+    filtros = [
+        (obra_id, RespostaChecklist.obra_id),
+        (usuario_id, RespostaChecklist.usuario_id),
+        (responsavel_id, Obra.responsavel_id),
+        (checklist_id, RespostaChecklist.checklist_id),
+        (campo, RespostaChecklist.campo),
+    ]
+    for valor, coluna in filtros:
+        if valor is not None:
+            stmt = stmt.where(coluna == valor)
+    if inicio:
+        stmt = stmt.where(RespostaChecklist.data >= inicio)
+    if fim:
+        stmt = stmt.where(RespostaChecklist.data <= fim)
+
+    stmt = stmt.group_by(*grupos).order_by(*grupos)
+    resultados = []
+    for row in db.session.execute(stmt):
+        item = dict(row._mapping)
+        item['conformes'] = int(item['conformes'] or 0)
+        item['nao_conformes'] = item['total'] - item['conformes']
+        item['taxa_conformidade'] = round(item['conformes'] / item['total'], 4) if item['total'] else None
+        resultados.append(item)
+    return resultados
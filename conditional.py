@@ -0,0 +1,173 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect, select, text
+
+from models import db, Contador, User, Obra, Relatorio, Checklist, Contato, Foto, HistoricoAprovacao
+
+# Cheap validators for conditional GETs. Each list page depends on a few
+# tables, and every commit that touches one of them bumps its 'versao_*' row
+# in contadores. Flushes only note the tables they touched; the bump is the
+# last statement of the writer's transaction, run from before_commit, so
+# the version moves atomically with the change while writers hold those few
+# rows only for the commit itself rather than for their whole transaction.
+# Reports and checklists carry data_atualizacao, and changes to a report's
+# photos or approval history touch it too. A request whose If-None-Match
+# still matches gets its 304 after one primary-key lookup, before the
+# page's own queries or template rendering run.
+
+# Table a model's rows belong to, for the list versions
+VERSIONED = {
+    User: 'usuarios',
+    Obra: 'obras',
+    Relatorio: 'relatorios',
+    Foto: 'relatorios',
+    HistoricoAprovacao: 'relatorios',
+    Contato: 'contatos',
+    Checklist: 'checklists',
+}
+
+# Children shown by /api/reports/<id>, which touch their report
+REPORT_CHILDREN = (Foto, HistoricoAprovacao)
+
+# Maintained by the hook below and never rendered
+IGNORED_FIELDS = {
+    Relatorio: {'data_atualizacao'},
+}
+
+def version_key(tabela):
+    return f'versao_{tabela}'
+
+def _changed(obj):
+    state = inspect(obj)
+    ignored = IGNORED_FIELDS.get(type(obj), ())
+    return any(attr.key not in ignored and attr.history.has_changes() for attr in state.attrs)
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_versions(session, flush_context):
+    tabelas, relatorio_ids = set(), set()
+    dirty = [obj for obj in session.dirty if type(obj) in VERSIONED and _changed(obj)]
+    for obj in list(session.new) + list(session.deleted) + dirty:
+        tabela = VERSIONED.get(type(obj))
+        if tabela is None:
+            continue
+        tabelas.add(tabela)
+        if isinstance(obj, REPORT_CHILDREN):
+            relatorio_ids.add(obj.relatorio_id)
+
+    if not tabelas:
+        return
+    session.info.setdefault('tabelas_alteradas', set()).update(tabelas)
+    relatorio_ids.discard(None)
+    if relatorio_ids:
+        agora = datetime.utcnow()
+        session.connection().execute(
+            text("UPDATE relatorios SET data_atualizacao = :agora WHERE id = :id"),
+            [{'agora': agora, 'id': i} for i in sorted(relatorio_ids)])
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_before_commit(session):
+    # A savepoint's changes are bumped when the enclosing transaction commits
+    if session.in_nested_transaction():
+        return
+    session.flush()
+    tabelas = session.info.pop('tabelas_alteradas', None)
+    if tabelas:
+        bump_versions(session.connection(), tabelas)
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_pending(session, transaction):
+    # after_rollback also fires for savepoints, whose enclosing transaction may still commit
+    if transaction.parent is None:
+        session.info.pop('tabelas_alteradas', None)
+
+def bump_versions(conn, tabelas, agora=None):
+    """Mark tables as changed; for writes that bypass the session, such as bulk inserts"""
+    # Upsert, so a missing row starts counting instead of staying at 0
+    conn.execute(text(
+        "INSERT INTO contadores (chave, valor, data_atualizacao) VALUES (:chave, 1, :agora) "
+        "ON CONFLICT (chave) DO UPDATE SET valor = contadores.valor + 1, "
+        "data_atualizacao = excluded.data_atualizacao"
+    ), [{'chave': version_key(tabela), 'agora': agora or datetime.utcnow()} for tabela in sorted(tabelas)])
+
+def table_versions(*tabelas):
+    """Return ({tabela: versao}, last change) for the given tables"""
+    chaves = {version_key(tabela): tabela for tabela in tabelas}
+    rows = db.session.execute(select(Contador.chave, Contador.valor, Contador.data_atualizacao)
+                              .where(Contador.chave.in_(chaves))).all()
+    versoes = dict.fromkeys(tabelas, 0)
+    for chave, valor, _ in rows:
+        versoes[chaves[chave]] = valor
+    return versoes, max((row.data_atualizacao for row in rows if row.data_atualizacao), default=None)
+
+_release = None
+
+def release():
+    """Identify the deployed templates and code, so a deploy changes every ETag"""
+    global _release
+    if _release is None:
+        root = current_app.root_path
+        mtimes = [os.path.getmtime(os.path.join(folder, nome))
+                  for folder in (root, os.path.join(root, 'templates'))
+                  for nome in os.listdir(folder) if nome.endswith(('.py', '.html'))]
+        _release = os.environ.get('RELEASE_ID') or str(int(max(mtimes, default=0)))
+    return _release
+
+def validators(chave, atualizado_em=None, tabelas=()):
+    """Return (etag, last_modified) for a response built from chave's state and tables
+
+    The ETag includes the user, since pages and permissions depend on who asks.
+    """
+    versoes, alterado_em = table_versions(*tabelas) if tabelas else ({}, None)
+    partes = [release(), chave, current_user.get_id(), current_user.role, atualizado_em]
+    partes += [f'{tabela}:{versoes[tabela]}' for tabela in sorted(versoes)]
+    etag = hashlib.sha1('|'.join(map(str, partes)).encode()).hexdigest()[:24]
+    datas = [data for data in (atualizado_em, alterado_em) if data]
+    return etag, max(datas) if datas else None
+
+def _utc(value):
+    return value.replace(microsecond=0, tzinfo=timezone.utc)
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request's validators still match, else None"""
+    if request.if_none_match:
+        # If-Modified-Since is ignored when If-None-Match is present
+        matches = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        matches = _utc(last_modified) <= request.if_modified_since
+    else:
+        matches = False
+    if not matches:
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _utc(last_modified)
+    # Cached copies must be revalidated, and only by this user's browser
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def conditional(*tabelas):
+    """Answer GETs of a page built from tabelas with 304 while none of them changed"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Pending flash messages are rendered once, so the page must be rebuilt
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            etag, last_modified = validators(request.full_path, tabelas=tabelas)
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                set_validators(response, etag, last_modified)
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,55 @@
+from sqlalchemy import func, select, update
+
+from models import db, User, Obra, Relatorio, Checklist, Contador
+
+# Aggregate counters kept in the contadores table. Write paths adjust them
+# in the same transaction as the change they count, so every gunicorn
+# worker reads the same committed value with a primary-key lookup instead
+# of a COUNT(*) over the whole table. Migration 18 creates every row, so an
+# increment never has to create one.
+
+def _count(model, *criteria):
+    return lambda: db.session.execute(select(func.count()).select_from(model).where(*criteria)).scalar()
+
+COUNTERS = {
+    'usuarios': _count(User),
+    'obras': _count(Obra),
+    'checklists': _count(Checklist),
+    'relatorios': _count(Relatorio),
+    'relatorios_pendente': _count(Relatorio, Relatorio.status == 'pendente'),
+    'relatorios_aprovado': _count(Relatorio, Relatorio.status == 'aprovado'),
+    'relatorios_reprovado': _count(Relatorio, Relatorio.status == 'reprovado'),
+}
+
+def increment(chave, delta=1):
+    """Adjust a counter inside the caller's transaction"""
+    db.session.execute(update(Contador).where(Contador.chave == chave).values(valor=Contador.valor + delta))
+
+def status_changed(old_status, new_status):
+    """Move one report between the per-status counters"""
+    if old_status == new_status:
+        return
+    if old_status:
+        increment(f'relatorios_{old_status}', -1)
+    if new_status:
+        increment(f'relatorios_{new_status}', 1)
+
+def get_counters(*chaves):
+    """Return {chave: valor} for the requested counters"""
+    rows = dict(db.session.execute(
+        select(Contador.chave, Contador.valor).where(Contador.chave.in_(chaves))).all())
+    for chave in chaves:
+        if chave not in rows:
+            # Only if a row was deleted; 'flask rebuild-counters' restores it
+            rows[chave] = COUNTERS[chave]()
+    return rows
+
+def rebuild():
+    """Recompute every counter from the source tables"""
+    for chave, compute in COUNTERS.items():
+        contador = db.session.get(Contador, chave)
+        if contador is None:
+            db.session.add(Contador(chave=chave, valor=compute()))
+        else:
+            contador.valor = compute()
+    db.session.commit()
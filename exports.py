@@ -0,0 +1,104 @@
+import zipfile
+from collections import deque
+
+from flask import current_app
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import Relatorio, Foto
+import pdf_cache
+import pdf_jobs
+import workers
+
+# Bulk export of an obra's report PDFs as a ZIP streamed to the client.
+# Reports are loaded in chunks, missing PDFs are rendered by the PDF pool
+# with a bounded number in flight, and each finished file is copied into
+# the archive in small pieces, so memory does not grow with report count.
+
+CHUNK_SIZE = 64 * 1024
+LOAD_BATCH = 50
+
+class _ZipStream:
+    """Write-only sink collecting the bytes zipfile produces"""
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_query(obra_id, status=None, data_inicio=None, data_fim=None):
+    query = Relatorio.query.filter(Relatorio.obra_id == obra_id)
+    if status:
+        query = query.filter(Relatorio.status == status)
+    if data_inicio:
+        query = query.filter(Relatorio.data >= data_inicio)
+    if data_fim:
+        query = query.filter(Relatorio.data <= data_fim)
+    return query
+
+def _iter_reports(relatorio_ids):
+    for start in range(0, len(relatorio_ids), LOAD_BATCH):
+        batch = Relatorio.query.options(
+            joinedload(Relatorio.obra),
+            joinedload(Relatorio.usuario),
+            joinedload(Relatorio.aprovador),
+            selectinload(Relatorio.fotos).selectinload(Foto.derivados),
+        ).filter(Relatorio.id.in_(relatorio_ids[start:start + LOAD_BATCH])).order_by(
+            Relatorio.numero_seq, Relatorio.id).all()
+        yield from batch
+
+def generate_zip(query):
+    """Yield the bytes of a ZIP holding one PDF per report matched by query"""
+    relatorio_ids = [relatorio_id for (relatorio_id,) in
+                     query.with_entities(Relatorio.id).order_by(Relatorio.numero_seq, Relatorio.id)]
+    window = current_app.config['PDF_WORKERS'] * 2
+    pending = deque()
+    erros = []
+    sink = _ZipStream()
+    
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        def write_entry(entry_name, result):
+            try:
+                cache_name = result if isinstance(result, str) else result.result()
+            except Exception as e:
+                current_app.logger.error(f"Error rendering {entry_name} for export: {str(e)}")
+                cache_name = None
+            if not cache_name:
+                erros.append(entry_name)
+                return
+            with open(pdf_cache.cache_path(cache_name), 'rb') as source, \
+                    archive.open(entry_name, 'w') as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+        
+        for relatorio in _iter_reports(relatorio_ids):
+            entry_name = f"relatorio_{relatorio.numero_seq:03d}_v{relatorio.versao or 1}.pdf"
+            cached = pdf_cache.lookup(relatorio)
+            if cached:
+                pending.append((entry_name, cached))
+            else:
+                future = workers.submit('pdf', current_app.config['PDF_WORKERS'],
+                                        pdf_jobs.render_report, relatorio.id)
+                pending.append((entry_name, future))
+            
+            # Keep at most `window` renders queued ahead of the archive writer
+            while len(pending) > window:
+                yield from write_entry(*pending.popleft())
+        
+        while pending:
+            yield from write_entry(*pending.popleft())
+        
+        if erros:
+            archive.writestr('ERROS.txt', 'Não foi possível gerar:\n' + '\n'.join(erros) + '\n')
+    
+    yield sink.drain()
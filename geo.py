@@ -0,0 +1,192 @@
+import math
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select, text
+
+from conditional import table_versions
+from models import db, Obra, Relatorio
+
+# Server-side geofencing. Obra sites are kept in an in-process 3-d tree over
+# unit-sphere coordinates: the straight-line (chord) distance between two
+# points grows with their great-circle distance, so the tree prunes exactly
+# and nearest/radius lookups visit only a few dozen nodes even with tens of
+# thousands of sites. Each worker builds the tree lazily from the obras
+# table. Every use compares the versao_obras counter, which any committed obra
+# write bumps, with the one the tree was built at, so an obra created or
+# moved through any worker is seen by all of them on their next lookup;
+# GEO_INDEX_TTL bounds the age of a tree regardless.
+
+EARTH_RADIUS = 6371000.0  # meters
+DEFAULT_RADIUS = 100  # meters, same default as geolocation.js
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two GPS fixes"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def _xyz(lat, lon):
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+def _chord(meters):
+    return 2 * math.sin(min(meters, math.pi * EARTH_RADIUS) / (2 * EARTH_RADIUS))
+
+def _meters(chord):
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, chord / 2))
+
+class SiteIndex:
+    """Static 3-d tree of (obra_id, lat, lon) points"""
+
+    def __init__(self, sites, raios=None):
+        self.size = len(sites)
+        self.raios = raios or {}  # obra_id -> raio_geofence, when set
+        self.max_raio = max(self.raios.values(), default=0)
+        self.root = self._build([(_xyz(lat, lon), obra_id) for obra_id, lat, lon in sites], 0)
+
+    def _build(self, items, axis):
+        if not items:
+            return None
+        items.sort(key=lambda item: item[0][axis])
+        mid = len(items) // 2
+        point, obra_id = items[mid]
+        following = (axis + 1) % 3
+        return (point, obra_id, axis, self._build(items[:mid], following), self._build(items[mid + 1:], following))
+
+    def nearest(self, lat, lon, accept=None, max_distance=None):
+        """Return (obra_id, meters) of the closest accepted site, or None"""
+        target = _xyz(lat, lon)
+        best = [_chord(max_distance) if max_distance is not None else 2.0, None]
+
+        def visit(node):
+            if node is None:
+                return
+            point, obra_id, axis, left, right = node
+            d = math.dist(point, target)
+            if d <= best[0] and (accept is None or accept(obra_id)):
+                best[0], best[1] = d, obra_id
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if abs(diff) <= best[0]:
+                visit(far)
+
+        visit(self.root)
+        return (best[1], _meters(best[0])) if best[1] is not None else None
+
+    def within(self, lat, lon, raio, accept=None):
+        """Return [(obra_id, meters)] of accepted sites within raio meters, closest first"""
+        target = _xyz(lat, lon)
+        limit = _chord(raio)
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            point, obra_id, axis, left, right = node
+            d = math.dist(point, target)
+            if d <= limit and (accept is None or accept(obra_id)):
+                found.append((obra_id, _meters(d)))
+            diff = target[axis] - point[axis]
+            if diff - limit <= 0:
+                stack.append(left)
+            if diff + limit >= 0:
+                stack.append(right)
+        found.sort(key=lambda item: item[1])
+        return found
+
+_index = None
+_built_at = 0.0
+_versao = None
+_lock = threading.Lock()
+
+def invalidate():
+    """Drop this worker's site index; call after creating or moving an obra"""
+    global _index
+    _index = None
+
+def _fresh(versao):
+    return _index is not None and _versao == versao and \
+        time.monotonic() - _built_at < current_app.config['GEO_INDEX_TTL']
+
+def site_index():
+    global _index, _built_at, _versao
+    # Read before the rows, so a tree built from newer rows is only rebuilt once more
+    versao = table_versions('obras')[0]['obras']
+    if _fresh(versao):
+        return _index
+    with _lock:
+        if not _fresh(versao):
+            rows = db.session.execute(select(
+                Obra.id, Obra.latitude_obra, Obra.longitude_obra, Obra.raio_geofence
+            ).where(Obra.latitude_obra.isnot(None), Obra.longitude_obra.isnot(None))).all()
+            _index = SiteIndex([row[:3] for row in rows],
+                               {row.id: row.raio_geofence for row in rows if row.raio_geofence})
+            _built_at, _versao = time.monotonic(), versao
+        return _index
+
+def nearest_obra(lat, lon, obra_ids=None, max_distance=None):
+    """Return (obra_id, meters) of the closest obra, optionally among obra_ids"""
+    accept = obra_ids.__contains__ if obra_ids is not None else None
+    return site_index().nearest(lat, lon, accept=accept, max_distance=max_distance)
+
+def obras_within(lat, lon, raio, obra_ids=None):
+    """Return [(obra_id, meters)] of obras within raio meters, closest first"""
+    accept = obra_ids.__contains__ if obra_ids is not None else None
+    return site_index().within(lat, lon, raio, accept=accept)
+
+def locate_obra(lat, lon, obra_ids=None):
+    """Return (obra_id, meters) of the closest obra whose geofence contains the fix, or None"""
+    index = site_index()
+    # The closest site may have a smaller fence than a farther one, so every
+    # site within the largest radius in use is a candidate
+    for obra_id, meters in obras_within(lat, lon, max(index.max_raio, geofence_radius(None)), obra_ids):
+        if meters <= geofence_radius(index.raios.get(obra_id)):
+            return obra_id, meters
+    return None
+
+def geofence_radius(raio_geofence):
+    return raio_geofence or current_app.config.get('GEOFENCE_RADIUS', DEFAULT_RADIUS)
+
+def fence_status(latitude, longitude, obra_latitude, obra_longitude, raio_geofence):
+    """Return (meters to the site, outside the geofence) or (None, None) without coordinates"""
+    if None in (latitude, longitude, obra_latitude, obra_longitude):
+        return None, None
+    distancia = round(distance_m(latitude, longitude, obra_latitude, obra_longitude), 1)
+    return distancia, distancia > geofence_radius(raio_geofence)
+
+def check_report(relatorio, obra):
+    """Set the report's distance to its obra and whether it was filed outside the geofence"""
+    relatorio.distancia_obra, relatorio.fora_da_cerca = fence_status(
+        relatorio.latitude, relatorio.longitude, obra.latitude_obra, obra.longitude_obra, obra.raio_geofence)
+
+def refresh_fence_status(conn, obra_id=None, batch_size=1000):
+    """Recompute distancia_obra and fora_da_cerca of reports with coordinates, of one obra or all"""
+    ultimo_id = 0
+    while True:
+        stmt = select(
+            Relatorio.id, Relatorio.latitude, Relatorio.longitude,
+            Obra.latitude_obra, Obra.longitude_obra, Obra.raio_geofence
+        ).join(Obra, Obra.id == Relatorio.obra_id).where(
+            Relatorio.id > ultimo_id, Relatorio.latitude.isnot(None), Relatorio.longitude.isnot(None)
+        ).order_by(Relatorio.id).limit(batch_size)
+        if obra_id is not None:
+            stmt = stmt.where(Relatorio.obra_id == obra_id)
+        rows = conn.execute(stmt).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            distancia, fora = fence_status(row.latitude, row.longitude, row.latitude_obra,
+                                           row.longitude_obra, row.raio_geofence)
+            updates.append({'id': row.id, 'distancia': distancia, 'fora': fora})
+        if updates:
+            conn.execute(text(
+                "UPDATE relatorios SET distancia_obra = :distancia, fora_da_cerca = :fora WHERE id = :id"
+            ), updates)
+        ultimo_id = rows[-1].id
@@ -0,0 +1,87 @@
+import os
+
+from flask import current_app
+
+from models import db, Foto, FotoDerivado
+import metrics
+import workers
+
+# Derivatives written for every photo, largest first: each one is resized
+# from the previous, so the full-size original is decoded only once.
+VARIANTS = [
+    # (variante, max size, PIL format, extension)
+    ('tela', (1920, 1080), 'JPEG', 'jpg'),
+    ('webp', (1920, 1080), 'WEBP', 'webp'),
+    ('pdf', (1200, 900), 'JPEG', 'jpg'),  # 4x3 in at 300 dpi
+    ('miniatura', (320, 320), 'JPEG', 'jpg'),
+]
+
+def queue_photo(foto):
+    """Schedule derivative generation for a committed Foto"""
+    try:
+        workers.submit('images', current_app.config['IMAGE_WORKERS'], process_photo, foto.id)
+    except Exception as e:
+        current_app.logger.error(f"Error queueing photo {foto.id}: {str(e)}")
+
+def process_photo(foto_id):
+    """Write every derivative of a photo; runs inside a pool process"""
+    from app import app
+    from PIL import Image, ImageOps
+    
+    with app.app_context():
+        foto = db.session.get(Foto, foto_id)
+        if foto is None:
+            return
+        
+        upload_folder = app.config['UPLOAD_FOLDER']
+        base = os.path.splitext(foto.caminho_arquivo)[0]
+        
+        # Photos sharing a stored blob share its derivatives
+        existing = FotoDerivado.query.join(Foto).filter(
+            Foto.caminho_arquivo == foto.caminho_arquivo,
+            Foto.id != foto.id
+        ).all()
+        shared = {}
+        for derivado in existing:
+            if os.path.exists(os.path.join(upload_folder, derivado.caminho_arquivo)):
+                shared[derivado.variante] = derivado
+        if len(shared) == len(VARIANTS):
+            foto.derivados = [
+                FotoDerivado(variante=d.variante, caminho_arquivo=d.caminho_arquivo,
+                             largura=d.largura, altura=d.altura, tamanho=d.tamanho)
+                for d in shared.values()
+            ]
+            foto.status_processamento = 'concluido'
+            db.session.commit()
+            return
+        
+        derivados = []
+        try:
+            with metrics.timer('elp_image_processing_seconds'), \
+                    Image.open(os.path.join(upload_folder, foto.caminho_arquivo)) as original:
+                # Let the JPEG decoder downscale while reading large camera files
+                original.draft('RGB', VARIANTS[0][1])
+                img = ImageOps.exif_transpose(original)
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                
+                for variante, size, image_format, extension in VARIANTS:
+                    img = img.copy()
+                    img.thumbnail(size, Image.Resampling.LANCZOS)
+                    filename = f"{base}_{variante}.{extension}"
+                    filepath = os.path.join(upload_folder, filename)
+                    img.save(filepath, image_format, quality=85)
+                    derivados.append(FotoDerivado(
+                        variante=variante,
+                        caminho_arquivo=filename,
+                        largura=img.width,
+                        altura=img.height,
+                        tamanho=os.path.getsize(filepath)
+                    ))
+            
+            foto.derivados = derivados
+            foto.status_processamento = 'concluido'
+        except Exception as e:
+            app.logger.error(f"Error processing photo {foto.caminho_arquivo}: {str(e)}")
+            foto.status_processamento = 'erro'
+        db.session.commit()
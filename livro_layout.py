@@ -0,0 +1,302 @@
+import gc
+import math
+import os
+import tempfile
+from datetime import datetime
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from flask import current_app
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, Obra, Relatorio, Foto, RespostaChecklist
+from livro_obra import approved_reports
+from pdf_concat import PdfConcat
+import pdf_renderer  # sets ReportLab to write binary streams
+
+# Layout of the livro de obra. ReportLab keeps a document's pages and images
+# in memory until it is saved, so the book is never laid out as one
+# document. Reports are loaded LIVRO_SECTION_REPORTS at a time, each batch is
+# rendered to its own temporary PDF and dropped from the session, and the
+# sections are then concatenated from disk. Pages are numbered for their
+# final position: the table of contents has a fixed number of rows per page,
+# so its length is known from the report count before any section is
+# rendered, and it is laid out last, once every report's page is known.
+
+TOC_ROWS = 40
+PHOTO_MAX = (4 * inch, 3 * inch)
+# Originals without a 'pdf' derivative yet are reduced to its size
+FALLBACK_SIZE = (1200, 900)
+
+def _styles():
+    styles = getSampleStyleSheet()
+    return {
+        'capa': ParagraphStyle('LivroCapa', parent=styles['Title'], fontSize=26, spaceAfter=24),
+        'titulo': ParagraphStyle('LivroTitulo', parent=styles['Heading1'], fontSize=16, spaceAfter=12),
+        'secao': styles['Heading3'],
+        'normal': styles['Normal'],
+        'legenda': ParagraphStyle('LivroLegenda', parent=styles['Normal'], fontSize=8,
+                                  textColor=colors.grey, alignment=1),
+    }
+
+TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+INFO_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+])
+
+def _text(value):
+    return escape(str(value)) if value else ''
+
+def _fit(largura, altura):
+    escala = min(PHOTO_MAX[0] / largura, PHOTO_MAX[1] / altura)
+    return largura * escala, altura * escala
+
+def _photo(foto, upload_folder):
+    """Flowable of a photo from its downsampled derivative, or None if the file is missing"""
+    from PIL import Image as PILImage
+
+    derivado = next((d for d in foto.derivados if d.variante == 'pdf'), None)
+    if derivado is not None:
+        path = os.path.join(upload_folder, derivado.caminho_arquivo)
+        if os.path.exists(path):
+            if derivado.largura and derivado.altura:
+                tamanho = (derivado.largura, derivado.altura)
+            else:
+                with PILImage.open(path) as img:
+                    tamanho = img.size
+            return Image(path, *_fit(*tamanho))
+
+    path = os.path.join(upload_folder, foto.caminho_arquivo)
+    if not os.path.exists(path):
+        return None
+    # Not processed yet: never embed a full-resolution original
+    with PILImage.open(path) as img:
+        img.draft('RGB', FALLBACK_SIZE)
+        reduzida = img.convert('RGB')
+    reduzida.thumbnail(FALLBACK_SIZE)
+    buffer = BytesIO()
+    reduzida.save(buffer, 'JPEG', quality=80)
+    buffer.seek(0)
+    return Image(buffer, *_fit(*reduzida.size))
+
+def _report_story(relatorio, estilos, upload_folder):
+    titulo = Paragraph(f"{_text(relatorio.codigo_relatorio)} — Relatório #{relatorio.numero_seq:03d}",
+                       estilos['titulo'])
+    data = relatorio.data.strftime('%d/%m/%Y') if relatorio.data else ''
+    # Picked up by the section template to record the report's page
+    titulo.entrada_sumario = (relatorio.codigo_relatorio, data, relatorio.usuario.nome)
+    story = [titulo]
+
+    info = [['Data:', data], ['Responsável:', relatorio.usuario.nome]]
+    if relatorio.aprovador:
+        aprovado_em = relatorio.data_aprovacao.strftime('%d/%m/%Y %H:%M') if relatorio.data_aprovacao else ''
+        info.append(['Aprovado por:', f"{relatorio.aprovador.nome} {aprovado_em}".strip()])
+    if relatorio.latitude is not None and relatorio.longitude is not None:
+        info.append(['Localização:', f"{relatorio.latitude:.6f}, {relatorio.longitude:.6f}"])
+    tabela = Table(info, colWidths=[1.5 * inch, 4.5 * inch])
+    tabela.setStyle(INFO_STYLE)
+    story += [tabela, Spacer(1, 10)]
+
+    if relatorio.atividades:
+        story.append(Paragraph("Atividades Realizadas", estilos['secao']))
+        story.append(Paragraph(_text(relatorio.atividades).replace('\n', '<br/>'), estilos['normal']))
+        story.append(Spacer(1, 10))
+
+    if relatorio.respostas:
+        conformes = sum(1 for resposta in relatorio.respostas if resposta.conforme)
+        story.append(Paragraph(f"Checklist — {conformes} de {len(relatorio.respostas)} itens conformes",
+                               estilos['secao']))
+        linhas = [['Item', 'Resposta', 'Situação']] + [
+            [Paragraph(_text(resposta.campo), estilos['normal']), resposta.valor or '—',
+             'Conforme' if resposta.conforme else 'Não conforme']
+            for resposta in sorted(relatorio.respostas, key=lambda r: r.id)
+        ]
+        tabela = Table(linhas, colWidths=[3.6 * inch, 1.2 * inch, 1.2 * inch], repeatRows=1)
+        tabela.setStyle(TABLE_STYLE)
+        story += [tabela, Spacer(1, 10)]
+    elif relatorio.checklist_data:
+        story.append(Paragraph("Checklist", estilos['secao']))
+        linhas = [['Item', 'Resposta']] + [[chave.replace('_', ' ').title(), str(valor)]
+                                           for chave, valor in relatorio.checklist_data.items()]
+        tabela = Table(linhas, colWidths=[4 * inch, 2 * inch], repeatRows=1)
+        tabela.setStyle(TABLE_STYLE)
+        story += [tabela, Spacer(1, 10)]
+
+    if relatorio.fotos:
+        story.append(Paragraph("Fotos", estilos['secao']))
+        for foto in sorted(relatorio.fotos, key=lambda f: f.id):
+            try:
+                imagem = _photo(foto, upload_folder)
+            except Exception as e:
+                current_app.logger.error(f"Error loading photo {foto.id} for livro: {str(e)}")
+                imagem = None
+            legenda = ' — '.join(filter(None, [_text(foto.tipo_servico), _text(foto.descricao)]))
+            if imagem is None:
+                story.append(Paragraph(f"{legenda} (arquivo não encontrado)", estilos['legenda']))
+                continue
+            imagem.hAlign = 'CENTER'
+            story += [imagem, Paragraph(legenda, estilos['legenda']), Spacer(1, 8)]
+    return story
+
+class _Section(SimpleDocTemplate):
+    """One temporary PDF of the book, numbered from its final first page"""
+
+    def __init__(self, path, titulo, primeira):
+        super().__init__(path, pagesize=A4, title=titulo)
+        self.titulo = titulo
+        self.primeira = primeira
+        self.entradas = []
+
+    def afterFlowable(self, flowable):
+        entrada = getattr(flowable, 'entrada_sumario', None)
+        if entrada is not None:
+            self.entradas.append(entrada + (self.numero(),))
+
+    def numero(self):
+        return self.primeira + self.page - 1
+
+    def rodape(self, canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 8)
+        canvas.setFillColor(colors.grey)
+        canvas.drawString(doc.leftMargin, 0.5 * inch, self.titulo)
+        canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, 0.5 * inch, f"Página {self.numero()}")
+        canvas.restoreState()
+
+def _render(path, story, titulo, primeira):
+    """Lay out story at path; return (pages, table of contents entries)"""
+    doc = _Section(path, titulo, primeira)
+    doc.build(story, onFirstPage=doc.rodape, onLaterPages=doc.rodape)
+    return doc.page, doc.entradas
+
+def _load(relatorio_ids):
+    return Relatorio.query.options(
+        joinedload(Relatorio.usuario),
+        joinedload(Relatorio.aprovador),
+        selectinload(Relatorio.respostas),
+        selectinload(Relatorio.fotos).selectinload(Foto.derivados),
+    ).filter(Relatorio.id.in_(relatorio_ids)).order_by(
+        Relatorio.data, Relatorio.numero_seq, Relatorio.id).all()
+
+def _summary_story(obra_id, estilos):
+    """Appendix: conformity per checklist item over the approved reports"""
+    conformes = func.sum(case((RespostaChecklist.conforme == True, 1), else_=0))
+    rows = db.session.execute(select(
+        RespostaChecklist.campo, func.count(), conformes
+    ).join(Relatorio, Relatorio.id == RespostaChecklist.relatorio_id).where(
+        Relatorio.obra_id == obra_id, Relatorio.status == 'aprovado'
+    ).group_by(RespostaChecklist.campo).order_by(RespostaChecklist.campo)).all()
+
+    titulo = Paragraph("Resumo do Checklist", estilos['titulo'])
+    titulo.entrada_sumario = ('Resumo do checklist', '', '')
+    if not rows:
+        return [titulo, Paragraph("Nenhuma resposta de checklist registrada.", estilos['normal'])]
+    linhas = [['Item', 'Respostas', 'Conformes', 'Não conformes', 'Conformidade']]
+    for campo, total, ok in rows:
+        ok = int(ok or 0)
+        linhas.append([Paragraph(_text(campo), estilos['normal']), total, ok, total - ok,
+                       f"{100 * ok / total:.1f}%" if total else '—'])
+    tabela = Table(linhas, colWidths=[2.6 * inch, 0.8 * inch, 0.8 * inch, 1 * inch, 1 * inch], repeatRows=1)
+    tabela.setStyle(TABLE_STYLE)
+    return [titulo, tabela]
+
+def _front_story(capa, entradas, toc_paginas, estilos):
+    story = [Spacer(1, 2 * inch), Paragraph("Livro de Obra", estilos['capa']),
+             Paragraph(_text(capa['nome']), estilos['titulo'])]
+    info = [['Tipo:', capa['tipo'] or ''], ['Endereço:', Paragraph(_text(capa['endereco']), estilos['normal'])],
+            ['Responsável:', capa['responsavel']], ['Período:', capa['periodo']],
+            ['Relatórios aprovados:', str(capa['total'])],
+            ['Gerado em:', datetime.now().strftime('%d/%m/%Y %H:%M')]]
+    tabela = Table(info, colWidths=[1.8 * inch, 4.2 * inch])
+    tabela.setStyle(INFO_STYLE)
+    story += [Spacer(1, 24), tabela]
+
+    # Exactly toc_paginas pages, as the sections were numbered for
+    for pagina in range(toc_paginas):
+        story += [PageBreak(), Paragraph("Sumário", estilos['titulo'])]
+        linhas = [[codigo, data, usuario[:45], str(numero)]
+                  for codigo, data, usuario, numero in entradas[pagina * TOC_ROWS:(pagina + 1) * TOC_ROWS]]
+        if linhas:
+            tabela = Table([['Relatório', 'Data', 'Responsável', 'Página']] + linhas,
+                           colWidths=[1.6 * inch, 0.9 * inch, 2.8 * inch, 0.7 * inch])
+            tabela.setStyle(TableStyle(TABLE_STYLE.getCommands() + [
+                ('FONTSIZE', (0, 0), (-1, -1), 8),
+                ('TOPPADDING', (0, 0), (-1, -1), 1),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+                ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
+            ]))
+            story.append(tabela)
+    return story
+
+def build_livro(obra_id, destino):
+    """Write the obra's book to destino; return (reports, pages)"""
+    obra = db.session.get(Obra, obra_id)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    lote = current_app.config['LIVRO_SECTION_REPORTS']
+    titulo = f"Livro de Obra — {obra.nome}"
+
+    ordem = (Relatorio.data, Relatorio.numero_seq, Relatorio.id)
+    relatorio_ids = [relatorio_id for (relatorio_id,) in
+                     approved_reports(obra_id).with_entities(Relatorio.id).order_by(*ordem)]
+    datas = approved_reports(obra_id).with_entities(func.min(Relatorio.data), func.max(Relatorio.data)).one()
+    capa = {
+        'nome': obra.nome, 'tipo': obra.tipo, 'endereco': obra.endereco, 'total': len(relatorio_ids),
+        'responsavel': obra.responsavel.nome if obra.responsavel else '',
+        'periodo': ' a '.join(d.strftime('%d/%m/%Y') for d in datas if d) if all(datas) else '',
+    }
+    # One row per report plus the appendix
+    toc_paginas = max(1, math.ceil((len(relatorio_ids) + 1) / TOC_ROWS))
+    estilos = _styles()
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(destino)) as pasta:
+        secoes, entradas = [], []
+        pagina = 2 + toc_paginas
+        for inicio in range(0, len(relatorio_ids), lote):
+            story = []
+            for relatorio in _load(relatorio_ids[inicio:inicio + lote]):
+                if story:
+                    story.append(PageBreak())
+                story += _report_story(relatorio, estilos, upload_folder)
+            path = os.path.join(pasta, f"secao_{len(secoes):05d}.pdf")
+            paginas, novas = _render(path, story, titulo, pagina)
+            secoes.append(path)
+            entradas += novas
+            pagina += paginas
+            # Nothing from this batch is needed again; ReportLab's document
+            # objects are cyclic, so collect them now rather than letting
+            # several sections' worth pile up before the next GC pass
+            db.session.expunge_all()
+            gc.collect()
+
+        path = os.path.join(pasta, 'resumo.pdf')
+        paginas, novas = _render(path, _summary_story(obra_id, estilos), titulo, pagina)
+        secoes.append(path)
+        entradas += novas
+
+        frente = os.path.join(pasta, 'capa.pdf')
+        paginas, _ = _render(frente, _front_story(capa, entradas, toc_paginas, estilos), titulo, 1)
+        if paginas != 1 + toc_paginas:
+            raise RuntimeError(f"Sumário ocupou {paginas - 1} páginas, esperado {toc_paginas}")
+
+        livro = PdfConcat(destino, title=titulo)
+        for path in [frente] + secoes:
+            livro.append(path)
+            os.remove(path)
+        return len(relatorio_ids), livro.close()
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, LivroJob, Relatorio
+from conditional import table_versions
+from pdf_jobs import ACTIVE_STATUSES, PdfQueueFull
+import metrics
+import pdf_cache
+import workers
+
+# The "livro de obra": every approved report of an obra in one PDF, in date
+# order, behind a cover and a table of contents and followed by a checklist
+# summary. Books are cached by a key over everything they show and built by
+# a job in a pool of their own. The layout lives in livro_layout, imported
+# on first render, so web workers that only look up or queue books never
+# load ReportLab.
+
+# Bump when the layout changes so cached books are rebuilt
+LIVRO_VERSION = 1
+
+def approved_reports(obra_id):
+    return Relatorio.query.filter(Relatorio.obra_id == obra_id, Relatorio.status == 'aprovado')
+
+def livro_key(obra):
+    """Key derived from everything the book shows; a cheap aggregate, no report is loaded"""
+    total, soma, ultimo, atualizado = db.session.execute(select(
+        func.count(Relatorio.id), func.sum(Relatorio.id), func.max(Relatorio.id),
+        func.max(Relatorio.data_atualizacao)
+    ).where(Relatorio.obra_id == obra.id, Relatorio.status == 'aprovado')).one()
+    versoes, _ = table_versions('usuarios', 'checklists')
+    payload = {
+        'render': LIVRO_VERSION,
+        'obra': [obra.id, obra.nome, obra.tipo, obra.endereco, obra.responsavel_id,
+                 obra.data_inicio, obra.data_fim],
+        'relatorios': [total, soma, ultimo, atualizado],
+        'versoes': versoes,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(b'livro:' + encoded).hexdigest()
+
+def lookup(obra):
+    """Return the cache entry of the obra's current book, or None"""
+    name = pdf_cache.cache_name(livro_key(obra))
+    return name if os.path.exists(pdf_cache.cache_path(name)) else None
+
+def render_livro(obra):
+    """Build the obra's book into the PDF cache unless already present; return the entry name"""
+    from livro_layout import build_livro
+
+    name = pdf_cache.cache_name(livro_key(obra))
+    path = pdf_cache.cache_path(name)
+    if os.path.exists(path):
+        return name
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with metrics.timer('elp_pdf_render_seconds', tipo='livro'):
+            build_livro(obra.id, tmp_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return name
+
+def render_livro_job(job_id):
+    """Build the book for a job; runs inside a pool process"""
+    from app import app
+    with app.app_context():
+        job = db.session.get(LivroJob, job_id)
+        if job is None:
+            return
+        job.status = 'processando'
+        job.data_inicio = datetime.utcnow()
+        db.session.commit()
+        obra_id = job.obra_id
+
+        try:
+            filename = render_livro(job.obra)
+        except Exception as e:
+            app.logger.error(f"Livro job {job_id} failed: {str(e)}")
+            db.session.rollback()
+            job = db.session.get(LivroJob, job_id)
+            job.status = 'erro'
+            job.erro = 'Falha ao gerar o livro de obra.'
+            job.data_conclusao = datetime.utcnow()
+            db.session.commit()
+            return
+
+        # The session was cleared between sections
+        job = db.session.get(LivroJob, job_id)
+        superados = LivroJob.query.filter(LivroJob.obra_id == obra_id, LivroJob.status == 'concluido',
+                                          LivroJob.arquivo != filename).all()
+        for anterior in superados:
+            pdf_cache.discard(anterior.arquivo)
+            anterior.arquivo = None
+        job.status = 'concluido'
+        job.arquivo = filename
+        job.data_conclusao = datetime.utcnow()
+        db.session.commit()
+
+def enqueue_livro(obra, usuario):
+    """Return an active job for the obra's book or queue a new one"""
+    recent = datetime.utcnow() - timedelta(seconds=current_app.config['LIVRO_JOB_TIMEOUT'])
+    ativos = LivroJob.query.filter(LivroJob.status.in_(ACTIVE_STATUSES), LivroJob.data_criacao >= recent)
+
+    job = ativos.filter(LivroJob.obra_id == obra.id).order_by(LivroJob.id.desc()).first()
+    if job:
+        return job
+    if ativos.count() >= current_app.config['PDF_MAX_QUEUED']:
+        raise PdfQueueFull()
+
+    job = LivroJob(obra_id=obra.id, usuario_id=usuario.id, status='pendente')
+    db.session.add(job)
+    db.session.commit()
+    try:
+        # A pool of its own, so a long book never holds up single-report PDFs
+        workers.submit('livro', 1, render_livro_job, job.id)
+    except Exception as e:
+        job.status = 'erro'
+        job.erro = str(e)
+        db.session.commit()
+    return job
+
+def job_expired(job):
+    """True if an active job has outlived LIVRO_JOB_TIMEOUT (e.g. its worker died)"""
+    timeout = timedelta(seconds=current_app.config['LIVRO_JOB_TIMEOUT'])
+    return job.status in ACTIVE_STATUSES and job.data_criacao < datetime.utcnow() - timeout
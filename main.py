@@ -1,4 +1,8 @@
 from app import app
 
 if __name__ == '__main__':
+    # The development server prepares its own database
+    import bootstrap
+    with app.app_context():
+        bootstrap.run()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,322 @@
+import math
+from collections import defaultdict
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import Integer, bindparam, delete, event, func, inspect, literal_column, or_, select, text, update
+
+from models import db, ClusterMapa, ClusterMapaPendente, Obra, Relatorio
+
+# Map clusters for active obras and report locations. Points are binned into
+# a Web Mercator grid of 64 px cells (4 per 256 px tile) for every zoom up to
+# MAX_CLUSTER_ZOOM, and clusters_mapa keeps the count and coordinate sums
+# of each cell, so a cluster's position is the centroid of its points.
+# Report cells are split by month so "recent" is a sum over a few periods.
+# Every obra and report also stores its cell at MAX_CLUSTER_ZOOM; its cell
+# at a shallower zoom is that one divided by a power of two, which lets the
+# clusters of a user's own obras and reports be grouped in SQL.
+#
+# Writers never touch clusters_mapa, whose low-zoom cells every point
+# shares: an after_flush hook appends each write's +1/-1 to
+# clusters_mapa_pendentes, and once the write commits its connection folds
+# the pending rows into every zoom level in a short transaction of its own,
+# one fold at a time. Reads add the rows still pending, so a fold that
+# failed or was skipped only delays the next one. `flask
+# rebuild-map-clusters` recomputes the table from scratch.
+
+MAX_CLUSTER_ZOOM = 16  # deeper zooms return individual points
+CELLS_PER_TILE = 4
+MAX_LATITUDE = 85.05112878
+MAX_POINTS = 2000
+FOLD_BATCH = 5000
+# Arbitrary key for the Postgres advisory lock held while folding
+FOLD_LOCK_KEY = 720151
+
+OBRAS = 'obras'
+RELATORIOS = 'relatorios'
+LAYERS = (OBRAS, RELATORIOS)
+
+TRACKED_FIELDS = {
+    Relatorio: ('latitude', 'longitude'),
+    Obra: ('latitude_obra', 'longitude_obra', 'status'),
+}
+
+# Position of each layer's rows: (id, label, lat, lon, cell x, cell y)
+COLUMNS = {
+    OBRAS: (Obra.id, Obra.nome, Obra.latitude_obra, Obra.longitude_obra, Obra.celula_x, Obra.celula_y),
+    RELATORIOS: (Relatorio.id, Relatorio.codigo_relatorio, Relatorio.latitude, Relatorio.longitude,
+                 Relatorio.celula_x, Relatorio.celula_y),
+}
+
+def cell(lat, lon, zoom):
+    """Return the (x, y) grid cell of a point at a zoom level"""
+    n = (1 << zoom) * CELLS_PER_TILE
+    phi = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(phi)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def month(value):
+    return value.strftime('%Y-%m') if value else ''
+
+def first_period(meses, today=None):
+    """Oldest 'YYYY-MM' period included when showing the last meses months"""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - (max(meses, 1) - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def _point(obj, value):
+    """Return (layer, period, lat, lon) for what obj contributes to the map, or None"""
+    if isinstance(obj, Relatorio):
+        lat, lon = value('latitude'), value('longitude')
+        if lat is None or lon is None:
+            return None
+        return RELATORIOS, month(value('data_criacao')), lat, lon
+    if isinstance(obj, Obra):
+        lat, lon = value('latitude_obra'), value('longitude_obra')
+        if lat is None or lon is None or value('status') != 'ativa':
+            return None
+        return OBRAS, '', lat, lon
+    return None
+
+def apply(conn, changes):
+    """Add (layer, period, lat, lon, sign) changes to every zoom level"""
+    cells = defaultdict(lambda: [0, 0.0, 0.0])
+    for camada, periodo, lat, lon, sign in changes:
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            x, y = cell(lat, lon, zoom)
+            acc = cells[(camada, zoom, x, y, periodo)]
+            acc[0] += sign
+            acc[1] += sign * lat
+            acc[2] += sign * lon
+    # Sorted, so concurrent folds would lock cells in the same order
+    rows = [{'camada': k[0], 'zoom': k[1], 'x': k[2], 'y': k[3], 'periodo': k[4],
+             'total': v[0], 'soma_lat': v[1], 'soma_lon': v[2]}
+            for k, v in sorted(cells.items()) if any(v)]
+    if not rows:
+        return
+    conn.execute(text(
+        "INSERT INTO clusters_mapa (camada, zoom, x, y, periodo, total, soma_lat, soma_lon) "
+        "VALUES (:camada, :zoom, :x, :y, :periodo, :total, :soma_lat, :soma_lon) "
+        "ON CONFLICT (camada, zoom, x, y, periodo) DO UPDATE SET "
+        "total = clusters_mapa.total + excluded.total, "
+        "soma_lat = clusters_mapa.soma_lat + excluded.soma_lat, "
+        "soma_lon = clusters_mapa.soma_lon + excluded.soma_lon"
+    ), rows)
+    removed = [row for row in rows if row['total'] < 0]
+    if removed:
+        conn.execute(text(
+            "DELETE FROM clusters_mapa WHERE camada = :camada AND zoom = :zoom AND x = :x "
+            "AND y = :y AND periodo = :periodo AND total <= 0"
+        ), removed)
+
+def _old_value(state):
+    def value(attr):
+        history = state.attrs[attr].history
+        if history.deleted:
+            return history.deleted[0]
+        if history.unchanged:
+            return history.unchanged[0]
+        return None
+    return value
+
+def _new_value(obj):
+    return lambda attr: getattr(obj, attr)
+
+@event.listens_for(db.session, 'before_flush')
+def _set_cells(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        fields = TRACKED_FIELDS.get(type(obj), ())[:2]
+        if not fields:
+            continue
+        if obj not in session.new and not any(inspect(obj).attrs[f].history.has_changes() for f in fields):
+            continue
+        lat, lon = (getattr(obj, field) for field in fields)
+        obj.celula_x, obj.celula_y = cell(lat, lon, MAX_CLUSTER_ZOOM) if None not in (lat, lon) else (None, None)
+
+@event.listens_for(db.session, 'after_flush')
+def _queue_changes(session, flush_context):
+    changes = []
+    def add(point, sign):
+        if point:
+            changes.append(point + (sign,))
+
+    for obj in session.new:
+        add(_point(obj, _new_value(obj)), 1)
+    for obj in session.dirty:
+        fields = TRACKED_FIELDS.get(type(obj))
+        if fields is None:
+            continue
+        state = inspect(obj)
+        if any(state.attrs[field].history.has_changes() for field in fields):
+            add(_point(obj, _old_value(state)), -1)
+            add(_point(obj, _new_value(obj)), 1)
+    for obj in session.deleted:
+        add(_point(obj, _old_value(inspect(obj))), -1)
+
+    if changes:
+        conn = session.connection()
+        conn.execute(ClusterMapaPendente.__table__.insert(), [
+            dict(zip(('x', 'y'), cell(lat, lon, MAX_CLUSTER_ZOOM)),
+                 camada=camada, periodo=periodo, latitude=lat, longitude=lon, sinal=sign)
+            for camada, periodo, lat, lon, sign in changes])
+        # Folded on this connection, which is still checked out when after_commit runs
+        session.info['clusters_pendentes'] = conn
+
+@event.listens_for(db.session, 'after_commit')
+def _fold_after_commit(session):
+    conn = session.info.pop('clusters_pendentes', None)
+    if conn is None:
+        return
+    try:
+        with conn.begin():
+            fold(conn)
+    except Exception as e:
+        # The changes stay pending: reads include them and the next fold applies them
+        current_app.logger.error(f"Error folding map clusters: {str(e)}")
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_fold(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('clusters_pendentes', None)
+
+def fold(conn, limit=FOLD_BATCH):
+    """Apply the oldest pending changes to clusters_mapa and return how many"""
+    if conn.dialect.name == 'postgresql':
+        # Writers that find a fold running leave their rows to the next one
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': FOLD_LOCK_KEY}).scalar():
+            return 0
+    # Deleting first, so two folds can never apply the same row
+    rows = conn.execute(text(
+        "DELETE FROM clusters_mapa_pendentes WHERE id IN "
+        "(SELECT id FROM clusters_mapa_pendentes ORDER BY id LIMIT :limit) "
+        "RETURNING camada, periodo, latitude, longitude, sinal"), {'limit': limit}).all()
+    apply(conn, [tuple(row) for row in rows])
+    return len(rows)
+
+# Load the previous value on assignment, so a moved point can be taken out
+# of its old cell even if the attribute had been expired by a commit
+for model, fields in TRACKED_FIELDS.items():
+    for field in fields:
+        event.listen(getattr(model, field), 'set', lambda target, value, oldvalue, initiator: value,
+                     active_history=True, retval=True)
+
+def rebuild(conn):
+    """Recompute clusters_mapa, and the cells of rows written without the session, from the tables"""
+    for camada, model in ((OBRAS, Obra), (RELATORIOS, Relatorio)):
+        row_id, _, lat, lon, celula_x, _ = COLUMNS[camada]
+        rows = conn.execute(select(row_id, lat, lon).where(
+            lat.isnot(None), lon.isnot(None), celula_x.is_(None))).all()
+        for start in range(0, len(rows), 5000):
+            conn.execute(update(model.__table__).where(model.__table__.c.id == bindparam('row_id')), [
+                dict(zip(('celula_x', 'celula_y'), cell(lat_, lon_, MAX_CLUSTER_ZOOM)), row_id=i)
+                for i, lat_, lon_ in rows[start:start + 5000]])
+    conn.execute(delete(ClusterMapaPendente.__table__))
+    conn.execute(delete(ClusterMapa.__table__))
+    points = [(OBRAS, '', lat, lon) for lat, lon in conn.execute(select(
+        Obra.latitude_obra, Obra.longitude_obra
+    ).where(Obra.status == 'ativa', Obra.latitude_obra.isnot(None), Obra.longitude_obra.isnot(None)))]
+    points += [(RELATORIOS, month(criacao), lat, lon) for lat, lon, criacao in conn.execute(select(
+        Relatorio.latitude, Relatorio.longitude, Relatorio.data_criacao
+    ).where(Relatorio.latitude.isnot(None), Relatorio.longitude.isnot(None)))]
+    # One zoom level at a time keeps memory bounded by the number of cells
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        cells = defaultdict(lambda: [0, 0.0, 0.0])
+        for camada, periodo, lat, lon in points:
+            x, y = cell(lat, lon, zoom)
+            acc = cells[(camada, x, y, periodo)]
+            acc[0] += 1
+            acc[1] += lat
+            acc[2] += lon
+        rows = [{'camada': k[0], 'zoom': zoom, 'x': k[1], 'y': k[2], 'periodo': k[3],
+                 'total': v[0], 'soma_lat': v[1], 'soma_lon': v[2]} for k, v in cells.items()]
+        for start in range(0, len(rows), 5000):
+            conn.execute(ClusterMapa.__table__.insert(), rows[start:start + 5000])
+    return len(points)
+
+def _scale(zoom):
+    # Literal, so the grouped and selected expressions render identically
+    return literal_column(str(1 << (MAX_CLUSTER_ZOOM - zoom)), Integer)
+
+def precomputed_clusters(camadas, zoom, bbox, desde):
+    """Return (layer, total, lat, lon) of the precomputed cells inside bbox"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = cell(max_lat, min_lon, zoom)
+    x1, y1 = cell(min_lat, max_lon, zoom)
+    c = ClusterMapa
+    folded = select(
+        c.camada, c.x, c.y, func.sum(c.total), func.sum(c.soma_lat), func.sum(c.soma_lon)
+    ).where(
+        c.camada.in_(camadas), c.zoom == zoom, c.x.between(x0, x1), c.y.between(y0, y1),
+        or_(c.camada == OBRAS, c.periodo >= desde)
+    ).group_by(c.camada, c.x, c.y)
+    # Changes not folded yet, binned from their cells at MAX_CLUSTER_ZOOM
+    p, escala = ClusterMapaPendente, 1 << (MAX_CLUSTER_ZOOM - zoom)
+    x, y = p.x // _scale(zoom), p.y // _scale(zoom)
+    pending = select(
+        p.camada, x, y, func.sum(p.sinal), func.sum(p.sinal * p.latitude), func.sum(p.sinal * p.longitude)
+    ).where(
+        p.camada.in_(camadas), p.x.between(x0 * escala, (x1 + 1) * escala - 1),
+        p.y.between(y0 * escala, (y1 + 1) * escala - 1), or_(p.camada == OBRAS, p.periodo >= desde)
+    ).group_by(p.camada, x, y)
+
+    cells = defaultdict(lambda: [0, 0.0, 0.0])
+    for stmt in (folded, pending):
+        for camada, cx, cy, n, soma_lat, soma_lon in db.session.execute(stmt):
+            acc = cells[(camada, cx, cy)]
+            acc[0] += n
+            acc[1] += soma_lat
+            acc[2] += soma_lon
+    return [(key[0], n, soma_lat / n, soma_lon / n) for key, (n, soma_lat, soma_lon) in cells.items() if n > 0]
+
+def _criteria(camada, bbox, desde, scope):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    _, _, lat, lon, _, _ = COLUMNS[camada]
+    criteria = [lat.between(min_lat, max_lat), lon.between(min_lon, max_lon)]
+    if camada == OBRAS:
+        criteria.append(Obra.status == 'ativa')
+    else:
+        year, month_number = (int(part) for part in desde.split('-'))
+        criteria.append(Relatorio.data_criacao >= date(year, month_number, 1))
+    if scope is not None:
+        criteria.append(scope)
+    return criteria
+
+def scoped_clusters(camadas, zoom, bbox, desde, obra_scope=None, report_scope=None):
+    """Return (layer, total, lat, lon) of the cells of the obras and reports in scope, grouped in SQL"""
+    clusters = []
+    for camada, scope in ((OBRAS, obra_scope), (RELATORIOS, report_scope)):
+        if camada not in camadas:
+            continue
+        _, _, lat, lon, celula_x, celula_y = COLUMNS[camada]
+        x, y = celula_x // _scale(zoom), celula_y // _scale(zoom)
+        stmt = select(func.count(), func.sum(lat), func.sum(lon)).where(
+            *_criteria(camada, bbox, desde, scope), celula_x.isnot(None)).group_by(x, y)
+        clusters += [(camada, n, soma_lat / n, soma_lon / n) for n, soma_lat, soma_lon in db.session.execute(stmt)]
+    return clusters
+
+def points(camadas, bbox, desde, obra_scope=None, report_scope=None, limit=MAX_POINTS):
+    """Return (layer, id, label, lat, lon) of individual points inside bbox"""
+    found = []
+    for camada, scope in ((OBRAS, obra_scope), (RELATORIOS, report_scope)):
+        if camada not in camadas:
+            continue
+        row_id, label, lat, lon, _, _ = COLUMNS[camada]
+        stmt = select(row_id, label, lat, lon).where(*_criteria(camada, bbox, desde, scope)).limit(limit)
+        found += [(camada,) + tuple(row) for row in db.session.execute(stmt)]
+    return found
+
+def feature_collection(clusters=(), found=(), zoom=0):
+    """Compact GeoJSON: coordinates rounded to what is visible at the zoom level"""
+    digits = min(6, 2 + zoom // 3)
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(lon, digits), round(lat, digits)]},
+        'properties': {'camada': camada, 'total': n}
+    } for camada, n, lat, lon in clusters]
+    features += [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(lon, 6), round(lat, 6)]},
+        'properties': {'camada': camada, 'total': 1, 'id': point_id, 'nome': label}
+    } for camada, point_id, label, lat, lon in found]
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,263 @@
+import fcntl
+import json
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Prometheus-style instrumentation without a client library. Each process
+# (gunicorn worker, PDF or image pool process) keeps its counters and
+# histograms in memory and a background thread writes them, at most once per
+# METRICS_FLUSH_INTERVAL, to its own JSON file in METRICS_DIR. /metrics sums
+# every file, so whichever worker answers reports the totals of all of them.
+# Files of processes that have exited are folded into one 'encerrados.json',
+# so totals never go backwards when workers are recycled.
+#
+# Latency is measured until the view returns its response; the body of a
+# streamed response (ZIP exports) is not included.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+HISTOGRAMS = {
+    'elp_http_request_duration_seconds': ('Time to build a response, per endpoint', DEFAULT_BUCKETS),
+    'elp_db_queries_per_request': ('SQL statements executed per request', QUERY_BUCKETS),
+    'elp_db_time_per_request_seconds': ('Time spent in SQL per request', DEFAULT_BUCKETS),
+    'elp_pdf_render_seconds': ('PDF render time', SLOW_BUCKETS),
+    'elp_photo_upload_seconds': ('Time to receive and store photo bytes', DEFAULT_BUCKETS),
+    'elp_image_processing_seconds': ('Time to write the derivatives of a photo', SLOW_BUCKETS),
+}
+COUNTERS = {
+    'elp_db_statements_total': 'SQL statements executed',
+    'elp_db_statement_seconds_total': 'Time spent executing SQL statements',
+    'elp_photo_upload_bytes_total': 'Photo bytes received',
+}
+
+ARCHIVE = 'encerrados.json'
+
+_lock = threading.Lock()
+_state = {'pid': None, 'dirty': False}
+_counters = {}
+_histograms = {}
+_config = {'dir': None, 'interval': 1.0}
+
+def _after_fork():
+    # A thread of the parent may have held the lock when it forked
+    global _lock
+    _lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def _series(name, labels):
+    return json.dumps([name, sorted((k, str(v)) for k, v in labels.items())])
+
+def _process():
+    """Start this process's series and flusher; a forked child starts empty"""
+    pid = os.getpid()
+    if _state['pid'] == pid:
+        return
+    _counters.clear()
+    _histograms.clear()
+    _state.update(pid=pid, dirty=False, file=f"{pid}-{secrets.token_hex(4)}.json")
+    if _config['dir']:
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _process()
+        key = _series(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+        _state['dirty'] = True
+
+def observe(name, value, **labels):
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        _process()
+        key = _series(name, labels)
+        # Per-bucket counts plus +Inf, then sum and count
+        values = _histograms.setdefault(key, [0] * (len(buckets) + 3))
+        values[bisect_left(buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+        _state['dirty'] = True
+    if not has_request_context():
+        # Pool processes may exit before the next flush
+        flush()
+
+@contextmanager
+def timer(name, **labels):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - inicio, **labels)
+
+def flush():
+    """Write this process's values to its file if they changed"""
+    if not _config['dir']:
+        return
+    with _lock:
+        _process()
+        if not _state['dirty']:
+            return
+        payload = json.dumps({'pid': _state['pid'], 'counters': _counters, 'histograms': _histograms})
+        _state['dirty'] = False
+        path = os.path.join(_config['dir'], _state['file'])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+def _flush_loop():
+    pid = os.getpid()
+    while _state['pid'] == pid:
+        time.sleep(_config['interval'])
+        try:
+            flush()
+        except OSError:
+            pass
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merge(total, data):
+    for key, value in data.get('counters', {}).items():
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    for key, values in data.get('histograms', {}).items():
+        atual = total['histograms'].get(key)
+        total['histograms'][key] = values[:] if atual is None else [a + b for a, b in zip(atual, values)]
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def collect():
+    """Return the summed values of every process, folding exited ones into the archive"""
+    flush()
+    folder = _config['dir']
+    total = {'counters': {}, 'histograms': {}}
+    with open(os.path.join(folder, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(folder, ARCHIVE)
+        archive = _load(archive_path) or {'counters': {}, 'histograms': {}}
+        encerrados = []
+        for nome in os.listdir(folder):
+            if not nome.endswith('.json') or nome == ARCHIVE:
+                continue
+            data = _load(os.path.join(folder, nome))
+            if data.get('pid') and not _alive(data['pid']):
+                _merge(archive, data)
+                encerrados.append(nome)
+            else:
+                _merge(total, data)
+        if encerrados:
+            tmp_path = f"{archive_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(archive, f)
+            os.replace(tmp_path, archive_path)
+            for nome in encerrados:
+                os.remove(os.path.join(folder, nome))
+        _merge(total, archive)
+    return total
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    texto = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for k, v in pairs)
+    return '{' + texto + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """Prometheus text exposition of every process's values"""
+    total = collect()
+    por_nome = {}
+    for key, value in total['counters'].items():
+        name, pairs = json.loads(key)
+        por_nome.setdefault(name, []).append((pairs, value))
+    for key, values in total['histograms'].items():
+        name, pairs = json.loads(key)
+        por_nome.setdefault(name, []).append((pairs, values))
+
+    linhas = []
+    for name, help_text in COUNTERS.items():
+        linhas += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for pairs, value in sorted(por_nome.get(name, [])):
+            linhas.append(f"{name}{_labels(pairs)} {_number(value)}")
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        linhas += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for pairs, values in sorted(por_nome.get(name, [])):
+            acumulado = 0
+            for limite, count in zip(list(buckets) + ['+Inf'], values):
+                acumulado += count
+                le = limite if limite == '+Inf' else repr(float(limite))
+                linhas.append(f"{name}_bucket{_labels(pairs, [('le', le)])} {acumulado}")
+            linhas.append(f"{name}_sum{_labels(pairs)} {_number(values[-2])}")
+            linhas.append(f"{name}_count{_labels(pairs)} {values[-1]}")
+    return '\n'.join(linhas) + '\n'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_inicio = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, '_metrics_inicio', None)
+    if inicio is None:
+        return
+    duracao = time.perf_counter() - inicio
+    sql = g.get('_metrics_sql') if has_request_context() else None
+    if sql is not None:
+        sql[0] += 1
+        sql[1] += duracao
+    else:
+        inc('elp_db_statements_total', endpoint='-')
+        inc('elp_db_statement_seconds_total', duracao, endpoint='-')
+
+def _start_request():
+    g._metrics_inicio = time.perf_counter()
+    g._metrics_sql = [0, 0.0]
+
+def _finish_request(response):
+    inicio = g.pop('_metrics_inicio', None)
+    if inicio is None:
+        return response
+    # Endpoint names keep the label set small; unmatched URLs share one
+    endpoint = request.endpoint or 'nao_encontrado'
+    observe('elp_http_request_duration_seconds', time.perf_counter() - inicio,
+            endpoint=endpoint, method=request.method, status=response.status_code)
+    comandos, duracao = g.pop('_metrics_sql')
+    observe('elp_db_queries_per_request', comandos, endpoint=endpoint)
+    observe('elp_db_time_per_request_seconds', duracao, endpoint=endpoint)
+    if comandos:
+        inc('elp_db_statements_total', comandos, endpoint=endpoint)
+        inc('elp_db_statement_seconds_total', duracao, endpoint=endpoint)
+    return response
+
+def init_app(app):
+    """Record request metrics for app and share them through METRICS_DIR"""
+    _config['dir'] = app.config['METRICS_DIR']
+    _config['interval'] = app.config['METRICS_FLUSH_INTERVAL']
+    os.makedirs(_config['dir'], exist_ok=True)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,637 @@
+import json
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import (Boolean, Column, column, Date, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text,
+                        inspect, select, text)
+
+from models import db
+
+# Versioned schema migrations. Each migration runs once, in order, and is
+# recorded in schema_migrations. Migrations are frozen once released: later
+# schema changes get a new version instead of editing an old one. So that a
+# model or module change cannot alter what an old migration does, they use
+# the table definitions below and their own SQL, never models.py or the
+# application modules.
+
+MIGRATIONS = []
+
+# Arbitrary key for the Postgres advisory lock held while migrating
+MIGRATION_LOCK_KEY = 720150
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('descricao', String(200), nullable=False),
+    Column('aplicada_em', DateTime, nullable=False),
+)
+
+# Tables as the migration that created them defined them. Columns added
+# later are add_column calls in their own migrations.
+frozen = MetaData()
+
+users_v1 = Table(
+    'users', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('nome', String(100), nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('senha_hash', String(256), nullable=False),
+    Column('role', String(20)),
+    Column('data_criacao', DateTime),
+)
+
+obras_v1 = Table(
+    'obras', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('nome', String(200), nullable=False),
+    Column('tipo', String(100), nullable=False),
+    Column('responsavel_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('status', String(50)),
+    Column('data_inicio', Date),
+    Column('data_fim', Date),
+    Column('endereco', Text),
+    Column('endereco_gps', String(300)),
+    Column('latitude_obra', Float),
+    Column('longitude_obra', Float),
+    Column('descricao', Text),
+    Column('data_criacao', DateTime),
+)
+
+relatorios_v1 = Table(
+    'relatorios', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('obra_id', Integer, ForeignKey('obras.id'), nullable=False),
+    Column('usuario_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('numero_seq', Integer, nullable=False),
+    Column('codigo_relatorio', String(20), nullable=False),
+    Column('versao', Integer),
+    Column('data', Date),
+    Column('atividades', Text),
+    Column('checklist_json', Text),
+    Column('aprovador_id', Integer, ForeignKey('users.id')),
+    Column('status', String(20)),
+    Column('observacoes_admin', Text),
+    Column('prazo_revisao', DateTime),
+    Column('data_aprovacao', DateTime),
+    Column('pdf_path', String(200)),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('data_criacao', DateTime),
+)
+
+checklists_v1 = Table(
+    'checklists', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('nome', String(100), nullable=False),
+    Column('campos_json', Text, nullable=False),
+    Column('obrigatorios_json', Text),
+    Column('ativo', Boolean),
+    Column('data_criacao', DateTime),
+)
+
+contatos_v1 = Table(
+    'contatos', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('nome', String(100), nullable=False),
+    Column('email', String(120)),
+    Column('telefone', String(20)),
+    Column('obra_id', Integer, ForeignKey('obras.id'), nullable=False),
+    Column('cargo', String(100)),
+    Column('data_criacao', DateTime),
+)
+
+fotos_v1 = Table(
+    'fotos', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('relatorio_id', Integer, ForeignKey('relatorios.id'), nullable=False),
+    Column('tipo_servico', String(100), nullable=False),
+    Column('caminho_arquivo', String(200), nullable=False),
+    Column('tamanho', Integer),
+    Column('descricao', Text),
+    Column('data_upload', DateTime),
+)
+
+alertas_v1 = Table(
+    'alertas', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('obra_id', Integer, ForeignKey('obras.id'), nullable=False),
+    Column('descricao', Text, nullable=False),
+    Column('data_alerta', DateTime, nullable=False),
+    Column('status', String(20)),
+    Column('data_criacao', DateTime),
+)
+
+historico_aprovacoes_v1 = Table(
+    'historico_aprovacoes', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('relatorio_id', Integer, ForeignKey('relatorios.id'), nullable=False),
+    Column('aprovador_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('acao', String(20), nullable=False),
+    Column('observacoes', Text),
+    Column('data_acao', DateTime),
+)
+
+pdf_jobs_v3 = Table(
+    'pdf_jobs', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('relatorio_id', Integer, ForeignKey('relatorios.id'), nullable=False),
+    Column('usuario_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('status', String(20)),
+    Column('arquivo', String(200)),
+    Column('erro', Text),
+    Column('data_criacao', DateTime),
+    Column('data_inicio', DateTime),
+    Column('data_conclusao', DateTime),
+)
+
+fotos_derivados_v4 = Table(
+    'fotos_derivados', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('foto_id', Integer, ForeignKey('fotos.id'), nullable=False),
+    Column('variante', String(20), nullable=False),
+    Column('caminho_arquivo', String(200), nullable=False),
+    Column('largura', Integer),
+    Column('altura', Integer),
+    Column('tamanho', Integer),
+)
+
+arquivos_v5 = Table(
+    'arquivos', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('hash', String(64), unique=True, nullable=False),
+    Column('caminho_arquivo', String(200), nullable=False),
+    Column('tamanho', Integer),
+    Column('referencias', Integer, nullable=False),
+    Column('data_criacao', DateTime),
+)
+
+contadores_v6 = Table(
+    'contadores', frozen,
+    Column('chave', String(50), primary_key=True),
+    Column('valor', Integer, nullable=False),
+)
+
+email_outbox_v7 = Table(
+    'email_outbox', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('destinatario', String(120), nullable=False),
+    Column('assunto', String(200), nullable=False),
+    Column('corpo', Text, nullable=False),
+    Column('status', String(20)),
+    Column('tentativas', Integer, nullable=False),
+    Column('proxima_tentativa', DateTime),
+    Column('reservado_em', DateTime),
+    Column('ultimo_erro', Text),
+    Column('data_criacao', DateTime),
+    Column('data_envio', DateTime),
+)
+
+sequencias_relatorio_v8 = Table(
+    'sequencias_relatorio', frozen,
+    Column('obra_id', Integer, ForeignKey('obras.id'), primary_key=True),
+    Column('ano', Integer, primary_key=True),
+    Column('ultimo', Integer, nullable=False),
+)
+
+respostas_checklist_v9 = Table(
+    'respostas_checklist', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('relatorio_id', Integer, ForeignKey('relatorios.id'), nullable=False),
+    Column('checklist_id', Integer, ForeignKey('checklists.id')),
+    Column('campo', String(200), nullable=False),
+    Column('valor', String(100)),
+    Column('conforme', Boolean, nullable=False),
+    Column('obra_id', Integer, ForeignKey('obras.id'), nullable=False),
+    Column('usuario_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('data', Date, nullable=False),
+)
+
+clusters_mapa_v12 = Table(
+    'clusters_mapa', frozen,
+    Column('camada', String(20), primary_key=True),
+    Column('zoom', Integer, primary_key=True),
+    Column('x', Integer, primary_key=True),
+    Column('y', Integer, primary_key=True),
+    Column('periodo', String(7), primary_key=True),
+    Column('total', Integer, nullable=False),
+    Column('soma_lat', Float, nullable=False),
+    Column('soma_lon', Float, nullable=False),
+)
+
+uploads_parciais_v15 = Table(
+    'uploads_parciais', frozen,
+    Column('id', String(32), primary_key=True),
+    Column('usuario_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('relatorio_id', Integer, ForeignKey('relatorios.id', ondelete='CASCADE'), nullable=False),
+    Column('nome_arquivo', String(200), nullable=False),
+    Column('tipo_servico', String(100), nullable=False),
+    Column('descricao', Text),
+    Column('tamanho', Integer, nullable=False),
+    Column('recebido', Integer, nullable=False),
+    Column('foto_id', Integer, ForeignKey('fotos.id', ondelete='SET NULL')),
+    Column('data_criacao', DateTime),
+    Column('data_atualizacao', DateTime),
+)
+
+livro_jobs_v16 = Table(
+    'livro_jobs', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('obra_id', Integer, ForeignKey('obras.id', ondelete='CASCADE'), nullable=False),
+    Column('usuario_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('status', String(20)),
+    Column('arquivo', String(200)),
+    Column('erro', Text),
+    Column('data_criacao', DateTime),
+    Column('data_inicio', DateTime),
+    Column('data_conclusao', DateTime),
+)
+
+clusters_mapa_pendentes_v19 = Table(
+    'clusters_mapa_pendentes', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('camada', String(20), nullable=False),
+    Column('periodo', String(7), nullable=False),
+    Column('x', Integer, nullable=False),
+    Column('y', Integer, nullable=False),
+    Column('latitude', Float, nullable=False),
+    Column('longitude', Float, nullable=False),
+    Column('sinal', Integer, nullable=False),
+)
+
+def migration(version, descricao):
+    def register(fn):
+        MIGRATIONS.append((version, descricao, fn))
+        return fn
+    return register
+
+def create_index(conn, name, table, columns):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+def create_unique_index(conn, name, table, columns):
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+def add_column(conn, table, column, ddl):
+    # Databases whose first migration built the tables from the models already have the column
+    if column not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def batches(conn, stmt, id_column, batch_size=1000):
+    """Yield the rows of a select in id order, a batch at a time"""
+    ultimo_id = 0
+    while True:
+        rows = conn.execute(stmt.where(id_column > ultimo_id).order_by(id_column).limit(batch_size)).all()
+        if not rows:
+            return
+        yield rows
+        ultimo_id = rows[-1].id
+
+@migration(1, 'Esquema inicial')
+def initial_schema(conn):
+    tables = [users_v1, checklists_v1, obras_v1, relatorios_v1, contatos_v1, fotos_v1, alertas_v1,
+              historico_aprovacoes_v1]
+    frozen.create_all(conn, tables=tables, checkfirst=True)
+
+@migration(2, 'Índices para filtros e ordenações frequentes')
+def hot_query_indexes(conn):
+    # create_report: last numero_seq of an obra
+    create_index(conn, 'ix_relatorios_obra_seq', 'relatorios', 'obra_id, numero_seq DESC')
+    # admin_reports and report listings: status filter + keyset order
+    create_index(conn, 'ix_relatorios_status_criacao', 'relatorios', 'status, data_criacao DESC, id DESC')
+    create_index(conn, 'ix_relatorios_criacao', 'relatorios', 'data_criacao DESC, id DESC')
+    create_index(conn, 'ix_relatorios_usuario_criacao', 'relatorios', 'usuario_id, data_criacao DESC, id DESC')
+    # dashboard: rejected reports awaiting revision
+    create_index(conn, 'ix_relatorios_usuario_status_prazo', 'relatorios', 'usuario_id, status, prazo_revisao')
+    create_index(conn, 'ix_alertas_obra_data', 'alertas', 'obra_id, data_alerta')
+    create_index(conn, 'ix_alertas_data', 'alertas', 'data_alerta')
+    create_index(conn, 'ix_fotos_relatorio', 'fotos', 'relatorio_id')
+    create_index(conn, 'ix_contatos_obra', 'contatos', 'obra_id')
+    create_index(conn, 'ix_historico_relatorio_data', 'historico_aprovacoes', 'relatorio_id, data_acao DESC')
+    create_index(conn, 'ix_obras_responsavel', 'obras', 'responsavel_id')
+
+@migration(3, 'Fila de geração de PDF')
+def pdf_job_queue(conn):
+    pdf_jobs_v3.create(conn, checkfirst=True)
+    create_index(conn, 'ix_pdf_jobs_relatorio_status', 'pdf_jobs', 'relatorio_id, status')
+    create_index(conn, 'ix_pdf_jobs_status', 'pdf_jobs', 'status')
+
+@migration(4, 'Derivados de fotos')
+def photo_derivatives(conn):
+    add_column(conn, 'fotos', 'status_processamento', 'VARCHAR(20)')
+    fotos_derivados_v4.create(conn, checkfirst=True)
+    create_unique_index(conn, 'ux_fotos_derivados_foto_variante', 'fotos_derivados', 'foto_id, variante')
+
+@migration(5, 'Armazenamento de arquivos por conteúdo')
+def content_addressed_storage(conn):
+    arquivos_v5.create(conn, checkfirst=True)
+    create_index(conn, 'ix_fotos_caminho', 'fotos', 'caminho_arquivo')
+
+@migration(6, 'Contadores agregados')
+def aggregate_counters(conn):
+    # Rows are filled from COUNT(*) on first read
+    contadores_v6.create(conn, checkfirst=True)
+
+@migration(7, 'Fila de emails')
+def email_outbox(conn):
+    email_outbox_v7.create(conn, checkfirst=True)
+    create_index(conn, 'ix_email_outbox_status_proxima', 'email_outbox', 'status, proxima_tentativa')
+
+@migration(8, 'Sequência atômica de relatórios por obra')
+def report_sequences(conn):
+    # Counter rows are created from MAX(numero_seq) on first use
+    sequencias_relatorio_v8.create(conn, checkfirst=True)
+    
+    # Concurrent creates could produce repeated numbers; keep the oldest
+    # report on its number and move the others to the end of the sequence
+    duplicates = conn.execute(text(
+        "SELECT obra_id, numero_seq FROM relatorios GROUP BY obra_id, numero_seq HAVING COUNT(*) > 1"
+    )).all()
+    for obra_id, numero_seq in duplicates:
+        ids = conn.execute(text(
+            "SELECT id FROM relatorios WHERE obra_id = :obra_id AND numero_seq = :numero_seq ORDER BY id"
+        ), {'obra_id': obra_id, 'numero_seq': numero_seq}).scalars().all()
+        ultimo = conn.execute(text(
+            "SELECT MAX(numero_seq) FROM relatorios WHERE obra_id = :obra_id"
+        ), {'obra_id': obra_id}).scalar()
+        for relatorio_id in ids[1:]:
+            ultimo += 1
+            conn.execute(text("UPDATE relatorios SET numero_seq = :numero_seq WHERE id = :id"),
+                         {'numero_seq': ultimo, 'id': relatorio_id})
+    
+    # The unique index also serves the lookups ix_relatorios_obra_seq did
+    create_unique_index(conn, 'ux_relatorios_obra_seq', 'relatorios', 'obra_id, numero_seq')
+    conn.execute(text("DROP INDEX IF EXISTS ix_relatorios_obra_seq"))
+
+@migration(9, 'Respostas de checklist normalizadas')
+def checklist_response_rows(conn):
+    respostas_checklist_v9.create(conn, checkfirst=True)
+
+    # One row per item of the report's checklist, inferred from the answered
+    # fields when exactly one checklist covers them; unchecked items fail
+    def key(campo):
+        return re.sub(r'\s+', '_', campo.strip())
+
+    def conforme(valor):
+        return valor is not None and str(valor).strip().lower() in {'on', 'true', '1', 'sim', 'ok', 'conforme'}
+
+    checklists = [(checklist_id, json.loads(campos_json) if campos_json else [])
+                  for checklist_id, campos_json in conn.execute(
+                      select(checklists_v1.c.id, checklists_v1.c.campos_json))]
+    r = relatorios_v1.c
+    stmt = select(r.id, r.obra_id, r.usuario_id, r.data, r.data_criacao, r.checklist_json).where(
+        r.checklist_json.isnot(None))
+    for relatorios in batches(conn, stmt, r.id):
+        rows = []
+        for relatorio in relatorios:
+            try:
+                respostas = json.loads(relatorio.checklist_json)
+            except ValueError:
+                continue
+            if not respostas or not isinstance(respostas, dict):
+                continue
+            answered = {key(chave) for chave in respostas}
+            candidatos = [(checklist_id, campos) for checklist_id, campos in checklists
+                          if answered <= {key(campo) for campo in campos}]
+            checklist_id, campos = candidatos[0] if len(candidatos) == 1 else (None, None)
+            if campos is None:
+                itens = [(chave.replace('_', ' '), str(valor)) for chave, valor in respostas.items()]
+            else:
+                valores = {key(chave): valor for chave, valor in respostas.items()}
+                itens = [(campo, valores.get(key(campo))) for campo in campos]
+                itens = [(campo, None if valor is None else str(valor)) for campo, valor in itens]
+            data = relatorio.data or (relatorio.data_criacao or datetime.utcnow()).date()
+            rows += [{'relatorio_id': relatorio.id, 'checklist_id': checklist_id, 'campo': campo,
+                      'valor': valor, 'conforme': conforme(valor), 'obra_id': relatorio.obra_id,
+                      'usuario_id': relatorio.usuario_id, 'data': data} for campo, valor in itens]
+        if rows:
+            conn.execute(respostas_checklist_v9.insert(), rows)
+
+    create_index(conn, 'ix_respostas_relatorio', 'respostas_checklist', 'relatorio_id')
+    # Analytics filter by obra or author and period, then group by item
+    create_index(conn, 'ix_respostas_obra_data', 'respostas_checklist', 'obra_id, data, campo, conforme')
+    create_index(conn, 'ix_respostas_usuario_data', 'respostas_checklist', 'usuario_id, data, campo, conforme')
+    create_index(conn, 'ix_respostas_data_campo', 'respostas_checklist', 'data, campo, conforme')
+
+@migration(10, 'Índice de busca textual')
+def search_index(conn):
+    # Postgres: weighted tsvector under GIN; SQLite: FTS5. Text is accent-folded here
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS busca_relatorios ("
+            "relatorio_id INTEGER PRIMARY KEY REFERENCES relatorios (id) ON DELETE CASCADE, "
+            "documento tsvector NOT NULL)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_busca_relatorios_documento ON busca_relatorios USING GIN (documento)"))
+        insert = text(
+            "INSERT INTO busca_relatorios (relatorio_id, documento) VALUES (:id, "
+            "setweight(to_tsvector('portuguese', :atividades), 'A') || "
+            "setweight(to_tsvector('portuguese', :obra), 'B') || "
+            "setweight(to_tsvector('portuguese', :observacoes), 'C') || "
+            "setweight(to_tsvector('portuguese', :fotos), 'C')) "
+            "ON CONFLICT (relatorio_id) DO UPDATE SET documento = EXCLUDED.documento")
+    else:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS busca_relatorios USING fts5("
+            "atividades, obra, observacoes, fotos, tokenize = 'unicode61 remove_diacritics 2')"))
+        conn.execute(text("DELETE FROM busca_relatorios"))
+        insert = text("INSERT INTO busca_relatorios (rowid, atividades, obra, observacoes, fotos) "
+                      "VALUES (:id, :atividades, :obra, :observacoes, :fotos)")
+
+    def fold(texto):
+        decomposed = unicodedata.normalize('NFKD', texto or '')
+        return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+    r, o, f = relatorios_v1.c, obras_v1.c, fotos_v1.c
+    stmt = select(r.id, r.atividades, r.observacoes_admin, o.nome, o.endereco).join_from(
+        relatorios_v1, obras_v1, o.id == r.obra_id)
+    for relatorios in batches(conn, stmt, r.id, batch_size=500):
+        fotos = defaultdict(list)
+        for relatorio_id, descricao in conn.execute(select(f.relatorio_id, f.descricao).where(
+                f.descricao.isnot(None), f.relatorio_id.between(relatorios[0].id, relatorios[-1].id)
+        ).order_by(f.id)):
+            fotos[relatorio_id].append(descricao)
+        conn.execute(insert, [{
+            'id': row.id,
+            'atividades': fold(row.atividades),
+            'obra': fold(' '.join(filter(None, (row.nome, row.endereco)))),
+            'observacoes': fold(row.observacoes_admin),
+            'fotos': fold(' '.join(fotos[row.id])),
+        } for row in relatorios])
+
+@migration(11, 'Cerca geográfica das obras')
+def geofence(conn):
+    add_column(conn, 'obras', 'raio_geofence', 'INTEGER')
+    add_column(conn, 'relatorios', 'distancia_obra', 'FLOAT')
+    add_column(conn, 'relatorios', 'fora_da_cerca', 'BOOLEAN')
+
+    # Great-circle distance to the obra, outside beyond its own radius or the
+    # default radius of the time, frozen so the result does not depend on the
+    # environment the migration runs in; editing an obra recomputes its reports
+    padrao = 100
+
+    def distance_m(lat1, lon1, lat2, lon2):
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = math.sin((phi2 - phi1) / 2) ** 2 + \
+            math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+        return 2 * 6371000.0 * math.asin(min(1.0, math.sqrt(a)))
+
+    r, o = relatorios_v1.c, obras_v1.c
+    stmt = select(r.id, r.latitude, r.longitude, o.latitude_obra, o.longitude_obra,
+                  column('raio_geofence', Integer)).join_from(relatorios_v1, obras_v1, o.id == r.obra_id).where(
+        r.latitude.isnot(None), r.longitude.isnot(None), o.latitude_obra.isnot(None), o.longitude_obra.isnot(None))
+    for rows in batches(conn, stmt, r.id):
+        updates = []
+        for row in rows:
+            distancia = round(distance_m(row.latitude, row.longitude, row.latitude_obra, row.longitude_obra), 1)
+            updates.append({'id': row.id, 'distancia': distancia, 'fora': distancia > (row.raio_geofence or padrao)})
+        conn.execute(text("UPDATE relatorios SET distancia_obra = :distancia, fora_da_cerca = :fora "
+                          "WHERE id = :id"), updates)
+
+@migration(12, 'Clusters do mapa')
+def map_cluster_table(conn):
+    clusters_mapa_v12.create(conn, checkfirst=True)
+
+    # Active obras and report positions binned into a Web Mercator grid of
+    # 4 cells per 256 px tile for zooms 0-16; reports are split by month
+    def cell(lat, lon, zoom):
+        n = (1 << zoom) * 4
+        phi = math.radians(max(-85.05112878, min(85.05112878, lat)))
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(phi)) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    conn.execute(clusters_mapa_v12.delete())
+    r, o = relatorios_v1.c, obras_v1.c
+    points = [('obras', '', lat, lon) for lat, lon in conn.execute(select(o.latitude_obra, o.longitude_obra).where(
+        o.status == 'ativa', o.latitude_obra.isnot(None), o.longitude_obra.isnot(None)))]
+    points += [('relatorios', criacao.strftime('%Y-%m') if criacao else '', lat, lon)
+               for lat, lon, criacao in conn.execute(select(r.latitude, r.longitude, r.data_criacao).where(
+                   r.latitude.isnot(None), r.longitude.isnot(None)))]
+    for zoom in range(17):
+        cells = defaultdict(lambda: [0, 0.0, 0.0])
+        for camada, periodo, lat, lon in points:
+            x, y = cell(lat, lon, zoom)
+            acc = cells[(camada, x, y, periodo)]
+            acc[0] += 1
+            acc[1] += lat
+            acc[2] += lon
+        rows = [{'camada': k[0], 'zoom': zoom, 'x': k[1], 'y': k[2], 'periodo': k[3],
+                 'total': v[0], 'soma_lat': v[1], 'soma_lon': v[2]} for k, v in cells.items()]
+        for start in range(0, len(rows), 5000):
+            conn.execute(clusters_mapa_v12.insert(), rows[start:start + 5000])
+
+    # Individual points at deep zooms are looked up by bounding box
+    create_index(conn, 'ix_obras_lat_lon', 'obras', 'latitude_obra, longitude_obra')
+    create_index(conn, 'ix_relatorios_lat_lon', 'relatorios', 'latitude, longitude')
+
+@migration(13, 'Validadores para GET condicional')
+def conditional_get(conn):
+    add_column(conn, 'relatorios', 'data_atualizacao', 'TIMESTAMP')
+    add_column(conn, 'checklists', 'data_atualizacao', 'TIMESTAMP')
+    add_column(conn, 'contadores', 'data_atualizacao', 'TIMESTAMP')
+    conn.execute(text("UPDATE relatorios SET data_atualizacao = COALESCE(data_aprovacao, data_criacao) "
+                      "WHERE data_atualizacao IS NULL"))
+    conn.execute(text("UPDATE checklists SET data_atualizacao = data_criacao WHERE data_atualizacao IS NULL"))
+
+@migration(14, 'Chaves de idempotência da sincronização offline')
+def offline_sync_keys(conn):
+    add_column(conn, 'relatorios', 'chave_cliente', 'VARCHAR(64)')
+    add_column(conn, 'fotos', 'chave_cliente', 'VARCHAR(64)')
+    # Rows created online keep NULL, which unique indexes do not compare
+    create_unique_index(conn, 'ux_relatorios_usuario_chave', 'relatorios', 'usuario_id, chave_cliente')
+    create_unique_index(conn, 'ux_fotos_relatorio_chave', 'fotos', 'relatorio_id, chave_cliente')
+
+@migration(15, 'Uploads retomáveis')
+def resumable_uploads(conn):
+    uploads_parciais_v15.create(conn, checkfirst=True)
+    create_index(conn, 'ix_uploads_parciais_atualizacao', 'uploads_parciais', 'data_atualizacao')
+
+@migration(16, 'Livro de obra consolidado')
+def livro_jobs(conn):
+    livro_jobs_v16.create(conn, checkfirst=True)
+    create_index(conn, 'ix_livro_jobs_obra_status', 'livro_jobs', 'obra_id, status')
+
+@migration(17, 'Data de criação obrigatória nos relatórios')
+def report_creation_not_null(conn):
+    # Legacy rows without data_criacao broke the keyset cursor of the listings
+    if conn.dialect.name == 'sqlite':
+        fallback = "datetime(data), CURRENT_TIMESTAMP"
+    else:
+        fallback = "CAST(data AS TIMESTAMP), now() AT TIME ZONE 'utc'"
+    conn.execute(text(f"UPDATE relatorios SET data_criacao = COALESCE(data_atualizacao, data_aprovacao, {fallback}) "
+                      "WHERE data_criacao IS NULL"))
+    # SQLite cannot alter a column; the model's default keeps new rows filled there
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("ALTER TABLE relatorios ALTER COLUMN data_criacao SET NOT NULL"))
+
+@migration(18, 'Linhas iniciais dos contadores agregados')
+def counter_rows(conn):
+    # Increments skip a missing row, so every counter gets one now. Writers
+    # wait until this commits, so no report falls between COUNT and INSERT.
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("LOCK TABLE users, obras, checklists, relatorios IN SHARE MODE"))
+    contagens = {
+        'usuarios': "SELECT COUNT(*) FROM users",
+        'obras': "SELECT COUNT(*) FROM obras",
+        'checklists': "SELECT COUNT(*) FROM checklists",
+        'relatorios': "SELECT COUNT(*) FROM relatorios",
+        'relatorios_pendente': "SELECT COUNT(*) FROM relatorios WHERE status = 'pendente'",
+        'relatorios_aprovado': "SELECT COUNT(*) FROM relatorios WHERE status = 'aprovado'",
+        'relatorios_reprovado': "SELECT COUNT(*) FROM relatorios WHERE status = 'reprovado'",
+    }
+    for chave, contagem in contagens.items():
+        conn.execute(text(f"INSERT INTO contadores (chave, valor) SELECT :chave, ({contagem}) "
+                          "WHERE NOT EXISTS (SELECT 1 FROM contadores WHERE chave = :chave)"), {'chave': chave})
+
+@migration(19, 'Células do mapa e alterações pendentes dos clusters')
+def map_cells(conn):
+    add_column(conn, 'obras', 'celula_x', 'INTEGER')
+    add_column(conn, 'obras', 'celula_y', 'INTEGER')
+    add_column(conn, 'relatorios', 'celula_x', 'INTEGER')
+    add_column(conn, 'relatorios', 'celula_y', 'INTEGER')
+    clusters_mapa_pendentes_v19.create(conn, checkfirst=True)
+
+    # Web Mercator cell of 4 per 256 px tile at zoom 16, the deepest cluster zoom
+    n = (1 << 16) * 4
+
+    def cell(lat, lon):
+        phi = math.radians(max(-85.05112878, min(85.05112878, lat)))
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(phi)) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    for table, lat, lon in (('obras', obras_v1.c.latitude_obra, obras_v1.c.longitude_obra),
+                            ('relatorios', relatorios_v1.c.latitude, relatorios_v1.c.longitude)):
+        ids = lat.table.c.id
+        stmt = select(ids, lat, lon).where(lat.isnot(None), lon.isnot(None))
+        for rows in batches(conn, stmt, ids):
+            conn.execute(text(f"UPDATE {table} SET celula_x = :x, celula_y = :y WHERE id = :id"),
+                         [dict(zip(('x', 'y'), cell(row[1], row[2])), id=row.id) for row in rows])
+
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+def current_version():
+    """Return the highest applied migration version, or 0 for an empty database"""
+    with db.engine.begin() as conn:
+        return max(applied_versions(conn), default=0)
+
+def upgrade(target=None):
+    """Apply pending migrations up to target (default: latest) and return their versions"""
+    applied = []
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            # Serialize concurrent upgrades, e.g. several workers booting at once
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+        done = applied_versions(conn)
+        for version, descricao, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done or (target is not None and version > target):
+                continue
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, descricao=descricao, aplicada_em=datetime.utcnow()))
+            applied.append(version)
+    return applied
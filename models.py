@@ -5,6 +5,19 @@ import json
 
 db = SQLAlchemy()
 
+def _load_json(instance, column, default):
+    """Parse a JSON text column once per stored value instead of on every access"""
+    raw = getattr(instance, column)
+    if not raw:
+        return default
+    cache = instance.__dict__.setdefault('_json_cache', {})
+    cached = cache.get(column)
+    if cached is None or cached[0] != raw:
+        cached = cache[column] = (raw, json.loads(raw))
+    # A shallow copy is enough: these columns hold flat lists and dicts of strings,
+    # and callers that mutate the result must not change what the next access sees
+    return cached[1].copy()
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -34,6 +47,9 @@ class Obra(db.Model):
     latitude_obra = db.Column(db.Float)
     longitude_obra = db.Column(db.Float)
     descricao = db.Column(db.Text)
+    raio_geofence = db.Column(db.Integer)  # meters; None uses GEOFENCE_RADIUS
+    celula_x = db.Column(db.Integer)  # map grid cell at the deepest cluster zoom
+    celula_y = db.Column(db.Integer)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -61,17 +77,22 @@ class Relatorio(db.Model):
     pdf_path = db.Column(db.String(200))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
-    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    distancia_obra = db.Column(db.Float)  # meters from the obra's GPS position
+    fora_da_cerca = db.Column(db.Boolean)  # None when either position is missing
+    celula_x = db.Column(db.Integer)  # map grid cell at the deepest cluster zoom
+    celula_y = db.Column(db.Integer)
+    data_criacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # keyset pagination key
+    data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # also touched by photo and history changes
+    chave_cliente = db.Column(db.String(64))  # idempotency key of reports synced from offline devices
     
     # Relationships
     fotos = db.relationship('Foto', backref='relatorio', lazy=True, cascade='all, delete-orphan')
+    respostas = db.relationship('RespostaChecklist', backref='relatorio', lazy=True, cascade='all, delete-orphan')
     aprovador = db.relationship('User', foreign_keys=[aprovador_id], backref='relatorios_aprovados')
     
     @property
     def checklist_data(self):
-        if self.checklist_json:
-            return json.loads(self.checklist_json)
-        return {}
+        return _load_json(self, 'checklist_json', {})
     
     @checklist_data.setter
     def checklist_data(self, data):
@@ -86,10 +107,11 @@ class Checklist(db.Model):
     obrigatorios_json = db.Column(db.Text)
     ativo = db.Column(db.Boolean, default=True)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     @property
     def campos(self):
-        return json.loads(self.campos_json) if self.campos_json else []
+        return _load_json(self, 'campos_json', [])
     
     @campos.setter
     def campos(self, data):
@@ -97,7 +119,7 @@ class Checklist(db.Model):
     
     @property
     def obrigatorios(self):
-        return json.loads(self.obrigatorios_json) if self.obrigatorios_json else []
+        return _load_json(self, 'obrigatorios_json', [])
     
     @obrigatorios.setter
     def obrigatorios(self, data):
@@ -124,6 +146,29 @@ class Foto(db.Model):
     tamanho = db.Column(db.Integer)
     descricao = db.Column(db.Text)
     data_upload = db.Column(db.DateTime, default=datetime.utcnow)
+    status_processamento = db.Column(db.String(20))  # 'pendente', 'concluido', 'erro'
+    chave_cliente = db.Column(db.String(64))  # idempotency key of photos synced from offline devices
+    
+    # Relationships
+    derivados = db.relationship('FotoDerivado', backref='foto', lazy=True, cascade='all, delete-orphan')
+    
+    def derivado(self, variante):
+        """Return the file of a processed variant, or None if it is not ready"""
+        for derivado in self.derivados:
+            if derivado.variante == variante:
+                return derivado.caminho_arquivo
+        return None
+
+class FotoDerivado(db.Model):
+    __tablename__ = 'fotos_derivados'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    foto_id = db.Column(db.Integer, db.ForeignKey('fotos.id'), nullable=False)
+    variante = db.Column(db.String(20), nullable=False)  # 'miniatura', 'tela', 'pdf', 'webp'
+    caminho_arquivo = db.Column(db.String(200), nullable=False)
+    largura = db.Column(db.Integer)
+    altura = db.Column(db.Integer)
+    tamanho = db.Column(db.Integer)
 
 class Alerta(db.Model):
     __tablename__ = 'alertas'
@@ -149,3 +194,130 @@ class HistoricoAprovacao(db.Model):
     aprovador = db.relationship('User', backref='historico_aprovacoes')
 
 
+
+class PdfJob(db.Model):
+    __tablename__ = 'pdf_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    relatorio_id = db.Column(db.Integer, db.ForeignKey('relatorios.id'), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    status = db.Column(db.String(20), default='pendente')  # 'pendente', 'processando', 'concluido', 'erro'
+    arquivo = db.Column(db.String(200))
+    erro = db.Column(db.Text)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_inicio = db.Column(db.DateTime)
+    data_conclusao = db.Column(db.DateTime)
+    
+    # Relationships
+    relatorio = db.relationship('Relatorio')
+
+class LivroJob(db.Model):
+    __tablename__ = 'livro_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    obra_id = db.Column(db.Integer, db.ForeignKey('obras.id', ondelete='CASCADE'), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    status = db.Column(db.String(20), default='pendente')  # same states as PdfJob
+    arquivo = db.Column(db.String(200))
+    erro = db.Column(db.Text)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_inicio = db.Column(db.DateTime)
+    data_conclusao = db.Column(db.DateTime)
+    
+    # Relationships
+    obra = db.relationship('Obra')
+
+class Arquivo(db.Model):
+    __tablename__ = 'arquivos'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of the content
+    caminho_arquivo = db.Column(db.String(200), nullable=False)
+    tamanho = db.Column(db.Integer)
+    referencias = db.Column(db.Integer, default=0, nullable=False)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Contador(db.Model):
+    __tablename__ = 'contadores'
+    
+    chave = db.Column(db.String(50), primary_key=True)  # e.g. 'relatorios', 'relatorios_pendente'
+    valor = db.Column(db.Integer, nullable=False, default=0)
+    data_atualizacao = db.Column(db.DateTime)  # set by the 'versao_*' rows only
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    destinatario = db.Column(db.String(120), nullable=False)
+    assunto = db.Column(db.String(200), nullable=False)
+    corpo = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pendente')  # 'pendente', 'enviando', 'enviado', 'erro'
+    tentativas = db.Column(db.Integer, default=0, nullable=False)
+    proxima_tentativa = db.Column(db.DateTime, default=datetime.utcnow)
+    reservado_em = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.Text)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_envio = db.Column(db.DateTime)
+
+class SequenciaRelatorio(db.Model):
+    __tablename__ = 'sequencias_relatorio'
+    
+    obra_id = db.Column(db.Integer, db.ForeignKey('obras.id'), primary_key=True)
+    ano = db.Column(db.Integer, primary_key=True)  # 0 for the obra-wide numero_seq
+    ultimo = db.Column(db.Integer, nullable=False, default=0)
+
+class RespostaChecklist(db.Model):
+    __tablename__ = 'respostas_checklist'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    relatorio_id = db.Column(db.Integer, db.ForeignKey('relatorios.id'), nullable=False)
+    checklist_id = db.Column(db.Integer, db.ForeignKey('checklists.id'))  # None when it could not be inferred
+    campo = db.Column(db.String(200), nullable=False)
+    valor = db.Column(db.String(100))  # raw form value, None for unchecked items
+    conforme = db.Column(db.Boolean, nullable=False, default=False)
+    # Copied from the report so analytics filter and group without a join
+    obra_id = db.Column(db.Integer, db.ForeignKey('obras.id'), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    data = db.Column(db.Date, nullable=False)
+    
+    # Relationships
+    checklist = db.relationship('Checklist')
+
+class ClusterMapa(db.Model):
+    __tablename__ = 'clusters_mapa'
+    
+    camada = db.Column(db.String(20), primary_key=True)  # 'obras', 'relatorios'
+    zoom = db.Column(db.Integer, primary_key=True)
+    x = db.Column(db.Integer, primary_key=True)
+    y = db.Column(db.Integer, primary_key=True)
+    periodo = db.Column(db.String(7), primary_key=True, default='')  # 'YYYY-MM' of reports, '' for obras
+    total = db.Column(db.Integer, nullable=False, default=0)
+    soma_lat = db.Column(db.Float, nullable=False, default=0)
+    soma_lon = db.Column(db.Float, nullable=False, default=0)
+
+class ClusterMapaPendente(db.Model):
+    __tablename__ = 'clusters_mapa_pendentes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    camada = db.Column(db.String(20), nullable=False)
+    periodo = db.Column(db.String(7), nullable=False, default='')
+    x = db.Column(db.Integer, nullable=False)  # cell at the deepest cluster zoom
+    y = db.Column(db.Integer, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    sinal = db.Column(db.Integer, nullable=False)  # +1 added, -1 removed
+
+class UploadParcial(db.Model):
+    __tablename__ = 'uploads_parciais'
+    
+    id = db.Column(db.String(32), primary_key=True)  # random token; also names the partial file
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    relatorio_id = db.Column(db.Integer, db.ForeignKey('relatorios.id', ondelete='CASCADE'), nullable=False)
+    nome_arquivo = db.Column(db.String(200), nullable=False)
+    tipo_servico = db.Column(db.String(100), nullable=False, default='Geral')
+    descricao = db.Column(db.Text)
+    tamanho = db.Column(db.Integer, nullable=False)  # declared total in bytes
+    recebido = db.Column(db.Integer, nullable=False, default=0)  # bytes stored so far
+    foto_id = db.Column(db.Integer, db.ForeignKey('fotos.id', ondelete='SET NULL'))  # set once complete
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow)
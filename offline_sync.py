@@ -0,0 +1,183 @@
+from datetime import date, datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Obra, Relatorio, Checklist, Foto
+from utils import allowed_file
+from storage import store_file
+import counters
+import sequences
+import geo
+from checklist_responses import record_responses
+
+# Batch sync for reports filled in while offline. The service worker sends
+# its whole queue in one request: a JSON list of reports, each with its
+# checklist answers and photos, plus the photo files as multipart parts
+# named by the photo's key. Every report and photo carries a client key,
+# stored in chave_cliente under a unique index, so a retried batch returns
+# the rows created the first time instead of duplicating them.
+#
+# The batch is one transaction with a savepoint per item: an invalid item
+# is reported and skipped without losing the rest.
+
+MAX_KEY_LENGTH = 64
+
+class SyncError(Exception):
+    """An item that can never be applied as sent"""
+
+def accessible_obra(usuario, obra_id):
+    """Return the obra if usuario may file reports for it, else None"""
+    query = Obra.query.filter_by(id=obra_id)
+    if usuario.role != 'admin':
+        query = query.filter_by(responsavel_id=usuario.id)
+    return query.first()
+
+def new_report(usuario, obra, atividades, checklist_data, checklist=None,
+               latitude=None, longitude=None, data=None, chave_cliente=None):
+    """Add a numbered, pending report to the session; the caller commits"""
+    data = data or datetime.now().date()
+    relatorio = Relatorio()
+    relatorio.obra_id = obra.id
+    relatorio.usuario_id = usuario.id
+    relatorio.numero_seq = sequences.next_report_number(obra.id)
+    relatorio.codigo_relatorio = sequences.report_code(obra.id, data.year)
+    relatorio.versao = 1
+    relatorio.data = data
+    relatorio.atividades = atividades
+    relatorio.checklist_data = checklist_data
+    relatorio.latitude = latitude
+    relatorio.longitude = longitude
+    relatorio.chave_cliente = chave_cliente
+    geo.check_report(relatorio, obra)
+    record_responses(relatorio, checklist)
+
+    db.session.add(relatorio)
+    counters.increment('relatorios')
+    counters.increment('relatorios_pendente')
+    return relatorio
+
+def _key(item):
+    chave = item.get('chave')
+    if not isinstance(chave, str) or not chave or len(chave) > MAX_KEY_LENGTH:
+        raise SyncError(f'Chave ausente ou maior que {MAX_KEY_LENGTH} caracteres')
+    return chave
+
+def _number(value, kind, nome):
+    # Queued form fields arrive as strings
+    if value in (None, ''):
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise SyncError(f'{nome} inválido')
+
+def _create_report(usuario, item):
+    latitude = _number(item.get('latitude'), float, 'Campo latitude')
+    longitude = _number(item.get('longitude'), float, 'Campo longitude')
+    obra_id = _number(item.get('obra_id'), int, 'Campo obra_id')
+    if not obra_id and latitude is not None and longitude is not None:
+        permitidas = None if usuario.role == 'admin' else \
+            {obra.id for obra in Obra.query.filter_by(responsavel_id=usuario.id)}
+        encontrada = geo.locate_obra(latitude, longitude, permitidas)
+        obra_id = encontrada[0] if encontrada else None
+    obra = accessible_obra(usuario, obra_id) if obra_id else None
+    if obra is None:
+        raise SyncError('Obra não encontrada ou acesso negado')
+
+    try:
+        data = date.fromisoformat(item['data']) if item.get('data') else None
+    except (TypeError, ValueError):
+        raise SyncError('Data deve estar no formato AAAA-MM-DD')
+    checklist_data = item.get('checklist') or {}
+    if not isinstance(checklist_data, dict):
+        raise SyncError('Checklist deve ser um objeto')
+    checklist_id = _number(item.get('checklist_id'), int, 'Campo checklist_id')
+    checklist = db.session.get(Checklist, checklist_id) if checklist_id else None
+
+    return new_report(usuario, obra, item.get('atividades'), checklist_data, checklist,
+                      latitude, longitude, data, chave_cliente=_key(item))
+
+def _sync_photo(relatorio, item, arquivos):
+    chave = _key(item)
+    foto = Foto.query.filter_by(relatorio_id=relatorio.id, chave_cliente=chave).first()
+    if foto is not None:
+        return foto, 'duplicado'
+
+    arquivo = arquivos.get(item.get('arquivo') or chave)
+    if arquivo is None or not arquivo.filename:
+        raise SyncError('Arquivo da foto não enviado')
+    if not allowed_file(arquivo.filename):
+        raise SyncError('Tipo de arquivo não permitido')
+
+    caminho, tamanho = store_file(arquivo.stream, arquivo.filename)
+    foto = Foto(relatorio_id=relatorio.id, tipo_servico=item.get('tipo_servico') or 'Geral',
+                caminho_arquivo=caminho, tamanho=tamanho, descricao=item.get('descricao', ''),
+                status_processamento='pendente', chave_cliente=chave)
+    db.session.add(foto)
+    db.session.flush()
+    return foto, 'criado'
+
+def _apply(fn, duplicate):
+    """Run fn in a savepoint; return (result, status) or (None, error message)"""
+    try:
+        with db.session.begin_nested():
+            return fn()
+    except SyncError as e:
+        return None, str(e)
+    except IntegrityError:
+        # A concurrent retry of the same item committed first
+        existing = duplicate()
+        if existing is None:
+            raise
+        return existing, 'duplicado'
+
+def apply_batch(usuario, itens, arquivos):
+    """Apply a batch of queued reports; return (per-item results, new photos)
+
+    The caller commits, then queues the new photos for processing.
+    """
+    resultados, novas = [], []
+    for item in itens:
+        if not isinstance(item, dict):
+            resultados.append({'chave': None, 'status': 'erro', 'erro': 'Item inválido'})
+            continue
+        chave = item.get('chave')
+
+        def create():
+            relatorio = Relatorio.query.filter_by(usuario_id=usuario.id, chave_cliente=_key(item)).first()
+            if relatorio is not None:
+                return relatorio, 'duplicado'
+            relatorio = _create_report(usuario, item)
+            db.session.flush()
+            return relatorio, 'criado'
+
+        relatorio, status = _apply(create, lambda: Relatorio.query.filter_by(
+            usuario_id=usuario.id, chave_cliente=chave).first())
+        if relatorio is None:
+            resultados.append({'chave': chave, 'status': 'erro', 'erro': status})
+            continue
+
+        fotos = []
+        for foto_item in item.get('fotos') or []:
+            if not isinstance(foto_item, dict):
+                fotos.append({'chave': None, 'status': 'erro', 'erro': 'Foto inválida'})
+                continue
+            foto_chave = foto_item.get('chave')
+            foto, foto_status = _apply(
+                lambda: _sync_photo(relatorio, foto_item, arquivos),
+                lambda: Foto.query.filter_by(relatorio_id=relatorio.id, chave_cliente=foto_chave).first())
+            if foto is None:
+                fotos.append({'chave': foto_chave, 'status': 'erro', 'erro': foto_status})
+                continue
+            if foto_status == 'criado':
+                novas.append(foto)
+            fotos.append({'chave': foto_chave, 'status': foto_status, 'id': foto.id})
+
+        resultados.append({
+            'chave': chave,
+            'status': status,
+            'id': relatorio.id,
+            'codigo_relatorio': relatorio.codigo_relatorio,
+            'fotos': fotos,
+        })
+    return resultados, novas
@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, or_, select, update
+
+from models import db, EmailOutbox
+from utils import email_body
+
+# Transactional email outbox. Routes add EmailOutbox rows in the same
+# transaction as the change they report; a background sender in each worker
+# claims pending rows in batches and delivers them over one SMTP connection,
+# retrying failures with exponential backoff. A sender claims rows with one
+# conditional UPDATE, so two senders never deliver the same email.
+
+# Seconds before a batch claimed by a sender that died is retried
+CLAIM_TIMEOUT = 300
+
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+_wake = threading.Event()
+
+def queue_email(to_email, subject, template=None, **kwargs):
+    """Add a notification to the outbox; it is sent after the caller commits"""
+    email = EmailOutbox(
+        destinatario=to_email,
+        assunto=subject,
+        corpo=email_body(subject, template, **kwargs),
+        status='pendente',
+        proxima_tentativa=datetime.utcnow()
+    )
+    db.session.add(email)
+    return email
+
+def claim_batch(limit):
+    """Reserve up to limit due emails for this sender"""
+    now = datetime.utcnow()
+    due = or_(
+        and_(EmailOutbox.status == 'pendente', EmailOutbox.proxima_tentativa <= now),
+        and_(EmailOutbox.status == 'enviando', EmailOutbox.reservado_em < now - timedelta(seconds=CLAIM_TIMEOUT))
+    )
+    candidates = select(EmailOutbox.id).where(due).order_by(EmailOutbox.id).limit(limit) \
+        .with_for_update(skip_locked=True)
+    # Rows another sender claimed meanwhile no longer match `due`; SQLite has
+    # no row locks, so this condition is what keeps two senders apart there
+    ids = db.session.execute(
+        update(EmailOutbox).where(EmailOutbox.id.in_(candidates), due)
+        .values(status='enviando', reservado_em=now).returning(EmailOutbox.id),
+        execution_options={'synchronize_session': False}).scalars().all()
+    db.session.commit()
+    if not ids:
+        return []
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(ids)).order_by(EmailOutbox.id).all()
+
+def _group(emails):
+    """Group emails into outgoing messages, merging per recipient when digests are on"""
+    if not current_app.config['EMAIL_DIGEST']:
+        return [[email] for email in emails]
+    groups = OrderedDict()
+    for email in emails:
+        groups.setdefault(email.destinatario, []).append(email)
+    return list(groups.values())
+
+def _message(group):
+    sender = current_app.config.get('MAIL_USERNAME') or 'noreply@elp.com'
+    if len(group) == 1:
+        return Message(subject=group[0].assunto, recipients=[group[0].destinatario],
+                       body=group[0].corpo, sender=sender)
+    body = '\n\n----------------------------------------\n\n'.join(
+        f"{email.assunto}\n{email.corpo}" for email in group)
+    return Message(subject=f'ELP Obras: {len(group)} notificações', recipients=[group[0].destinatario],
+                   body=body, sender=sender)
+
+def _mark_failed(group, error):
+    now = datetime.utcnow()
+    for email in group:
+        email.tentativas += 1
+        email.ultimo_erro = str(error)
+        if email.tentativas >= current_app.config['EMAIL_MAX_ATTEMPTS']:
+            email.status = 'erro'
+        else:
+            email.status = 'pendente'
+            email.proxima_tentativa = now + timedelta(
+                seconds=current_app.config['EMAIL_RETRY_BASE'] * 2 ** (email.tentativas - 1))
+
+def send_batch(emails):
+    """Deliver claimed emails over a single SMTP connection"""
+    from app import mail
+    groups = _group(emails)
+    
+    if not current_app.config.get('MAIL_USERNAME'):
+        for group in groups:
+            current_app.logger.info(f"Email would be sent to {group[0].destinatario}: {group[0].assunto}")
+        sent = groups
+    else:
+        sent = []
+        try:
+            with mail.connect() as connection:
+                for group in groups:
+                    try:
+                        connection.send(_message(group))
+                        sent.append(group)
+                    except Exception as e:
+                        current_app.logger.error(f"Error sending email to {group[0].destinatario}: {str(e)}")
+                        _mark_failed(group, e)
+        except Exception as e:
+            # Connection or login failed: everything not yet sent is retried
+            current_app.logger.error(f"Error connecting to mail server: {str(e)}")
+            for group in groups:
+                if group not in sent and group[0].status == 'enviando':
+                    _mark_failed(group, e)
+    
+    now = datetime.utcnow()
+    for group in sent:
+        for email in group:
+            email.status = 'enviado'
+            email.data_envio = now
+    db.session.commit()
+    return sum(len(group) for group in sent)
+
+def drain():
+    """Send every due email; return how many were delivered"""
+    delivered = 0
+    while True:
+        emails = claim_batch(current_app.config['EMAIL_BATCH_SIZE'])
+        if not emails:
+            return delivered
+        delivered += send_batch(emails)
+
+def _sender_loop(app):
+    while True:
+        _wake.wait(timeout=app.config['EMAIL_POLL_INTERVAL'])
+        _wake.clear()
+        if not app.config['EMAIL_BACKGROUND_SENDER']:
+            return
+        with app.app_context():
+            try:
+                drain()
+            except Exception as e:
+                app.logger.error(f"Email sender error: {str(e)}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+def _ensure_sender():
+    """Start this process's sender thread unless it is running; True if it runs"""
+    global _sender, _sender_pid
+    if not current_app.config['EMAIL_BACKGROUND_SENDER']:
+        return False
+    if _sender is not None and _sender_pid == os.getpid() and _sender.is_alive():
+        return True
+    with _sender_lock:
+        if _sender is None or _sender_pid != os.getpid() or not _sender.is_alive():
+            app = current_app._get_current_object()
+            _sender = threading.Thread(target=_sender_loop, args=(app,), name='email-sender', daemon=True)
+            _sender.start()
+            _sender_pid = os.getpid()
+            # Emails left pending or due for retry by a previous process go out now
+            _wake.set()
+    return True
+
+def wake():
+    """Make sure this process runs a sender thread and ask it to drain now"""
+    if _ensure_sender():
+        _wake.set()
+
+def init_app(app):
+    """Run a sender in each worker from its first request, so a restart leaves nothing stuck
+
+    Started from a request rather than here, so `flask` commands importing
+    the app run no sender and each forked worker starts its own.
+    """
+    @app.before_request
+    def start_email_sender():
+        _ensure_sender()
+
+def run_sender(once=False):
+    """Drain the outbox from a dedicated process, polling until interrupted"""
+    while True:
+        delivered = drain()
+        if delivered:
+            current_app.logger.info(f"{delivered} emails sent")
+        db.session.remove()
+        if once:
+            return
+        time.sleep(current_app.config['EMAIL_POLL_INTERVAL'])
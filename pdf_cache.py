@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+
+from flask import current_app
+
+from utils import generate_pdf_report
+
+# Rendered PDFs are stored under a key derived from everything the PDF shows.
+# Any edit, approval or photo change yields a new key, so a cached file is
+# never stale and an unchanged report is served without re-rendering.
+
+# Bump when the PDF layout changes so existing entries are re-rendered
+RENDER_VERSION = 1
+
+def cache_key(relatorio):
+    fotos = sorted(relatorio.fotos, key=lambda foto: foto.id)
+    payload = {
+        'render': RENDER_VERSION,
+        'id': relatorio.id,
+        'numero_seq': relatorio.numero_seq,
+        'codigo_relatorio': relatorio.codigo_relatorio,
+        'versao': relatorio.versao,
+        'data': relatorio.data,
+        'status': relatorio.status,
+        'obra': relatorio.obra.nome,
+        'usuario': relatorio.usuario.nome,
+        'aprovador': relatorio.aprovador.nome if relatorio.aprovador else None,
+        'atividades': relatorio.atividades,
+        'checklist': relatorio.checklist_json,
+        'latitude': relatorio.latitude,
+        'longitude': relatorio.longitude,
+        'fotos': [[foto.id, foto.caminho_arquivo, foto.tamanho, foto.tipo_servico, foto.descricao]
+                  for foto in fotos],
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def cache_name(key):
+    return os.path.join(key[:2], f"{key}.pdf")
+
+def cache_path(name):
+    return os.path.join(current_app.config['PDF_CACHE_FOLDER'], name)
+
+def lookup(relatorio):
+    """Return the cache entry for the report's current content, or None"""
+    name = cache_name(cache_key(relatorio))
+    return name if os.path.exists(cache_path(name)) else None
+
+def render(relatorio):
+    """Render the report into the cache unless already present; return the entry name"""
+    name = cache_name(cache_key(relatorio))
+    path = cache_path(name)
+    if os.path.exists(path):
+        return name
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Concurrent renders of the same content each write a private file and
+    # atomically replace the entry, so readers never see a partial PDF
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if not generate_pdf_report(relatorio, tmp_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, path)
+    return name
+
+def discard(name):
+    """Remove a superseded cache entry, ignoring names outside the cache"""
+    path = cache_path(name)
+    cache_folder = os.path.abspath(current_app.config['PDF_CACHE_FOLDER'])
+    if not os.path.abspath(path).startswith(cache_folder + os.sep):
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
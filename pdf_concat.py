@@ -0,0 +1,156 @@
+import os
+import re
+
+# Concatenate PDFs written by ReportLab into one file without loading them.
+# ReportLab writes a classic xref table, plain-text object dictionaries and a
+# flat page tree, so each object can be copied straight from disk: only the
+# object header and the "n 0 R" references before its stream are renumbered,
+# and stream bytes are copied in chunks. Page objects keep their /Parent
+# reference, which is remapped to the page tree of the output.
+#
+# Memory holds one offset per output object and one id per page, never a
+# page's content, so it stays flat however many files are joined.
+
+CHUNK_SIZE = 64 * 1024
+
+_REFERENCE = re.compile(rb'(\d+) 0 (obj|R)\b')
+_STREAM = re.compile(rb'>>\s*stream\r?\n')
+_ENTRY = re.compile(rb'/(Root|Info|Pages|Kids|Type)\s*(\[[^\]]*\]|\d+ 0 R|/\w+)')
+
+class PdfConcatError(Exception):
+    """An input that is not a ReportLab-style PDF"""
+
+def _read_xref(source, size):
+    """Return ({object number: offset}, trailer bytes, xref offset)"""
+    source.seek(max(0, size - 1024))
+    tail = source.read()
+    match = re.search(rb'startxref\s+(\d+)', tail)
+    if match is None:
+        raise PdfConcatError('startxref não encontrado')
+    startxref = int(match.group(1))
+    source.seek(startxref)
+    if source.readline().strip() != b'xref':
+        raise PdfConcatError('Tabela xref não suportada')
+
+    offsets = {}
+    while True:
+        line = source.readline().strip()
+        if line.startswith(b'trailer') or not line:
+            break
+        first, count = map(int, line.split())
+        for number in range(first, first + count):
+            entry = source.readline()
+            if entry[17:18] == b'n':
+                offsets[number] = int(entry[:10])
+    return offsets, source.read(1024), startxref
+
+def _read_object(source, offset, end):
+    source.seek(offset)
+    return source.read(end - offset)
+
+def _entries(data):
+    return {key.decode(): value for key, value in _ENTRY.findall(data)}
+
+def _ref(value):
+    return int(value.split()[0])
+
+class PdfConcat:
+    """Append ReportLab PDFs to one output file, page tree and all"""
+
+    def __init__(self, path, title=None):
+        self.path = path
+        self.title = title
+        self.output = open(path, 'wb')
+        self.output.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        # Objects 1 and 2 are the catalog and the page tree, written last
+        self.offsets = [0, None, None]
+        self.kids = []
+
+    def _position(self):
+        return self.output.tell()
+
+    def append(self, path):
+        """Copy every page of path, with the objects they use"""
+        with open(path, 'rb') as source:
+            size = os.fstat(source.fileno()).st_size
+            offsets, trailer, startxref = _read_xref(source, size)
+            # Each object runs up to the next one, or to the xref table
+            ends = sorted(offsets.values()) + [startxref]
+            extent = {offset: ends[i + 1] for i, offset in enumerate(ends[:-1])}
+
+            root = _ref(_entries(trailer)['Root'])
+            info = _entries(trailer).get('Info')
+            catalog = _entries(_read_object(source, offsets[root], extent[offsets[root]]))
+            pages, skip = [], {root, _ref(info)} if info else {root}
+            self._walk(source, offsets, extent, _ref(catalog['Pages']), pages, skip)
+
+            numbers = {}
+            for number in sorted(offsets):
+                if number in skip:
+                    # Page tree nodes are replaced by the output's own
+                    numbers[number] = 2
+                else:
+                    numbers[number] = len(self.offsets)
+                    self.offsets.append(None)
+            for number in sorted(offsets):
+                if number not in skip:
+                    self._copy(source, offsets[number], extent[offsets[number]], numbers)
+            self.kids.extend(numbers[number] for number in pages)
+
+    def _walk(self, source, offsets, extent, number, pages, skip):
+        node = _entries(_read_object(source, offsets[number], extent[offsets[number]]))
+        if node.get('Type') != b'/Pages':
+            pages.append(number)
+            return
+        skip.add(number)
+        for kid in re.findall(rb'(\d+) 0 R', node.get('Kids', b'')):
+            self._walk(source, offsets, extent, int(kid), pages, skip)
+
+    def _copy(self, source, start, end, numbers):
+        source.seek(start)
+        head = source.read(min(CHUNK_SIZE, end - start))
+        match = _STREAM.search(head)
+        if match is None and end - start > len(head):
+            # A dictionary-only object larger than a chunk
+            head += source.read(end - start - len(head))
+        split = match.end() if match else len(head)
+
+        def renumber(found):
+            return b'%d 0 %s' % (numbers[int(found.group(1))], found.group(2))
+
+        self.offsets[numbers[int(head.split(None, 1)[0])]] = self._position()
+        self.output.write(_REFERENCE.sub(renumber, head[:split]))
+        self.output.write(head[split:])
+        restante = end - start - len(head)
+        while restante > 0:
+            chunk = source.read(min(CHUNK_SIZE, restante))
+            if not chunk:
+                break
+            self.output.write(chunk)
+            restante -= len(chunk)
+
+    def _write_object(self, number, body):
+        if number >= len(self.offsets):
+            self.offsets.append(None)
+        self.offsets[number] = self._position()
+        self.output.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def close(self):
+        """Write the page tree, catalog and xref; return the page count"""
+        kids = b' '.join(b'%d 0 R' % kid for kid in self.kids)
+        self._write_object(2, b'<< /Type /Pages /Count %d /Kids [ %s ] >>' % (len(self.kids), kids))
+        self._write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        info = len(self.offsets)
+        titulo = (self.title or '').encode('latin-1', 'replace')
+        titulo = titulo.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+        self._write_object(info, b'<< /Producer (ELP Obras) /Title (%s) >>' % titulo)
+
+        xref = self._position()
+        self.output.write(b'xref\n0 %d\n' % len(self.offsets))
+        self.output.write(b'0000000000 65535 f \n')
+        for offset in self.offsets[1:]:
+            self.output.write(b'%010d 00000 n \n' % offset)
+        self.output.write(b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                          % (len(self.offsets), info, xref))
+        self.output.close()
+        return len(self.kids)
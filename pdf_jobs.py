@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, PdfJob, Relatorio
+import pdf_cache
+import workers
+
+# PDF rendering runs in a per-worker process pool so ReportLab/PIL work never
+# blocks a request thread. Job state lives in the pdf_jobs table, so any
+# gunicorn worker can answer status polls and serve the finished file.
+
+ACTIVE_STATUSES = ('pendente', 'processando')
+
+class PdfQueueFull(Exception):
+    pass
+
+def render_cached(relatorio):
+    """Render a report into the PDF cache and point pdf_path at the new entry"""
+    filename = pdf_cache.render(relatorio)
+    if filename and relatorio.pdf_path != filename:
+        if relatorio.pdf_path:
+            pdf_cache.discard(relatorio.pdf_path)
+        relatorio.pdf_path = filename
+    return filename
+
+def render_report(relatorio_id):
+    """Render a report by id; runs inside a pool process and returns the cache entry"""
+    from app import app
+    with app.app_context():
+        relatorio = db.session.get(Relatorio, relatorio_id)
+        if relatorio is None:
+            return None
+        filename = render_cached(relatorio)
+        db.session.commit()
+        return filename
+
+def render_job(job_id):
+    """Render the PDF for a job; runs inside a pool process"""
+    from app import app
+    with app.app_context():
+        job = db.session.get(PdfJob, job_id)
+        if job is None:
+            return
+        job.status = 'processando'
+        job.data_inicio = datetime.utcnow()
+        db.session.commit()
+        
+        filename = render_cached(job.relatorio)
+        if filename:
+            job.status = 'concluido'
+            job.arquivo = filename
+        else:
+            job.status = 'erro'
+            job.erro = 'Falha ao gerar o PDF.'
+        job.data_conclusao = datetime.utcnow()
+        db.session.commit()
+
+def _mark_failed(app, job_id, future):
+    error = future.exception()
+    if error is None:
+        return
+    with app.app_context():
+        app.logger.error(f"PDF job {job_id} failed: {error}")
+        job = db.session.get(PdfJob, job_id)
+        if job and job.status in ACTIVE_STATUSES:
+            job.status = 'erro'
+            job.erro = str(error)
+            job.data_conclusao = datetime.utcnow()
+            db.session.commit()
+
+def enqueue_pdf(relatorio, usuario):
+    """Return an active job for the report or queue a new one"""
+    timeout = timedelta(seconds=current_app.config['PDF_JOB_TIMEOUT'])
+    recent = datetime.utcnow() - timeout
+    
+    job = PdfJob.query.filter(
+        PdfJob.relatorio_id == relatorio.id,
+        PdfJob.status.in_(ACTIVE_STATUSES),
+        PdfJob.data_criacao >= recent
+    ).order_by(PdfJob.id.desc()).first()
+    if job:
+        return job
+    
+    queued = PdfJob.query.filter(
+        PdfJob.status.in_(ACTIVE_STATUSES),
+        PdfJob.data_criacao >= recent
+    ).count()
+    if queued >= current_app.config['PDF_MAX_QUEUED']:
+        raise PdfQueueFull()
+    
+    job = PdfJob(relatorio_id=relatorio.id, usuario_id=usuario.id, status='pendente')
+    db.session.add(job)
+    db.session.commit()
+    
+    app = current_app._get_current_object()
+    job_id = job.id
+    try:
+        future = workers.submit('pdf', current_app.config['PDF_WORKERS'], render_job, job_id)
+    except Exception as e:
+        job.status = 'erro'
+        job.erro = str(e)
+        db.session.commit()
+        return job
+    future.add_done_callback(lambda f: _mark_failed(app, job_id, f))
+    return job
+
+def job_expired(job):
+    """True if an active job has outlived PDF_JOB_TIMEOUT (e.g. its worker died)"""
+    timeout = timedelta(seconds=current_app.config['PDF_JOB_TIMEOUT'])
+    return job.status in ACTIVE_STATUSES and job.data_criacao < datetime.utcnow() - timeout
@@ -0,0 +1,156 @@
+import os
+from tempfile import SpooledTemporaryFile
+
+from flask import current_app
+from PIL import Image as PILImage
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+
+# Report PDF layout. The style sheet, paragraph and table styles are built
+# once per process by the shared renderer and reused by every render; only
+# the document template, which holds per-document state, is new each time.
+# Output goes to any binary file object, so a PDF can be written straight
+# into the private PDF cache or into a spooled buffer, never the public
+# uploads folder.
+
+def binary_streams():
+    """Write PDF streams as raw bytes instead of ASCII85 text
+
+    ASCII85 only helps 7-bit transports; ReportLab encodes it in pure
+    Python, which dominated the time spent embedding photos, and it makes
+    every stream 25% larger.
+    """
+    rl_config.useA85 = 0
+
+# A process-wide ReportLab setting with no per-document equivalent, so it is
+# set once here for every PDF this process writes, the livro included
+binary_streams()
+
+# Buffers stay in memory up to this size, then spill to a temporary file
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+PHOTO_MAX = (4 * inch, 3 * inch)
+
+class ReportRenderer:
+    """Lays out report PDFs with styles shared by every render"""
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.title = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18,
+                                    spaceAfter=30, alignment=1)  # Center
+        self.heading = styles['Heading2']
+        self.normal = styles['Normal']
+        self.info_style = TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.grey),
+            ('TEXTCOLOR', (0, 0), (0, -1), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+            ('BACKGROUND', (1, 0), (1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ])
+        self.checklist_style = TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ])
+
+    def photo(self, foto, upload_folder):
+        """Image flowable for a photo, preferring the downsampled derivative; None if missing"""
+        derivado = next((d for d in foto.derivados if d.variante == 'pdf'), None)
+        photo_path = os.path.join(upload_folder, derivado.caminho_arquivo if derivado else foto.caminho_arquivo)
+        if not os.path.exists(photo_path):
+            return None
+        if derivado and derivado.largura and derivado.altura:
+            width, height = derivado.largura, derivado.altura
+        else:
+            # Only the header is read; the pixels are decoded by ReportLab when drawn
+            with PILImage.open(photo_path) as pil_img:
+                width, height = pil_img.size
+        scale = min(PHOTO_MAX[0] / width, PHOTO_MAX[1] / height)
+        img = Image(photo_path, width=width * scale, height=height * scale)
+        img.hAlign = 'CENTER'
+        return img
+
+    def story(self, relatorio, upload_folder):
+        story = [Paragraph(f"Relatório de Obra #{relatorio.numero_seq:03d}", self.title), Spacer(1, 12)]
+
+        report_data = [
+            ['Obra:', relatorio.obra.nome],
+            ['Data:', relatorio.data.strftime('%d/%m/%Y')],
+            ['Responsável:', relatorio.usuario.nome],
+            ['Status:', relatorio.status.title()],
+        ]
+        if relatorio.aprovador:
+            report_data.append(['Aprovador:', relatorio.aprovador.nome])
+        report_table = Table(report_data, colWidths=[2*inch, 4*inch])
+        report_table.setStyle(self.info_style)
+        story += [report_table, Spacer(1, 12)]
+
+        if relatorio.atividades:
+            story.append(Paragraph("Atividades Realizadas", self.heading))
+            story.append(Paragraph(relatorio.atividades, self.normal))
+            story.append(Spacer(1, 12))
+
+        if relatorio.checklist_data:
+            story.append(Paragraph("Checklist", self.heading))
+            checklist_data = [[key.replace('_', ' ').title(), value]
+                              for key, value in relatorio.checklist_data.items()]
+            checklist_table = Table(checklist_data, colWidths=[3*inch, 3*inch])
+            checklist_table.setStyle(self.checklist_style)
+            story += [checklist_table, Spacer(1, 12)]
+
+        if relatorio.fotos:
+            story.append(Paragraph("Fotos Anexadas", self.heading))
+            for foto in relatorio.fotos:
+                story.append(Paragraph(f"<b>{foto.tipo_servico}</b>", self.normal))
+                if foto.descricao:
+                    story.append(Paragraph(foto.descricao, self.normal))
+                try:
+                    img = self.photo(foto, upload_folder)
+                    if img is None:
+                        story.append(Paragraph(f"Arquivo: {foto.caminho_arquivo} (não encontrado)", self.normal))
+                        current_app.logger.warning(f"Image file not found for photo {foto.id}")
+                    else:
+                        story += [img, Spacer(1, 6)]
+                except Exception as img_error:
+                    story.append(Paragraph(f"Erro ao carregar imagem: {foto.caminho_arquivo}", self.normal))
+                    current_app.logger.error(f"Error loading image in PDF: {str(img_error)}")
+                story.append(Spacer(1, 12))
+
+        if relatorio.latitude and relatorio.longitude:
+            story.append(Paragraph("Localização", self.heading))
+            story.append(Paragraph(f"Coordenadas: {relatorio.latitude:.6f}, {relatorio.longitude:.6f}", self.normal))
+        return story
+
+    def render(self, relatorio, output):
+        """Write the report's PDF to output, a path or a binary file object"""
+        doc = SimpleDocTemplate(output, pagesize=A4)
+        doc.build(self.story(relatorio, current_app.config['UPLOAD_FOLDER']))
+
+    def render_to_buffer(self, relatorio):
+        """Return the report's PDF in a spooled buffer, rewound for reading"""
+        buffer = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            self.render(relatorio, buffer)
+        except Exception:
+            buffer.close()
+            raise
+        buffer.seek(0)
+        return buffer
+
+_renderer = None
+
+def get_renderer():
+    """The process-wide renderer, created on first use"""
+    global _renderer
+    if _renderer is None:
+        _renderer = ReportRenderer()
+    return _renderer
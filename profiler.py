@@ -0,0 +1,161 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Opt-in sampling profiler. A request is profiled when PROFILE_ENABLED is set
+# and it falls in the PROFILE_SAMPLE_RATE sample, or when an admin sends the
+# X-Profile header. While it runs, one sampler thread per process records the
+# request thread's Python stack every PROFILE_INTERVAL_MS and the SQL it
+# issues. Sampled requests faster than PROFILE_SLOW_MS are discarded; the rest
+# are written to PROFILE_DIR as <nome>.folded, one 'frame;frame;... count'
+# line per distinct stack (flamegraph.pl, speedscope, inferno), and
+# <nome>.sql. Only the newest PROFILE_KEEP profiles are kept.
+#
+# When nothing is being profiled the cost is a header lookup per request and
+# a dict check per SQL statement.
+
+HEADER = 'X-Profile'
+
+_active = {}  # thread ident -> Profile
+_wake = threading.Event()
+_sampler = {'pid': None}
+_write_lock = threading.Lock()
+
+class Profile:
+    def __init__(self, forced):
+        self.forced = forced
+        self.inicio = time.perf_counter()
+        self.stacks = Counter()
+        self.sql = []
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+def _sample_loop(interval):
+    while True:
+        _wake.wait()
+        _wake.clear()
+        while _active:
+            frames = sys._current_frames()
+            for ident, profile in list(_active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    profile.sample(frame)
+            del frames
+            time.sleep(interval)
+
+def _ensure_sampler(interval):
+    # Threads do not survive fork; each worker starts its own
+    pid = os.getpid()
+    if _sampler['pid'] != pid:
+        _sampler['pid'] = pid
+        threading.Thread(target=_sample_loop, args=(interval,), name='profiler', daemon=True).start()
+
+def _requested():
+    """Whether this request should be profiled, and whether an admin forced it"""
+    if request.headers.get(HEADER):
+        if current_user.is_authenticated and current_user.role == 'admin':
+            return True, True
+    config = current_app.config
+    if config['PROFILE_ENABLED'] and random.random() < config['PROFILE_SAMPLE_RATE']:
+        return True, False
+    return False, False
+
+def _start_request():
+    profile, forced = _requested()
+    if not profile:
+        return
+    _ensure_sampler(current_app.config['PROFILE_INTERVAL_MS'] / 1000)
+    g._profile = _active[threading.get_ident()] = Profile(forced)
+    _wake.set()
+
+def _stop():
+    profile = g.pop('_profile', None)
+    if profile is not None:
+        _active.pop(threading.get_ident(), None)
+    return profile
+
+def _finish_request(response):
+    profile = _stop()
+    if profile is not None:
+        nome = _save(profile, response.status_code)
+        if nome and profile.forced:
+            response.headers['X-Profile-Id'] = nome
+    return response
+
+def _teardown_request(error):
+    # The view raised before a response was built
+    profile = _stop()
+    if profile is not None:
+        _save(profile, 500)
+
+def _save(profile, status):
+    """Write a finished profile if it is kept; return its name"""
+    duracao = time.perf_counter() - profile.inicio
+    config = current_app.config
+    if not profile.forced and duracao * 1000 < config['PROFILE_SLOW_MS']:
+        return None
+
+    endpoint = request.endpoint or 'nao_encontrado'
+    agora = time.time()
+    nome = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(agora))}.{int(agora * 1000) % 1000:03d}"
+            f"-{os.getpid()}-{endpoint}-{int(duracao * 1000)}ms")
+    pasta = config['PROFILE_DIR']
+    os.makedirs(pasta, exist_ok=True)
+    with open(os.path.join(pasta, f"{nome}.folded"), 'w') as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    tempo_sql = sum(d for d, _ in profile.sql)
+    with open(os.path.join(pasta, f"{nome}.sql"), 'w') as f:
+        f.write(f"-- {request.method} {request.full_path.rstrip('?')} -> {status}\n")
+        f.write(f"-- {duracao * 1000:.1f} ms total, {len(profile.sql)} statements, "
+                f"{tempo_sql * 1000:.1f} ms in SQL, {sum(profile.stacks.values())} samples\n\n")
+        for duracao_sql, statement in profile.sql:
+            f.write(f"-- {duracao_sql * 1000:.2f} ms\n{statement};\n\n")
+    _rotate(pasta, config['PROFILE_KEEP'])
+    return nome
+
+def _rotate(pasta, keep):
+    with _write_lock:
+        # Names start with the time they were written, to the millisecond
+        nomes = sorted({n.rsplit('.', 1)[0] for n in os.listdir(pasta) if n.endswith(('.folded', '.sql'))})
+        for nome in nomes[:max(len(nomes) - keep, 0)]:
+            for extension in ('folded', 'sql'):
+                try:
+                    os.remove(os.path.join(pasta, f"{nome}.{extension}"))
+                except OSError:
+                    pass
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    if _active and context is not None and threading.get_ident() in _active:
+        context._profile_inicio = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    if not _active:
+        return
+    inicio = getattr(context, '_profile_inicio', None)
+    profile = _active.get(threading.get_ident())
+    if inicio is not None and profile is not None:
+        profile.sql.append((time.perf_counter() - inicio, statement))
+
+def init_app(app):
+    """Profile requests of app on demand"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select, true
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import User, Obra, Relatorio, Contato
+
+# Relationships each list view renders. Many-to-one links are joined into the
+# main SELECT; one-to-many collections are fetched with a single extra
+# SELECT ... IN query, so the number of round trips does not grow with rows.
+
+def report_list_query():
+    """Reports with obra, author and approver loaded for list templates"""
+    return Relatorio.query.options(
+        joinedload(Relatorio.obra),
+        joinedload(Relatorio.usuario),
+        joinedload(Relatorio.aprovador),
+    )
+
+def obra_list_query():
+    """Projects with their responsible user loaded"""
+    return Obra.query.options(joinedload(Obra.responsavel))
+
+def contact_list_query():
+    """Contacts with their project loaded"""
+    return Contato.query.options(joinedload(Contato.obra))
+
+def user_list_query():
+    """Users with the projects they are responsible for"""
+    return User.query.options(selectinload(User.obras_responsavel))
+
+def report_scope(usuario):
+    """Filter for the reports a user may see: all for admins, else own or of their obras"""
+    if usuario.role == 'admin':
+        return true()
+    return or_(
+        Relatorio.usuario_id == usuario.id,
+        Relatorio.obra_id.in_(select(Obra.id).where(Obra.responsavel_id == usuario.id))
+    )
+
+# Keyset pagination for report listings, ordered by (data_criacao, id) desc.
+# A cursor encodes the sort key of the boundary row, so fetching any page is
+# an index range scan instead of OFFSET over every preceding row.
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+class ReportPage:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+def page_size(value):
+    """Clamp a requested page size to the allowed range"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+def encode_cursor(relatorio):
+    return f"{relatorio.data_criacao.isoformat()}_{relatorio.id}"
+
+def decode_cursor(cursor):
+    """Return (data_criacao, id) for a cursor, or None if it is malformed"""
+    try:
+        timestamp, _, relatorio_id = cursor.rpartition('_')
+        return datetime.fromisoformat(timestamp), int(relatorio_id)
+    except (AttributeError, ValueError):
+        return None
+
+def paginate_reports(query, after=None, before=None, per_page=DEFAULT_PAGE_SIZE):
+    """Return one ReportPage of query, newest first, relative to a cursor"""
+    key = decode_cursor(before) if before else None
+    if key:
+        # Walk backwards from the cursor, then restore newest-first order
+        data_criacao, relatorio_id = key
+        rows = query.filter(or_(
+            Relatorio.data_criacao > data_criacao,
+            and_(Relatorio.data_criacao == data_criacao, Relatorio.id > relatorio_id)
+        )).order_by(Relatorio.data_criacao.asc(), Relatorio.id.asc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return ReportPage(
+            items, per_page,
+            next_cursor=encode_cursor(items[-1]) if items else None,
+            prev_cursor=encode_cursor(items[0]) if has_more else None
+        )
+
+    key = decode_cursor(after) if after else None
+    if key:
+        data_criacao, relatorio_id = key
+        query = query.filter(or_(
+            Relatorio.data_criacao < data_criacao,
+            and_(Relatorio.data_criacao == data_criacao, Relatorio.id < relatorio_id)
+        ))
+    rows = query.order_by(Relatorio.data_criacao.desc(), Relatorio.id.desc()).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    return ReportPage(
+        items, per_page,
+        next_cursor=encode_cursor(items[-1]) if has_more else None,
+        prev_cursor=encode_cursor(items[0]) if key and items else None
+    )
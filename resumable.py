@@ -0,0 +1,115 @@
+import os
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import update
+from werkzeug.exceptions import ClientDisconnected
+
+from models import db, Foto, UploadParcial
+from storage import CHUNK_SIZE, store_assembled
+import metrics
+
+# Resumable photo uploads in the style of tus. A client opens an upload with
+# the file's name and size, then sends the bytes in chunks, each tagged with
+# the offset it starts at. The server appends each chunk to a partial file
+# in the staging folder while it streams in, so nothing is held in memory,
+# and records how many bytes it has; after a dropped connection the client
+# asks for that offset and continues from there. The last chunk moves the
+# file into content-addressed storage and creates the Foto.
+
+class OffsetMismatch(Exception):
+    """A chunk that does not start where the stored bytes end"""
+
+    def __init__(self, recebido):
+        super().__init__(f'Upload está em {recebido} bytes')
+        self.recebido = recebido
+
+def _folder():
+    folder = os.path.join(current_app.config['UPLOAD_TMP_FOLDER'], 'uploads')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def partial_path(upload_id):
+    return os.path.join(_folder(), upload_id)
+
+def create_upload(usuario, relatorio, nome_arquivo, tamanho, tipo_servico=None, descricao=None):
+    """Open an upload session and its empty partial file; the caller commits"""
+    upload = UploadParcial(id=secrets.token_hex(16), usuario_id=usuario.id, relatorio_id=relatorio.id,
+                           nome_arquivo=nome_arquivo, tamanho=tamanho, recebido=0,
+                           tipo_servico=tipo_servico or 'Geral', descricao=descricao or '')
+    open(partial_path(upload.id), 'wb').close()
+    db.session.add(upload)
+    return upload
+
+def write_chunk(upload, offset, stream, length=None):
+    """Append a request body at offset; return the new offset, committed
+
+    Runs outside any open transaction, so a slow chunk holds no database
+    connection. Bytes read before a dropped connection are kept.
+    """
+    if offset != upload.recebido:
+        raise OffsetMismatch(upload.recebido)
+    if upload.foto_id is not None:
+        # Already assembled; a retry of the last chunk changes nothing
+        return upload.recebido
+    restante = upload.tamanho - offset
+    limite = restante if length is None else min(length, restante)
+    upload_id, path = upload.id, partial_path(upload.id)
+    db.session.commit()
+
+    escrito = 0
+    with metrics.timer('elp_photo_upload_seconds', etapa='bloco'), open(path, 'r+b') as destino:
+        destino.seek(offset)
+        try:
+            while escrito < limite:
+                chunk = stream.read(min(CHUNK_SIZE, limite - escrito))
+                if not chunk:
+                    break
+                destino.write(chunk)
+                escrito += len(chunk)
+        except ClientDisconnected:
+            pass
+    metrics.inc('elp_photo_upload_bytes_total', escrito, etapa='bloco')
+
+    # Only one request can move the offset forward from where it started
+    atualizados = db.session.execute(update(UploadParcial).where(
+        UploadParcial.id == upload_id, UploadParcial.recebido == offset
+    ).values(recebido=offset + escrito, data_atualizacao=datetime.utcnow())).rowcount
+    if not atualizados:
+        db.session.rollback()
+        raise OffsetMismatch(db.session.get(UploadParcial, upload_id, populate_existing=True).recebido)
+    db.session.commit()
+    db.session.refresh(upload)
+    return upload.recebido
+
+def finish(upload):
+    """Store a complete upload as a Foto of its report; the caller commits and queues it"""
+    path = partial_path(upload.id)
+    with open(path, 'r+b') as partial:
+        # Drop bytes past the declared size left by an interrupted retry
+        partial.truncate(upload.tamanho)
+    caminho, tamanho = store_assembled(path, upload.nome_arquivo)
+    foto = Foto(relatorio_id=upload.relatorio_id, tipo_servico=upload.tipo_servico,
+                caminho_arquivo=caminho, tamanho=tamanho, descricao=upload.descricao,
+                status_processamento='pendente')
+    db.session.add(foto)
+    db.session.flush()
+    upload.foto_id = foto.id
+    return foto
+
+def discard(upload):
+    """Delete an upload session and its partial file; the caller commits"""
+    try:
+        os.remove(partial_path(upload.id))
+    except OSError:
+        pass
+    db.session.delete(upload)
+
+def purge_expired(limit=100):
+    """Drop sessions untouched for UPLOAD_EXPIRY_HOURS; return how many"""
+    limite = datetime.utcnow() - timedelta(hours=current_app.config['UPLOAD_EXPIRY_HOURS'])
+    expirados = UploadParcial.query.filter(UploadParcial.data_atualizacao < limite).limit(limit).all()
+    for upload in expirados:
+        discard(upload)
+    return len(expirados)
@@ -1,16 +1,32 @@
 import os
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
-from werkzeug.utils import secure_filename
-from PIL import Image
 import json
 from datetime import datetime, date, timedelta
 from functools import wraps
 
 from app import app, db, mail
-from models import User, Obra, Relatorio, Checklist, Contato, Foto, Alerta, HistoricoAprovacao
-from utils import send_email, generate_pdf_report, allowed_file
+from models import User, Obra, Relatorio, Checklist, Contato, Foto, Alerta, HistoricoAprovacao, PdfJob, UploadParcial, LivroJob
+from utils import allowed_file
+from queries import report_list_query, obra_list_query, contact_list_query, user_list_query, paginate_reports, page_size, report_scope
+from pdf_jobs import enqueue_pdf, job_expired, PdfQueueFull
+import pdf_cache
+from images import queue_photo
+from storage import store_upload, release_photo, delete_files
+from exports import export_query, generate_zip
+import counters
+from checklist_responses import record_responses, compliance_rates, GROUPINGS
+from search import search_reports
+import geo
+import map_clusters
+from outbox import queue_email, wake as wake_email_sender
+from conditional import conditional, validators, not_modified, set_validators
+from offline_sync import apply_batch, accessible_obra, new_report
+import resumable
+import livro_obra
+import metrics
+import sequences
 
 def admin_required(f):
     @wraps(f)
@@ -99,6 +115,7 @@ def register():
         user.role = role
         
         db.session.add(user)
+        counters.increment('usuarios')
         try:
             db.session.commit()
             flash(f'Usuário {nome} criado com sucesso!', 'success')
@@ -115,16 +132,16 @@ def dashboard():
     # Get user's projects and recent reports
     if current_user.role == 'admin':
         obras = Obra.query.all()
-        relatorios_recentes = Relatorio.query.order_by(Relatorio.data_criacao.desc()).limit(5).all()
+        relatorios_recentes = report_list_query().order_by(Relatorio.data_criacao.desc()).limit(5).all()
     else:
         obras = Obra.query.filter_by(responsavel_id=current_user.id).all()
-        relatorios_recentes = Relatorio.query.filter_by(usuario_id=current_user.id).order_by(Relatorio.data_criacao.desc()).limit(5).all()
+        relatorios_recentes = report_list_query().filter_by(usuario_id=current_user.id).order_by(Relatorio.data_criacao.desc()).limit(5).all()
     
     # Get alerts for current user
     if current_user.role == 'admin':
         alertas = Alerta.query.filter(Alerta.data_alerta >= datetime.now()).order_by(Alerta.data_alerta.asc()).limit(5).all()
         # Also get pending reports for approval
-        relatorios_pendentes = Relatorio.query.filter_by(status='pendente').count()
+        relatorios_pendentes = counters.get_counters('relatorios_pendente')['relatorios_pendente']
         relatorios_reprovados = Relatorio.query.filter_by(status='reprovado', usuario_id=current_user.id).filter(
             Relatorio.prazo_revisao >= datetime.now()).count() if current_user.role != 'admin' else 0
     else:
@@ -146,26 +163,23 @@ def dashboard():
 @login_required
 @admin_required
 def admin_panel():
-    users_count = User.query.count()
-    obras_count = Obra.query.count()
-    relatorios_count = Relatorio.query.count()
-    checklists_count = Checklist.query.count()
-    relatorios_pendentes = Relatorio.query.filter_by(status='pendente').count()
+    totais = counters.get_counters('usuarios', 'obras', 'relatorios', 'checklists', 'relatorios_pendente')
     
     return render_template('admin_panel.html',
-                         users_count=users_count,
-                         obras_count=obras_count,
-                         relatorios_count=relatorios_count,
-                         checklists_count=checklists_count,
-                         relatorios_pendentes=relatorios_pendentes)
+                         users_count=totais['usuarios'],
+                         obras_count=totais['obras'],
+                         relatorios_count=totais['relatorios'],
+                         checklists_count=totais['checklists'],
+                         relatorios_pendentes=totais['relatorios_pendente'])
 
 @app.route('/projects')
 @login_required
+@conditional('obras', 'usuarios')
 def projects():
     if current_user.role == 'admin':
-        obras = Obra.query.all()
+        obras = obra_list_query().all()
     else:
-        obras = Obra.query.filter_by(responsavel_id=current_user.id).all()
+        obras = obra_list_query().filter_by(responsavel_id=current_user.id).all()
     
     users = User.query.all() if current_user.role == 'admin' else []
     
@@ -195,10 +209,13 @@ def create_project():
     obra.endereco_gps = endereco_gps
     obra.latitude_obra = float(latitude_obra) if latitude_obra else None
     obra.longitude_obra = float(longitude_obra) if longitude_obra else None
+    obra.raio_geofence = request.form.get('raio_geofence', type=int)
     obra.descricao = descricao
     
     db.session.add(obra)
+    counters.increment('obras')
     db.session.commit()
+    geo.invalidate()
     
     flash('Obra criada com sucesso!', 'success')
     return redirect(url_for('projects'))
@@ -224,6 +241,7 @@ def update_project(projeto_id):
     obra.endereco_gps = request.form.get('endereco_gps')
     obra.latitude_obra = float(request.form.get('latitude_obra')) if request.form.get('latitude_obra') else None
     obra.longitude_obra = float(request.form.get('longitude_obra')) if request.form.get('longitude_obra') else None
+    obra.raio_geofence = request.form.get('raio_geofence', type=int)
     obra.descricao = request.form.get('descricao')
     obra.status = request.form.get('status', 'ativa')
     
@@ -236,7 +254,11 @@ def update_project(projeto_id):
     if data_fim:
         obra.data_fim = datetime.strptime(data_fim, '%Y-%m-%d').date()
     
+    # The site may have moved or changed its radius: re-check its reports
+    db.session.flush()
+    geo.refresh_fence_status(db.session.connection(), obra.id)
     db.session.commit()
+    geo.invalidate()
     
     flash('Obra atualizada com sucesso!', 'success')
     return redirect(url_for('projects'))
@@ -245,8 +267,9 @@ def update_project(projeto_id):
 @app.route('/admin/users')
 @login_required
 @admin_required
+@conditional('usuarios', 'obras')
 def manage_users():
-    users = User.query.all()
+    users = user_list_query().all()
     return render_template('manage_users.html', users=users)
 
 @app.route('/admin/users/<int:user_id>/toggle-status', methods=['POST'])
@@ -277,9 +300,14 @@ def toggle_user_status(user_id):
 @app.route('/admin/reports/pending')
 @login_required
 @admin_required
+@conditional('relatorios', 'obras', 'usuarios')
 def pending_reports():
-    relatorios_pendentes = Relatorio.query.filter_by(status='pendente').order_by(Relatorio.data_criacao.desc()).all()
-    return render_template('admin_reports.html', relatorios=relatorios_pendentes, title='Relatórios Pendentes')
+    page = paginate_reports(report_list_query().filter_by(status='pendente'),
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            per_page=page_size(request.args.get('per_page')))
+    return render_template('admin_reports.html', relatorios=page.items, page=page,
+                           status_filter='pendente', title='Relatórios Pendentes')
 
 
 
@@ -322,6 +350,18 @@ def update_report(relatorio_id):
         flash('Este relatório não pode ser editado.', 'error')
         return redirect(url_for('reports'))
     
+    # Moving a report to another obra gives it a number and code in that obra's sequence
+    obra_id = request.form.get('obra_id', type=int) or relatorio.obra_id
+    if obra_id != relatorio.obra_id:
+        obra = accessible_obra(current_user, obra_id)
+        if not obra:
+            flash('Acesso negado a esta obra.', 'error')
+            return redirect(url_for('edit_report', relatorio_id=relatorio.id))
+        # Allocated before obra_id changes, so no autoflush writes the old number under the new obra
+        numero_seq = sequences.next_report_number(obra.id)
+        codigo = sequences.report_code(obra.id, (relatorio.data or date.today()).year, relatorio.versao or 1)
+        relatorio.obra_id, relatorio.numero_seq, relatorio.codigo_relatorio = obra.id, numero_seq, codigo
+    
     # Create history entry before updating if report was rejected
     if relatorio.status == 'reprovado' and relatorio.aprovador_id:
         historico = HistoricoAprovacao(
@@ -335,7 +375,6 @@ def update_report(relatorio_id):
 
     # Update report data
     relatorio.atividades = request.form.get('atividades')
-    relatorio.obra_id = request.form.get('obra_id')
     relatorio.endereco = request.form.get('endereco')
     
     # Process checklist data
@@ -345,6 +384,8 @@ def update_report(relatorio_id):
             field_name = key[10:-1]  # Remove 'checklist[' and ']'
             checklist_data[field_name] = request.form[key]
     relatorio.checklist_data = checklist_data
+    checklist_id = request.form.get('checklist_id', type=int)
+    record_responses(relatorio, db.session.get(Checklist, checklist_id) if checklist_id else None)
     
     # Update location if provided
     latitude = request.form.get('latitude')
@@ -352,23 +393,21 @@ def update_report(relatorio_id):
     if latitude and longitude:
         relatorio.latitude = float(latitude)
         relatorio.longitude = float(longitude)
+    geo.check_report(relatorio, db.session.get(Obra, relatorio.obra_id))
 
     # Handle photo removals
     remove_photos = request.form.getlist('remove_photos[]')
+    arquivos_liberados = []
     if remove_photos:
         for photo_id in remove_photos:
             foto = Foto.query.get(photo_id)
             if foto and foto.relatorio_id == relatorio.id:
-                # Delete file from filesystem
-                try:
-                    photo_path = os.path.join(app.config['UPLOAD_FOLDER'], foto.caminho_arquivo)
-                    if os.path.exists(photo_path):
-                        os.remove(photo_path)
-                except:
-                    pass
+                # Files are deleted after commit, once no photo references them
+                arquivos_liberados += release_photo(foto)
                 db.session.delete(foto)
 
     # Handle new photo uploads
+    novas_fotos = []
     if 'photos' in request.files:
         files = request.files.getlist('photos')
         photo_types = request.form.getlist('photo_types[]')
@@ -379,23 +418,22 @@ def update_report(relatorio_id):
                 tipo_servico = photo_types[i] if i < len(photo_types) else 'Geral'
                 descricao = photo_descriptions[i] if i < len(photo_descriptions) else ''
                 
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"{timestamp}_{filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
+                filename, file_size = store_upload(file)
                 
                 foto = Foto(
                     relatorio_id=relatorio.id,
                     tipo_servico=tipo_servico,
                     caminho_arquivo=filename,
-                    tamanho=os.path.getsize(file_path),
-                    descricao=descricao
+                    tamanho=file_size,
+                    descricao=descricao,
+                    status_processamento='pendente'
                 )
                 db.session.add(foto)
+                novas_fotos.append(foto)
     
     # Reset status to pending if it was rejected and increment version
     if relatorio.status == 'reprovado':
+        counters.status_changed(relatorio.status, 'pendente')
         relatorio.status = 'pendente'
         relatorio.aprovador_id = None
         relatorio.data_aprovacao = None
@@ -404,29 +442,36 @@ def update_report(relatorio_id):
         
         # Increment version
         relatorio.versao = (relatorio.versao or 1) + 1
-        # Update report code with new version
-        year = datetime.now().year
-        relatorio.codigo_relatorio = f"ELP-{year}-{relatorio.numero_seq:03d}-v{relatorio.versao}"
+        # Update report code with new version, keeping its year and number
+        codigo_base = relatorio.codigo_relatorio.rsplit('-v', 1)[0] if relatorio.codigo_relatorio else \
+            f"ELP-{datetime.now().year}-{relatorio.numero_seq:03d}"
+        relatorio.codigo_relatorio = f"{codigo_base}-v{relatorio.versao}"
     
     # Update last edit timestamp
     relatorio.data_ultima_edicao = datetime.utcnow()
     
     db.session.commit()
+    delete_files(arquivos_liberados)
+    
+    # Derivatives are generated in the background once the rows exist
+    for foto in novas_fotos:
+        queue_photo(foto)
     
     flash('Relatório atualizado e enviado para nova aprovação!', 'success')
     return redirect(url_for('reports'))
 
 @app.route('/reports')
 @login_required
+@conditional('relatorios', 'obras', 'usuarios')
 def reports():
     obra_id = request.args.get('obra_id')
     
     if current_user.role == 'admin':
         if obra_id:
-            relatorios = Relatorio.query.filter_by(obra_id=obra_id).order_by(Relatorio.data_criacao.desc()).all()
+            relatorios_query = report_list_query().filter_by(obra_id=obra_id)
             obras = Obra.query.all()
         else:
-            relatorios = Relatorio.query.order_by(Relatorio.data_criacao.desc()).all()
+            relatorios_query = report_list_query()
             obras = Obra.query.all()
     else:
         if obra_id:
@@ -435,12 +480,50 @@ def reports():
             if not obra:
                 flash('Acesso negado a esta obra.', 'error')
                 return redirect(url_for('reports'))
-            relatorios = Relatorio.query.filter_by(obra_id=obra_id).order_by(Relatorio.data_criacao.desc()).all()
+            relatorios_query = report_list_query().filter_by(obra_id=obra_id)
         else:
-            relatorios = Relatorio.query.filter_by(usuario_id=current_user.id).order_by(Relatorio.data_criacao.desc()).all()
+            relatorios_query = report_list_query().filter_by(usuario_id=current_user.id)
         obras = Obra.query.filter_by(responsavel_id=current_user.id).all()
     
-    return render_template('reports.html', relatorios=relatorios, obras=obras, selected_obra=obra_id)
+    page = paginate_reports(relatorios_query,
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            per_page=page_size(request.args.get('per_page')))
+    
+    return render_template('reports.html', relatorios=page.items, page=page, obras=obras, selected_obra=obra_id)
+
+def run_search():
+    consulta = request.args.get('q', '').strip()
+    pagina = max(request.args.get('page', 1, type=int), 1)
+    per_page = page_size(request.args.get('per_page'))
+    relatorios, has_more = search_reports(report_list_query().filter(report_scope(current_user)),
+                                          consulta, page=pagina, per_page=per_page)
+    return consulta, pagina, relatorios, has_more
+
+@app.route('/search')
+@login_required
+def search():
+    consulta, pagina, relatorios, has_more = run_search()
+    return render_template('search.html', consulta=consulta, pagina=pagina,
+                           relatorios=relatorios, has_more=has_more)
+
+@app.route('/api/search')
+@login_required
+def search_api():
+    consulta, pagina, relatorios, has_more = run_search()
+    return jsonify({
+        'q': consulta,
+        'page': pagina,
+        'has_more': has_more,
+        'resultados': [{
+            'id': relatorio.id,
+            'codigo_relatorio': relatorio.codigo_relatorio,
+            'obra': relatorio.obra.nome,
+            'data': relatorio.data.isoformat() if relatorio.data else None,
+            'status': relatorio.status,
+            'atividades': relatorio.atividades
+        } for relatorio in relatorios]
+    })
 
 @app.route('/reports/create')
 @login_required
@@ -464,41 +547,33 @@ def create_report():
     latitude = request.form.get('latitude')
     longitude = request.form.get('longitude')
     
+    # Without a chosen project, use the one whose geofence contains the GPS fix
+    if not obra_id and latitude and longitude:
+        permitidas = None if current_user.role == 'admin' else \
+            {obra.id for obra in Obra.query.filter_by(responsavel_id=current_user.id)}
+        encontrada = geo.locate_obra(float(latitude), float(longitude), permitidas)
+        if not encontrada:
+            flash('Nenhuma obra encontrada na sua localização. Selecione a obra.', 'error')
+            return redirect(url_for('create_report_form'))
+        obra_id = encontrada[0]
+    
     # Verify user has access to this project
-    if current_user.role != 'admin':
-        obra = Obra.query.filter_by(id=obra_id, responsavel_id=current_user.id).first()
-        if not obra:
-            flash('Acesso negado a esta obra.', 'error')
-            return redirect(url_for('reports'))
-    else:
-        obra = Obra.query.get(obra_id)
+    obra = accessible_obra(current_user, obra_id)
+    if not obra:
+        flash('Acesso negado a esta obra.', 'error')
+        return redirect(url_for('reports'))
     
     # Process checklist data
     for key in request.form:
-        if key.startswith('checklist_'):
+        if key.startswith('checklist_') and key != 'checklist_id':
             field_name = key.replace('checklist_', '')
             checklist_data[field_name] = request.form[key]
     
-    # Generate sequential number for this project
-    last_report = Relatorio.query.filter_by(obra_id=obra_id).order_by(Relatorio.numero_seq.desc()).first()
-    numero_seq = (last_report.numero_seq + 1) if last_report else 1
-    
-    # Generate unique report code
-    year = datetime.now().year
-    codigo_relatorio = f"ELP-{year}-{numero_seq:03d}-v1"
-    
-    relatorio = Relatorio()
-    relatorio.obra_id = obra_id
-    relatorio.usuario_id = current_user.id
-    relatorio.numero_seq = numero_seq
-    relatorio.codigo_relatorio = codigo_relatorio
-    relatorio.versao = 1
-    relatorio.atividades = atividades
-    relatorio.checklist_data = checklist_data
-    relatorio.latitude = float(latitude) if latitude else None
-    relatorio.longitude = float(longitude) if longitude else None
-    
-    db.session.add(relatorio)
+    checklist_id = request.form.get('checklist_id', type=int)
+    new_report(current_user, obra, atividades, checklist_data,
+               db.session.get(Checklist, checklist_id) if checklist_id else None,
+               latitude=float(latitude) if latitude else None,
+               longitude=float(longitude) if longitude else None)
     db.session.commit()
     
     flash('Relatório criado com sucesso e enviado para aprovação!', 'success')
@@ -506,15 +581,16 @@ def create_report():
 
 @app.route('/contacts')
 @login_required
+@conditional('contatos', 'obras')
 def contacts():
     if current_user.role == 'admin':
-        contatos = Contato.query.all()
+        contatos = contact_list_query().all()
         obras = Obra.query.all()
     else:
         # Only show contacts for user's projects
         user_obras = Obra.query.filter_by(responsavel_id=current_user.id).all()
         obra_ids = [obra.id for obra in user_obras]
-        contatos = Contato.query.filter(Contato.obra_id.in_(obra_ids)).all()
+        contatos = contact_list_query().filter(Contato.obra_id.in_(obra_ids)).all()
         obras = user_obras
     
     return render_template('contacts.html', contatos=contatos, obras=obras)
@@ -548,6 +624,32 @@ def create_contact():
     flash('Contato criado com sucesso!', 'success')
     return redirect(url_for('contacts'))
 
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def sync_offline():
+    # JSON without photos, or multipart with the batch in 'lote' and one file part per photo key
+    if request.is_json:
+        lote, arquivos = request.get_json(silent=True), {}
+    else:
+        try:
+            lote = json.loads(request.form.get('lote', ''))
+        except ValueError:
+            lote = None
+        arquivos = request.files
+    itens = lote.get('relatorios') if isinstance(lote, dict) else None
+    if not isinstance(itens, list):
+        return jsonify({'error': 'Envie {"relatorios": [...]}'}), 400
+    if len(itens) > app.config['SYNC_MAX_ITEMS']:
+        return jsonify({'error': f'Máximo de {app.config["SYNC_MAX_ITEMS"]} relatórios por lote'}), 413
+    
+    resultados, novas = apply_batch(current_user, itens, arquivos)
+    db.session.commit()
+    
+    for foto in novas:
+        queue_photo(foto)
+    
+    return jsonify({'resultados': resultados})
+
 @app.route('/upload_photo/<int:relatorio_id>', methods=['POST'])
 @login_required
 def upload_photo(relatorio_id):
@@ -568,28 +670,7 @@ def upload_photo(relatorio_id):
         return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Add timestamp to avoid conflicts
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + filename
-        
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Create upload directory if it doesn't exist
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        file.save(filepath)
-        
-        # Resize image if it's too large
-        try:
-            with Image.open(filepath) as img:
-                if img.width > 1920 or img.height > 1080:
-                    img.thumbnail((1920, 1080), Image.Resampling.LANCZOS)
-                    img.save(filepath)
-                
-                file_size = os.path.getsize(filepath)
-        except Exception as e:
-            file_size = os.path.getsize(filepath)
+        filename, file_size = store_upload(file)
         
         foto = Foto()
         foto.relatorio_id = relatorio_id
@@ -597,29 +678,230 @@ def upload_photo(relatorio_id):
         foto.caminho_arquivo = filename
         foto.tamanho = file_size
         foto.descricao = descricao
+        foto.status_processamento = 'pendente'
         
         db.session.add(foto)
         db.session.commit()
         
+        # Resizing and derivatives happen in the image worker pool
+        queue_photo(foto)
+        
         return jsonify({
             'success': True,
+            'id': foto.id,
             'filename': filename,
-            'tipo_servico': tipo_servico
+            'tipo_servico': tipo_servico,
+            'status_processamento': foto.status_processamento
         })
     
     return jsonify({'error': 'Tipo de arquivo não permitido'}), 400
 
+def upload_response(upload, status=200):
+    response = jsonify({
+        'id': upload.id,
+        'recebido': upload.recebido,
+        'tamanho': upload.tamanho,
+        'completo': upload.foto_id is not None,
+        'foto_id': upload.foto_id
+    })
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload.recebido)
+    response.headers['Upload-Length'] = str(upload.tamanho)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def owned_upload(upload_id):
+    return UploadParcial.query.filter_by(id=upload_id, usuario_id=current_user.id).first_or_404()
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    dados = request.get_json(silent=True) or {}
+    relatorio = Relatorio.query.get_or_404(dados.get('relatorio_id'))
+    
+    # Verify user has access to this report
+    if current_user.role != 'admin' and relatorio.usuario_id != current_user.id:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    nome = dados.get('nome') or ''
+    tamanho = dados.get('tamanho', request.headers.get('Upload-Length', type=int))
+    if not allowed_file(nome):
+        return jsonify({'error': 'Tipo de arquivo não permitido'}), 400
+    if not isinstance(tamanho, int) or tamanho <= 0:
+        return jsonify({'error': 'Informe o tamanho do arquivo em bytes'}), 400
+    if tamanho > app.config['UPLOAD_MAX_SIZE']:
+        return jsonify({'error': 'Arquivo maior que o permitido'}), 413
+    
+    resumable.purge_expired()
+    upload = resumable.create_upload(current_user, relatorio, nome, tamanho,
+                                     dados.get('tipo_servico'), dados.get('descricao'))
+    db.session.commit()
+    
+    response = upload_response(upload, 201)
+    response.headers['Location'] = url_for('upload_status', upload_id=upload.id)
+    return response
+
+@app.route('/api/uploads/<upload_id>')
+@login_required
+def upload_status(upload_id):
+    # HEAD is answered from here too; clients resume from Upload-Offset
+    return upload_response(owned_upload(upload_id))
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    upload = owned_upload(upload_id)
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Cabeçalho Upload-Offset obrigatório'}), 400
+    if request.content_length and offset + request.content_length > upload.tamanho:
+        return jsonify({'error': 'Bloco ultrapassa o tamanho declarado'}), 413
+    
+    try:
+        resumable.write_chunk(upload, offset, request.stream, request.content_length)
+    except resumable.OffsetMismatch:
+        return upload_response(db.session.get(UploadParcial, upload_id, populate_existing=True), 409)
+    
+    if upload.recebido == upload.tamanho:
+        # A retried last chunk finds the photo already created
+        upload = UploadParcial.query.filter_by(id=upload_id).with_for_update().populate_existing().one()
+        foto = resumable.finish(upload) if upload.foto_id is None else None
+        db.session.commit()
+        if foto:
+            queue_photo(foto)
+    
+    return upload_response(upload)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    resumable.discard(owned_upload(upload_id))
+    db.session.commit()
+    return '', 204
+
 @app.route('/api/checklists/<int:checklist_id>')
 @login_required
 def get_checklist(checklist_id):
     checklist = Checklist.query.get_or_404(checklist_id)
-    return jsonify({
+    etag, last_modified = validators(f'checklist-{checklist.id}', checklist.data_atualizacao)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    return set_validators(jsonify({
         'id': checklist.id,
         'nome': checklist.nome,
         'campos': checklist.campos,
         'obrigatorios': checklist.obrigatorios
+    }), etag, last_modified)
+
+@app.route('/api/analytics/checklists')
+@login_required
+def checklist_analytics():
+    agrupar = [nome for nome in request.args.get('agrupar', '').split(',') if nome]
+    invalidos = [nome for nome in agrupar if nome not in GROUPINGS]
+    if invalidos:
+        return jsonify({'error': f'Agrupamento inválido: {", ".join(invalidos)}',
+                        'agrupamentos': list(GROUPINGS)}), 400
+    try:
+        inicio = date.fromisoformat(request.args['inicio']) if request.args.get('inicio') else None
+        fim = date.fromisoformat(request.args['fim']) if request.args.get('fim') else None
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+    
+    filtros = {
+        'obra_id': request.args.get('obra_id', type=int),
+        'usuario_id': request.args.get('usuario_id', type=int),
+        'responsavel_id': request.args.get('responsavel_id', type=int),
+        'checklist_id': request.args.get('checklist_id', type=int),
+        'campo': request.args.get('campo') or None,
+    }
+    # Users only see the obras they are responsible for
+    if current_user.role != 'admin':
+        filtros['responsavel_id'] = current_user.id
+    
+    resultados = compliance_rates(agrupar=agrupar, inicio=inicio, fim=fim, **filtros)
+    return jsonify({
+        'agrupar': agrupar,
+        'filtros': dict(filtros, inicio=inicio and inicio.isoformat(), fim=fim and fim.isoformat()),
+        'resultados': resultados
     })
 
+@app.route('/api/projects/nearby')
+@login_required
+def nearby_projects():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    if latitude is None or longitude is None:
+        return jsonify({'error': 'Informe lat e lng'}), 400
+    raio = request.args.get('raio', type=float)
+    limite = min(request.args.get('limit', 20, type=int), 100)
+    
+    permitidas = None if current_user.role == 'admin' else \
+        {obra.id for obra in Obra.query.filter_by(responsavel_id=current_user.id)}
+    if raio is not None:
+        encontradas = geo.obras_within(latitude, longitude, raio, permitidas)[:limite]
+    else:
+        mais_proxima = geo.nearest_obra(latitude, longitude, permitidas)
+        encontradas = [mais_proxima] if mais_proxima else []
+    
+    obras = {obra.id: obra for obra in Obra.query.filter(Obra.id.in_([obra_id for obra_id, _ in encontradas]))}
+    resultado = []
+    for obra_id, distancia in encontradas:
+        obra = obras.get(obra_id)
+        if obra is None:
+            continue
+        resultado.append({
+            'id': obra.id,
+            'nome': obra.nome,
+            'latitude': obra.latitude_obra,
+            'longitude': obra.longitude_obra,
+            'distancia': round(distancia, 1),
+            'raio_geofence': geo.geofence_radius(obra.raio_geofence),
+            'dentro_da_cerca': distancia <= geo.geofence_radius(obra.raio_geofence)
+        })
+    return jsonify({'obras': resultado})
+
+@app.route('/map')
+@login_required
+def project_map():
+    return render_template('map.html')
+
+@app.route('/api/map')
+@login_required
+def map_data():
+    try:
+        bbox = [float(v) for v in request.args.get('bbox', '-180,-85,180,85').split(',')]
+        if len(bbox) != 4:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'bbox deve ser min_lon,min_lat,max_lon,max_lat'}), 400
+    zoom = min(max(request.args.get('zoom', 4, type=int), 0), 22)
+    camadas = [c for c in request.args.get('camadas', ','.join(map_clusters.LAYERS)).split(',')
+               if c in map_clusters.LAYERS]
+    desde = map_clusters.first_period(request.args.get('meses', app.config['MAP_REPORT_MONTHS'], type=int))
+    
+    # The window of recent months moves with the date, not only with writes
+    etag, last_modified = validators(f'{request.full_path}|{desde}', tabelas=('obras', 'relatorios'))
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    
+    obra_scope = None if current_user.role == 'admin' else Obra.responsavel_id == current_user.id
+    if zoom > map_clusters.MAX_CLUSTER_ZOOM:
+        pontos = map_clusters.points(camadas, bbox, desde, obra_scope=obra_scope,
+                                     report_scope=report_scope(current_user))
+        dados = map_clusters.feature_collection(found=pontos, zoom=zoom)
+    elif current_user.role == 'admin':
+        dados = map_clusters.feature_collection(
+            clusters=map_clusters.precomputed_clusters(camadas, zoom, bbox, desde), zoom=zoom)
+    else:
+        # Non-admins see their own obras and reports, grouped by cell in SQL
+        dados = map_clusters.feature_collection(clusters=map_clusters.scoped_clusters(
+            camadas, zoom, bbox, desde, obra_scope=obra_scope, report_scope=report_scope(current_user)), zoom=zoom)
+    
+    response = app.response_class(json.dumps(dados, separators=(',', ':')), mimetype='application/geo+json')
+    return set_validators(response, etag, last_modified)
+
 @app.route('/api/reports/<int:report_id>')
 @login_required
 def get_report_details(report_id):
@@ -629,10 +911,17 @@ def get_report_details(report_id):
     if current_user.role != 'admin' and relatorio.usuario_id != current_user.id:
         return jsonify({'error': 'Acesso negado'}), 403
     
+    # Obra and user names are part of the payload
+    etag, last_modified = validators(f'relatorio-{relatorio.id}', relatorio.data_atualizacao,
+                                     tabelas=('obras', 'usuarios'))
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    
     # Get history
     historico = HistoricoAprovacao.query.filter_by(relatorio_id=report_id).order_by(HistoricoAprovacao.data_acao.desc()).all()
     
-    return jsonify({
+    return set_validators(jsonify({
         'id': relatorio.id,
         'codigo_relatorio': relatorio.codigo_relatorio or f"#{relatorio.numero_seq:03d}",
         'numero_seq': relatorio.numero_seq,
@@ -652,13 +941,19 @@ def get_report_details(report_id):
         'endereco': getattr(relatorio, 'endereco', None),
         'latitude': relatorio.latitude,
         'longitude': relatorio.longitude,
+        'distancia_obra': relatorio.distancia_obra,
+        'fora_da_cerca': relatorio.fora_da_cerca,
         'fotos': [
             {
                 'id': foto.id,
                 'tipo_servico': foto.tipo_servico,
                 'caminho_arquivo': foto.caminho_arquivo,
                 'descricao': foto.descricao,
-                'data_upload': foto.data_upload.isoformat() if foto.data_upload else datetime.now().isoformat()
+                'data_upload': foto.data_upload.isoformat() if foto.data_upload else datetime.now().isoformat(),
+                'status_processamento': foto.status_processamento,
+                'derivados': {
+                    derivado.variante: derivado.caminho_arquivo for derivado in foto.derivados
+                }
             } for foto in relatorio.fotos
         ],
         'historico': [
@@ -670,7 +965,7 @@ def get_report_details(report_id):
                 'data_acao': hist.data_acao.isoformat()
             } for hist in historico
         ]
-    })
+    }), etag, last_modified)
 
 @app.route('/manifest.json')
 def manifest():
@@ -680,6 +975,41 @@ def manifest():
 def service_worker():
     return app.send_static_file('sw.js')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    authorized = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not authorized and not (current_user.is_authenticated and current_user.role == 'admin'):
+        return app.response_class('Acesso negado\n', status=403, mimetype='text/plain')
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def pdf_job_json(job):
+    data = {
+        'id': job.id,
+        'relatorio_id': job.relatorio_id,
+        'status': job.status,
+        'erro': job.erro,
+        'status_url': url_for('pdf_job_status', job_id=job.id),
+    }
+    if job.status == 'concluido':
+        data['download_url'] = url_for('download_pdf_job', job_id=job.id)
+    return data
+
+def send_report_pdf(relatorio, cache_name):
+    safe_obra_name = "".join(c for c in relatorio.obra.nome if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return send_file(pdf_cache.cache_path(cache_name), as_attachment=True,
+                     download_name=f'relatorio_{relatorio.numero_seq:03d}_v{relatorio.versao or 1}_{safe_obra_name}.pdf')
+
+def pdf_job_for_user(job_id):
+    job = PdfJob.query.get_or_404(job_id)
+    if current_user.role != 'admin' and job.usuario_id != current_user.id:
+        return None
+    if job_expired(job):
+        job.status = 'erro'
+        job.erro = 'Tempo limite de geração excedido.'
+        db.session.commit()
+    return job
+
 @app.route('/reports/pdf/<int:report_id>')
 @login_required
 def generate_report_pdf(report_id):
@@ -690,30 +1020,161 @@ def generate_report_pdf(report_id):
         flash('Acesso negado.', 'error')
         return redirect(url_for('reports'))
     
+    # Unchanged reports are served straight from the cache
+    cached = pdf_cache.lookup(relatorio)
+    if cached:
+        return send_report_pdf(relatorio, cached)
+    
     try:
-        pdf_filename = generate_pdf_report(relatorio)
-        
-        if pdf_filename:
-            pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
-            if os.path.exists(pdf_path):
-                # Update the report with the PDF path
-                relatorio.pdf_path = pdf_filename
-                db.session.commit()
-                
-                safe_obra_name = "".join(c for c in relatorio.obra.nome if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                return send_file(pdf_path, as_attachment=True, 
-                               download_name=f'relatorio_{relatorio.numero_seq:03d}_{safe_obra_name}.pdf')
-        
-        flash('Erro ao gerar PDF do relatório.', 'error')
+        job = enqueue_pdf(relatorio, current_user)
+    except PdfQueueFull:
+        flash('Muitos PDFs em geração no momento. Tente novamente em instantes.', 'warning')
         return redirect(url_for('reports'))
-    except Exception as e:
-        flash(f'Erro ao gerar PDF: {str(e)}', 'error')
+    
+    return redirect(url_for('download_pdf_job', job_id=job.id))
+
+@app.route('/reports/pdf/<int:report_id>/jobs', methods=['POST'])
+@login_required
+def enqueue_report_pdf(report_id):
+    relatorio = Relatorio.query.get_or_404(report_id)
+    
+    # Check permissions
+    if current_user.role != 'admin' and relatorio.usuario_id != current_user.id:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    if pdf_cache.lookup(relatorio):
+        return jsonify({
+            'relatorio_id': relatorio.id,
+            'status': 'concluido',
+            'download_url': url_for('generate_report_pdf', report_id=relatorio.id)
+        })
+    
+    try:
+        job = enqueue_pdf(relatorio, current_user)
+    except PdfQueueFull:
+        response = jsonify({'error': 'Fila de PDFs cheia. Tente novamente em instantes.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    return jsonify(pdf_job_json(job)), 202
+
+@app.route('/api/pdf-jobs/<int:job_id>')
+@login_required
+def pdf_job_status(job_id):
+    job = pdf_job_for_user(job_id)
+    if job is None:
+        return jsonify({'error': 'Acesso negado'}), 403
+    return jsonify(pdf_job_json(job))
+
+@app.route('/pdf-jobs/<int:job_id>/download')
+@login_required
+def download_pdf_job(job_id):
+    job = pdf_job_for_user(job_id)
+    if job is None:
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('reports'))
+    
+    if job.status == 'erro':
+        flash(f'Erro ao gerar PDF: {job.erro}', 'error')
         return redirect(url_for('reports'))
+    
+    if job.status != 'concluido':
+        # Browsers without JavaScript keep polling through the Refresh header
+        response = app.response_class('Gerando PDF do relatório, aguarde...', status=202, mimetype='text/plain')
+        response.headers['Refresh'] = '2'
+        response.headers['Retry-After'] = '2'
+        return response
+    
+    if not os.path.exists(pdf_cache.cache_path(job.arquivo)):
+        # The entry was superseded by a newer render of an edited report
+        return redirect(url_for('generate_report_pdf', report_id=job.relatorio_id))
+    
+    return send_report_pdf(job.relatorio, job.arquivo)
+
+def send_livro_pdf(obra, cache_name):
+    safe_obra_name = "".join(c for c in obra.nome if c.isalnum() or c in (' ', '-', '_')).rstrip().replace(' ', '_')
+    return send_file(pdf_cache.cache_path(cache_name), as_attachment=True,
+                     download_name=f'livro_obra_{safe_obra_name}.pdf')
+
+@app.route('/obras/<int:obra_id>/livro.pdf')
+@login_required
+def obra_livro(obra_id):
+    obra = Obra.query.get_or_404(obra_id)
+    if current_user.role != 'admin' and obra.responsavel_id != current_user.id:
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('projects'))
+    
+    if not livro_obra.approved_reports(obra.id).first():
+        flash('Esta obra ainda não tem relatórios aprovados.', 'warning')
+        return redirect(url_for('projects'))
+    
+    cached = livro_obra.lookup(obra)
+    if cached:
+        return send_livro_pdf(obra, cached)
+    
+    try:
+        job = livro_obra.enqueue_livro(obra, current_user)
+    except PdfQueueFull:
+        flash('Muitos livros em geração no momento. Tente novamente em instantes.', 'warning')
+        return redirect(url_for('projects'))
+    
+    return redirect(url_for('download_livro_job', job_id=job.id))
+
+@app.route('/livro-jobs/<int:job_id>/download')
+@login_required
+def download_livro_job(job_id):
+    job = LivroJob.query.get_or_404(job_id)
+    if current_user.role != 'admin' and job.usuario_id != current_user.id:
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('projects'))
+    if livro_obra.job_expired(job):
+        job.status = 'erro'
+        job.erro = 'Tempo limite de geração excedido.'
+        db.session.commit()
+    
+    if job.status == 'erro':
+        flash(f'Erro ao gerar o livro de obra: {job.erro}', 'error')
+        return redirect(url_for('projects'))
+    
+    if job.status != 'concluido':
+        response = app.response_class('Gerando o livro de obra, aguarde...', status=202, mimetype='text/plain')
+        response.headers['Refresh'] = '5'
+        response.headers['Retry-After'] = '5'
+        return response
+    
+    if not job.arquivo or not os.path.exists(pdf_cache.cache_path(job.arquivo)):
+        # Superseded by a book with newer reports
+        return redirect(url_for('obra_livro', obra_id=job.obra_id))
+    
+    return send_livro_pdf(job.obra, job.arquivo)
+
+@app.route('/obras/<int:obra_id>/relatorios.zip')
+@login_required
+@admin_required
+def export_obra_reports(obra_id):
+    obra = Obra.query.get_or_404(obra_id)
+    status = request.args.get('status')
+    
+    try:
+        data_inicio = datetime.strptime(request.args['data_inicio'], '%Y-%m-%d').date() if request.args.get('data_inicio') else None
+        data_fim = datetime.strptime(request.args['data_fim'], '%Y-%m-%d').date() if request.args.get('data_fim') else None
+    except ValueError:
+        flash('Data inválida. Use o formato AAAA-MM-DD.', 'error')
+        return redirect(url_for('projects'))
+    
+    query = export_query(obra.id, status=None if status in (None, '', 'all') else status,
+                         data_inicio=data_inicio, data_fim=data_fim)
+    
+    safe_obra_name = "".join(c for c in obra.nome if c.isalnum() or c in (' ', '-', '_')).rstrip().replace(' ', '_')
+    response = app.response_class(stream_with_context(generate_zip(query)), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'relatorios_{safe_obra_name}.zip')
+    return response
 
 # Admin workflow and checklist management routes
 @app.route('/admin/checklists')
 @login_required
 @admin_required
+@conditional('checklists')
 def admin_checklists():
     checklists = Checklist.query.all()
     return render_template('admin_checklists.html', checklists=checklists)
@@ -734,6 +1195,7 @@ def create_checklist():
         checklist.ativo = True
         
         db.session.add(checklist)
+        counters.increment('checklists')
         db.session.commit()
         
         flash(f'Checklist "{nome}" criado com sucesso!', 'success')
@@ -744,15 +1206,21 @@ def create_checklist():
 @app.route('/admin/reports')
 @login_required
 @admin_required
+@conditional('relatorios', 'obras', 'usuarios')
 def admin_reports():
     status_filter = request.args.get('status', 'pendente')
     
     if status_filter == 'all':
-        relatorios = Relatorio.query.order_by(Relatorio.data_criacao.desc()).all()
+        relatorios_query = report_list_query()
     else:
-        relatorios = Relatorio.query.filter_by(status=status_filter).order_by(Relatorio.data_criacao.desc()).all()
+        relatorios_query = report_list_query().filter_by(status=status_filter)
     
-    return render_template('admin_reports.html', relatorios=relatorios, status_filter=status_filter)
+    page = paginate_reports(relatorios_query,
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            per_page=page_size(request.args.get('per_page')))
+    
+    return render_template('admin_reports.html', relatorios=page.items, page=page, status_filter=status_filter)
 
 @app.route('/admin/reports/<int:relatorio_id>/approve', methods=['POST'])
 @login_required
@@ -761,6 +1229,7 @@ def approve_report(relatorio_id):
     relatorio = Relatorio.query.get_or_404(relatorio_id)
     observacoes = request.form.get('observacoes_admin', request.form.get('observacoes', ''))
     
+    counters.status_changed(relatorio.status, 'aprovado')
     relatorio.status = 'aprovado'
     relatorio.aprovador_id = current_user.id
     relatorio.data_aprovacao = datetime.utcnow()
@@ -776,20 +1245,24 @@ def approve_report(relatorio_id):
     )
     db.session.add(historico)
     
+    # Notification email is committed together with the approval
+    if relatorio.usuario.email:
+        queue_email(
+            to_email=relatorio.usuario.email,
+            subject=f'Relatório #{relatorio.numero_seq} Aprovado - {relatorio.obra.nome}',
+            template='email/report_approved.html',
+            relatorio=relatorio,
+            observacoes=observacoes
+        )
+    
     db.session.commit()
+    wake_email_sender()
     
-    # Send notification email to user
+    # Pre-render the approved version so the first download is a cache hit
     try:
-        if relatorio.usuario.email:
-            send_email(
-                to_email=relatorio.usuario.email,
-                subject=f'Relatório #{relatorio.numero_seq} Aprovado - {relatorio.obra.nome}',
-                template='email/report_approved.html',
-                relatorio=relatorio,
-                observacoes=observacoes
-            )
-    except Exception as e:
-        print(f"Erro ao enviar email: {e}")
+        enqueue_pdf(relatorio, current_user)
+    except PdfQueueFull:
+        app.logger.info(f"PDF queue full, report {relatorio.id} will be rendered on demand")
     
     flash('Relatório aprovado com sucesso!', 'success')
     return redirect(request.form.get('redirect_to', url_for('admin_reports')))
@@ -807,6 +1280,7 @@ def reject_report(relatorio_id):
         flash('É obrigatório informar o motivo da reprovação.', 'error')
         return redirect(request.form.get('redirect_to', url_for('admin_reports')))
     
+    counters.status_changed(relatorio.status, 'reprovado')
     relatorio.status = 'reprovado'
     relatorio.aprovador_id = current_user.id
     relatorio.data_aprovacao = datetime.utcnow()
@@ -828,10 +1302,6 @@ def reject_report(relatorio_id):
     )
     db.session.add(historico)
     
-    db.session.commit()
-    
-    # Create alert after committing the report changes
-    
     # Create alert for the user
     alerta = Alerta()
     alerta.obra_id = relatorio.obra_id
@@ -841,32 +1311,20 @@ def reject_report(relatorio_id):
     
     db.session.add(alerta)
     
-    # Send notification email to user
-    try:
-        if relatorio.usuario.email:
-            send_email(
-                to_email=relatorio.usuario.email,
-                subject=f'Relatório #{relatorio.numero_seq} Reprovado - {relatorio.obra.nome}',
-                template='email/report_rejected.html',
-                relatorio=relatorio,
-                observacoes=observacoes,
-                prazo_revisao=relatorio.prazo_revisao
-            )
-    except Exception as e:
-        print(f"Erro ao enviar email: {e}")
+    # Notification email is committed together with the rejection
+    if relatorio.usuario.email:
+        queue_email(
+            to_email=relatorio.usuario.email,
+            subject=f'Relatório #{relatorio.numero_seq} Reprovado - {relatorio.obra.nome}',
+            template='email/report_rejected.html',
+            relatorio=relatorio,
+            observacoes=observacoes,
+            prazo_revisao=relatorio.prazo_revisao
+        )
     
     db.session.commit()
+    wake_email_sender()
     
     flash('Relatório reprovado. Usuário foi notificado para realizar correções.', 'warning')
     return redirect(request.form.get('redirect_to', url_for('admin_reports')))
 
-@app.route('/api/checklists/<int:checklist_id>')
-@login_required
-def get_checklist_api(checklist_id):
-    checklist = Checklist.query.get_or_404(checklist_id)
-    return jsonify({
-        'id': checklist.id,
-        'nome': checklist.nome,
-        'campos': checklist.campos,
-        'obrigatorios': checklist.obrigatorios
-    })
@@ -0,0 +1,162 @@
+import re
+import unicodedata
+
+from sqlalchemy import column, event, func, inspect, literal_column, select, table, text
+
+from models import db, Relatorio, Foto, Obra
+
+# Full-text index over report activities, admin notes, photo descriptions and
+# the obra's name and address, one document per report in busca_relatorios.
+# Postgres stores a weighted tsvector under a GIN index; SQLite (local runs)
+# uses an FTS5 table with the same columns. Text is accent-folded in Python
+# before indexing and querying, so no unaccent extension is required.
+#
+# The index is refreshed from an after_flush hook on the session, so every
+# write path keeps it current inside the same transaction.
+
+SEARCH_CONFIG = 'portuguese'
+BATCH_SIZE = 500
+
+# bm25 weights for the FTS5 columns, in declaration order
+FTS_WEIGHTS = '4.0, 2.0, 1.0, 1.0'
+
+RELATORIO_FIELDS = ('atividades', 'observacoes_admin', 'obra_id')
+FOTO_FIELDS = ('descricao', 'relatorio_id')
+OBRA_FIELDS = ('nome', 'endereco')
+
+busca_relatorios = table('busca_relatorios', column('relatorio_id'), column('documento'))
+busca_fts = table('busca_relatorios', column('rowid'))
+
+# Light Portuguese suffix stripping for SQLite queries, which have no
+# stemmer: the stem is matched as a prefix, so 'lajes' finds 'laje'.
+SUFFIXES = ('mente', 'acoes', 'icoes', 'acao', 'icao', 'coes', 'cao', 'oes', 'aes', 'ais', 'eis',
+            'res', 'es', 'as', 'os', 'a', 'o', 's', 'e')
+
+def fold(texto):
+    """Lowercase and strip accents, so 'Fundação' matches 'fundacao'"""
+    decomposed = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+def stem(palavra):
+    for suffix in SUFFIXES:
+        if palavra.endswith(suffix) and len(palavra) - len(suffix) >= 3:
+            return palavra[:-len(suffix)]
+    return palavra
+
+def terms(consulta):
+    return re.findall(r'\w+', fold(consulta))
+
+def _documents(conn, relatorio_ids):
+    rows = conn.execute(select(
+        Relatorio.id, Relatorio.atividades, Relatorio.observacoes_admin, Obra.nome, Obra.endereco
+    ).join(Obra, Obra.id == Relatorio.obra_id).where(Relatorio.id.in_(relatorio_ids))).all()
+    fotos = {}
+    for relatorio_id, descricao in conn.execute(select(Foto.relatorio_id, Foto.descricao).where(
+            Foto.relatorio_id.in_(relatorio_ids), Foto.descricao.isnot(None))):
+        fotos.setdefault(relatorio_id, []).append(descricao)
+    return [{
+        'id': row.id,
+        'atividades': fold(row.atividades),
+        'obra': fold(' '.join(filter(None, (row.nome, row.endereco)))),
+        'observacoes': fold(row.observacoes_admin),
+        'fotos': fold(' '.join(fotos.get(row.id, []))),
+    } for row in rows]
+
+def _write(conn, documentos):
+    if not documentos:
+        return
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "INSERT INTO busca_relatorios (relatorio_id, documento) VALUES (:id, "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', :atividades), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', :obra), 'B') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', :observacoes), 'C') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', :fotos), 'C')) "
+            "ON CONFLICT (relatorio_id) DO UPDATE SET documento = EXCLUDED.documento"
+        ), documentos)
+    else:
+        remove(conn, [documento['id'] for documento in documentos])
+        conn.execute(text(
+            "INSERT INTO busca_relatorios (rowid, atividades, obra, observacoes, fotos) "
+            "VALUES (:id, :atividades, :obra, :observacoes, :fotos)"
+        ), documentos)
+
+def remove(conn, relatorio_ids):
+    if not relatorio_ids:
+        return
+    key = 'relatorio_id' if conn.dialect.name == 'postgresql' else 'rowid'
+    conn.execute(text(f"DELETE FROM busca_relatorios WHERE {key} = :id"), [{'id': i} for i in relatorio_ids])
+
+def reindex(conn, relatorio_ids=None, obra_ids=None):
+    """Rebuild the documents of some reports, of every report of some obras, or of all reports"""
+    if relatorio_ids is not None and obra_ids is None:
+        ids = sorted(relatorio_ids)
+        for start in range(0, len(ids), BATCH_SIZE):
+            _write(conn, _documents(conn, ids[start:start + BATCH_SIZE]))
+        return
+
+    ultimo_id = 0
+    while True:
+        stmt = select(Relatorio.id).where(Relatorio.id > ultimo_id).order_by(Relatorio.id).limit(BATCH_SIZE)
+        if obra_ids is not None:
+            stmt = stmt.where(Relatorio.obra_id.in_(obra_ids))
+        ids = conn.execute(stmt).scalars().all()
+        if not ids:
+            break
+        _write(conn, _documents(conn, ids))
+        ultimo_id = ids[-1]
+    if relatorio_ids:
+        reindex(conn, relatorio_ids=relatorio_ids)
+
+def _changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+@event.listens_for(db.session, 'after_flush')
+def _refresh_index(session, flush_context):
+    relatorio_ids, obra_ids, removidos = set(), set(), set()
+    for obj in session.new | session.dirty:
+        novo = obj in session.new
+        if isinstance(obj, Relatorio) and (novo or _changed(obj, RELATORIO_FIELDS)):
+            relatorio_ids.add(obj.id)
+        elif isinstance(obj, Foto) and (novo or _changed(obj, FOTO_FIELDS)):
+            relatorio_ids.add(obj.relatorio_id)
+            # A photo moved to another report leaves the old one too
+            relatorio_ids.update(inspect(obj).attrs.relatorio_id.history.deleted)
+        elif isinstance(obj, Obra) and not novo and _changed(obj, OBRA_FIELDS):
+            obra_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Relatorio):
+            removidos.add(obj.id)
+        elif isinstance(obj, Foto):
+            relatorio_ids.add(obj.relatorio_id)
+
+    relatorio_ids = {i for i in relatorio_ids if i is not None} - removidos
+    if not (relatorio_ids or obra_ids or removidos):
+        return
+    conn = session.connection()
+    remove(conn, sorted(removidos))
+    if obra_ids:
+        reindex(conn, relatorio_ids=relatorio_ids, obra_ids=obra_ids)
+    elif relatorio_ids:
+        reindex(conn, relatorio_ids=relatorio_ids)
+
+def search_reports(query, consulta, page=1, per_page=20):
+    """Return (reports of query matching consulta, best first, has_more) for a 1-based page"""
+    palavras = terms(consulta)
+    if not palavras:
+        return [], False
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), ' '.join(palavras))
+        query = query.join(busca_relatorios, busca_relatorios.c.relatorio_id == Relatorio.id).filter(
+            busca_relatorios.c.documento.op('@@')(tsquery)
+        ).order_by(func.ts_rank(busca_relatorios.c.documento, tsquery).desc(), Relatorio.id.desc())
+    else:
+        query = query.join(busca_fts, busca_fts.c.rowid == Relatorio.id).filter(
+            text("busca_relatorios MATCH :consulta")
+        ).order_by(literal_column(f"bm25(busca_relatorios, {FTS_WEIGHTS})"), Relatorio.id.desc())
+        query = query.params(consulta=' '.join(f'"{stem(palavra)}"*' for palavra in palavras))
+
+    rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    return rows[:per_page], len(rows) > per_page
@@ -0,0 +1,56 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Relatorio, SequenciaRelatorio
+
+# Report numbering. Each obra has one counter row for numero_seq (ano = 0)
+# and one per year for the NNN of its ELP-YYYY-NNN codes. Allocation is a
+# single UPDATE ... RETURNING, so concurrent creates serialize on the row
+# lock; a rolled-back create also rolls back its number, leaving no gaps.
+
+OBRA_WIDE = 0
+
+def _initial_value(obra_id, ano):
+    if ano == OBRA_WIDE:
+        return db.session.execute(
+            select(func.coalesce(func.max(Relatorio.numero_seq), 0)).where(Relatorio.obra_id == obra_id)
+        ).scalar()
+    prefix = f"ELP-{ano}-"
+    ultimo = 0
+    for (codigo,) in db.session.execute(select(Relatorio.codigo_relatorio).where(
+            Relatorio.obra_id == obra_id, Relatorio.codigo_relatorio.like(f"{prefix}%"))):
+        try:
+            ultimo = max(ultimo, int(codigo[len(prefix):].split('-', 1)[0]))
+        except ValueError:
+            continue
+    return ultimo
+
+def _next(obra_id, ano):
+    stmt = update(SequenciaRelatorio).where(
+        SequenciaRelatorio.obra_id == obra_id,
+        SequenciaRelatorio.ano == ano
+    ).values(ultimo=SequenciaRelatorio.ultimo + 1).returning(SequenciaRelatorio.ultimo)
+    
+    valor = db.session.execute(stmt).scalar()
+    if valor is not None:
+        return valor
+    
+    # First report of this obra/year since the counters were introduced
+    try:
+        with db.session.begin_nested():
+            valor = _initial_value(obra_id, ano) + 1
+            db.session.add(SequenciaRelatorio(obra_id=obra_id, ano=ano, ultimo=valor))
+        return valor
+    except IntegrityError:
+        return db.session.execute(stmt).scalar()
+
+def next_report_number(obra_id):
+    """Allocate the next numero_seq of an obra inside the caller's transaction"""
+    return _next(int(obra_id), OBRA_WIDE)
+
+def next_code_number(obra_id, ano):
+    """Allocate the next NNN of an obra's ELP-YYYY-NNN codes for a year"""
+    return _next(int(obra_id), ano)
+
+def report_code(obra_id, ano, versao=1):
+    return f"ELP-{ano}-{next_code_number(obra_id, ano):03d}-v{versao}"
@@ -32,6 +32,60 @@ window.ELPApp = {
         
         // Mobile menu handling
         this.setupMobileNavigation();
+        
+        // PDF downloads go through the background rendering queue
+        document.addEventListener('click', this.handlePdfLinkClick.bind(this));
+    },
+    
+    // Intercept links marked with data-pdf-report
+    handlePdfLinkClick: function(event) {
+        const link = event.target.closest('a[data-pdf-report]');
+        if (!link) {
+            return;
+        }
+        event.preventDefault();
+        this.downloadReportPdf(link.dataset.pdfReport, link);
+    },
+    
+    // Queue a PDF render, poll its job and start the download when ready
+    downloadReportPdf: async function(reportId, link) {
+        if (link.classList.contains('disabled')) {
+            return;
+        }
+        const originalHtml = link.innerHTML;
+        link.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
+        link.classList.add('disabled');
+        
+        try {
+            const response = await fetch(`/reports/pdf/${reportId}/jobs`, {
+                method: 'POST',
+                headers: { 'Accept': 'application/json' }
+            });
+            let job = await response.json();
+            if (!response.ok) {
+                throw new Error(job.error || 'Erro ao gerar PDF');
+            }
+            
+            while (job.status === 'pendente' || job.status === 'processando') {
+                await new Promise(resolve => setTimeout(resolve, 1500));
+                const statusResponse = await fetch(job.status_url, { headers: { 'Accept': 'application/json' } });
+                job = await statusResponse.json();
+                if (!statusResponse.ok) {
+                    throw new Error(job.error || 'Erro ao consultar PDF');
+                }
+            }
+            
+            if (job.status !== 'concluido') {
+                throw new Error(job.erro || 'Erro ao gerar PDF');
+            }
+            window.location.href = job.download_url;
+        } catch (error) {
+            console.error('Error generating PDF:', error);
+            this.showNotification(error.message, 'danger', 5000);
+        } finally {
+            link.innerHTML = originalHtml;
+            link.classList.remove('disabled');
+        }
     },
     
     // Handle online status change
@@ -287,6 +341,11 @@ window.ELPApp = {
     
     // Sync pending data when online
     syncPendingData: function() {
+        // Reports queued offline live in the service worker's IndexedDB queue
+        if ('serviceWorker' in navigator && navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ action: 'syncNow' });
+        }
+        
         const pendingData = localStorage.getItem('elp_pending_sync');
         if (pendingData && this.isOnline) {
             try {
@@ -0,0 +1,95 @@
+/**
+ * ELP Obras - Resumable Photo Uploads
+ * Sends photos to /api/uploads in chunks and resumes from the server's offset after a dropped connection
+ */
+
+class ResumableUpload {
+    constructor(file, options) {
+        this.file = file;
+        this.relatorioId = options.relatorioId;
+        this.tipoServico = options.tipoServico || 'Geral';
+        this.descricao = options.descricao || '';
+        this.onProgress = options.onProgress || (() => {});
+        this.chunkSize = options.chunkSize || 1024 * 1024;
+        this.maxRetries = options.maxRetries || 8;
+        // Survives a page reload, so the same file continues the same upload
+        this.storageKey = `elp_upload_${this.relatorioId}_${file.name}_${file.size}_${file.lastModified}`;
+    }
+
+    // Upload the whole file; resolves with the id of the created photo
+    async start() {
+        let url = localStorage.getItem(this.storageKey);
+        let state = url ? await this.status(url) : null;
+
+        if (!state) {
+            url = await this.create();
+            state = { recebido: 0, completo: false };
+            localStorage.setItem(this.storageKey, url);
+        }
+
+        let retries = 0;
+        while (!state.completo) {
+            try {
+                state = await this.sendChunk(url, state.recebido);
+                retries = 0;
+                this.onProgress(state.recebido / this.file.size);
+            } catch (error) {
+                if (error.fatal || ++retries > this.maxRetries) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, Math.min(1000 * 2 ** retries, 30000)));
+                // Continue from whatever the server stored before the failure
+                state = (await this.status(url).catch(() => null)) || state;
+            }
+        }
+
+        localStorage.removeItem(this.storageKey);
+        return state.foto_id;
+    }
+
+    async create() {
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                relatorio_id: this.relatorioId,
+                nome: this.file.name,
+                tamanho: this.file.size,
+                tipo_servico: this.tipoServico,
+                descricao: this.descricao
+            })
+        });
+        if (!response.ok) {
+            const error = new Error((await response.json().catch(() => ({}))).error || 'Falha ao iniciar o envio');
+            error.fatal = true;
+            throw error;
+        }
+        return response.headers.get('Location');
+    }
+
+    // Server-side state of an upload, or null if it no longer exists
+    async status(url) {
+        const response = await fetch(url, { cache: 'no-store' });
+        return response.ok ? response.json() : null;
+    }
+
+    async sendChunk(url, offset) {
+        const response = await fetch(url, {
+            method: 'PATCH',
+            headers: {
+                'Upload-Offset': String(offset),
+                'Content-Type': 'application/offset+octet-stream'
+            },
+            body: this.file.slice(offset, Math.min(offset + this.chunkSize, this.file.size))
+        });
+        // 409 carries the offset the server actually has
+        if (response.ok || response.status === 409) {
+            return response.json();
+        }
+        const error = new Error(`Falha no envio (HTTP ${response.status})`);
+        error.fatal = response.status < 500;
+        throw error;
+    }
+}
+
+window.ResumableUpload = ResumableUpload;
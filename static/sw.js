@@ -3,9 +3,9 @@
  * Handles offline functionality, caching strategies, and background sync
  */
 
-const CACHE_NAME = 'elp-obras-v1.2.0';
-const STATIC_CACHE_NAME = 'elp-static-v1.2.0';
-const DYNAMIC_CACHE_NAME = 'elp-dynamic-v1.2.0';
+const CACHE_NAME = 'elp-obras-v1.4.0';
+const STATIC_CACHE_NAME = 'elp-static-v1.4.0';
+const DYNAMIC_CACHE_NAME = 'elp-dynamic-v1.4.0';
 
 // Files to cache on install
 const STATIC_FILES = [
@@ -19,6 +19,7 @@ const STATIC_FILES = [
     '/static/js/app.js',
     '/static/js/pwa.js',
     '/static/js/geolocation.js',
+    '/static/js/uploads.js',
     '/static/manifest.json',
     // Bootstrap CSS and JS
     'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
@@ -203,12 +204,44 @@ async function handleFetch(request) {
     }
 }
 
+// Revalidate a cached response with its ETag / Last-Modified validators.
+// The server answers 304 without a body while the data is unchanged, and
+// the cached copy is served instead.
+async function revalidate(request, cachedResponse) {
+    const url = new URL(request.url);
+    if (!cachedResponse || url.origin !== self.location.origin) {
+        return fetch(request);
+    }
+    
+    const headers = new Headers(request.headers);
+    const etag = cachedResponse.headers.get('ETag');
+    const lastModified = cachedResponse.headers.get('Last-Modified');
+    if (etag) {
+        headers.set('If-None-Match', etag);
+    }
+    if (lastModified) {
+        headers.set('If-Modified-Since', lastModified);
+    }
+    
+    // Navigation requests cannot be cloned with new headers, so build a plain GET;
+    // no-store keeps the browser's HTTP cache from answering for the server
+    const response = await fetch(new Request(request.url, {
+        headers: headers,
+        credentials: 'same-origin',
+        cache: 'no-store'
+    }));
+    
+    return response.status === 304 ? cachedResponse : response;
+}
+
 // Network first strategy
 async function networkFirstStrategy(request) {
+    const cachedResponse = await caches.match(request);
+    
     try {
-        const networkResponse = await fetch(request);
+        const networkResponse = await revalidate(request, cachedResponse);
         
-        if (networkResponse.ok) {
+        if (networkResponse.ok && networkResponse !== cachedResponse) {
             // Cache successful responses
             const cache = await caches.open(DYNAMIC_CACHE_NAME);
             cache.put(request, networkResponse.clone());
@@ -217,7 +250,6 @@ async function networkFirstStrategy(request) {
         return networkResponse;
     } catch (error) {
         // Fall back to cache
-        const cachedResponse = await caches.match(request);
         if (cachedResponse) {
             return cachedResponse;
         }
@@ -250,9 +282,11 @@ async function cacheFirstStrategy(request) {
 // Stale while revalidate strategy
 async function staleWhileRevalidateStrategy(request) {
     const cachedResponse = await caches.match(request);
+    const cachedCopy = cachedResponse && cachedResponse.clone();
     
-    const networkResponse = fetch(request).then(response => {
-        if (response.ok) {
+    const networkResponse = revalidate(request, cachedCopy).then(response => {
+        // On 304 the cached copy comes back and the cache is already current
+        if (response.ok && response !== cachedCopy) {
             const cache = caches.open(DYNAMIC_CACHE_NAME);
             cache.then(c => c.put(request, response.clone()));
         }
@@ -316,31 +350,124 @@ self.addEventListener('sync', (event) => {
     }
 });
 
-// Sync pending reports
+// Offline queue: reports filled in without a connection, with their photo
+// blobs, kept in IndexedDB until /api/sync accepts them. Each report and
+// photo has a client key, so resending a batch never duplicates anything.
+const SYNC_DB_NAME = 'elp-sync';
+const SYNC_STORE = 'relatorios';
+const SYNC_BATCH_SIZE = 20;
+const SYNC_BATCH_BYTES = 12 * 1024 * 1024;  // below the server's 16 MB request limit
+
+function openSyncDb() {
+    return new Promise((resolve, reject) => {
+        const open = indexedDB.open(SYNC_DB_NAME, 1);
+        open.onupgradeneeded = () => open.result.createObjectStore(SYNC_STORE, { keyPath: 'chave' });
+        open.onsuccess = () => resolve(open.result);
+        open.onerror = () => reject(open.error);
+    });
+}
+
+async function syncStore(mode, fn) {
+    const db = await openSyncDb();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(SYNC_STORE, mode);
+        const request = fn(tx.objectStore(SYNC_STORE));
+        tx.oncomplete = () => resolve(request && request.result);
+        tx.onerror = () => reject(tx.error);
+    });
+}
+
+// Queue a report { chave, dados, fotos: [{ chave, arquivo: Blob, nome, tipo_servico, descricao }] }
+async function queueReport(item) {
+    await syncStore('readwrite', store => store.put(item));
+    if (self.registration.sync) {
+        await self.registration.sync.register('background-sync-reports');
+    }
+}
+
+// Get pending reports; items the server rejected wait for the user instead
+async function getPendingReports() {
+    const items = await syncStore('readonly', store => store.getAll());
+    return items.filter(item => !item.erro);
+}
+
+async function savePendingReport(item) {
+    await syncStore('readwrite', store => store.put(item));
+}
+
+async function removePendingReport(chave) {
+    await syncStore('readwrite', store => store.delete(chave));
+}
+
+function syncBatches(items) {
+    const batches = [];
+    let batch = [];
+    let bytes = 0;
+    for (const item of items) {
+        const size = (item.fotos || []).reduce((total, foto) => total + foto.arquivo.size, 0);
+        if (batch.length && (batch.length >= SYNC_BATCH_SIZE || bytes + size > SYNC_BATCH_BYTES)) {
+            batches.push(batch);
+            batch = [];
+            bytes = 0;
+        }
+        batch.push(item);
+        bytes += size;
+    }
+    if (batch.length) {
+        batches.push(batch);
+    }
+    return batches;
+}
+
+async function sendBatch(batch) {
+    const form = new FormData();
+    form.append('lote', JSON.stringify({
+        relatorios: batch.map(item => ({
+            ...item.dados,
+            chave: item.chave,
+            fotos: (item.fotos || []).map(foto => ({
+                chave: foto.chave,
+                tipo_servico: foto.tipo_servico,
+                descricao: foto.descricao
+            }))
+        }))
+    }));
+    batch.forEach(item => (item.fotos || []).forEach(foto => form.append(foto.chave, foto.arquivo, foto.nome)));
+    
+    const response = await fetch('/api/sync', { method: 'POST', body: form, credentials: 'same-origin' });
+    if (!response.ok) {
+        // Network and server errors reject, so the browser retries the sync later
+        throw new Error(`Sync failed with status ${response.status}`);
+    }
+    return (await response.json()).resultados;
+}
+
+// Drain the queue through /api/sync, one request per batch
 async function syncReports() {
     try {
-        // This would sync any pending reports stored in IndexedDB
-        // For now, we'll just log the action
-        console.log('Service Worker: Syncing pending reports...');
-        
-        // Get pending reports from IndexedDB or localStorage
         const pendingReports = await getPendingReports();
+        console.log('Service Worker: Syncing pending reports:', pendingReports.length);
         
-        for (const report of pendingReports) {
-            try {
-                await fetch('/reports/create', {
-                    method: 'POST',
-                    body: JSON.stringify(report),
-                    headers: {
-                        'Content-Type': 'application/json',
-                    }
-                });
-                
-                // Remove from pending after successful sync
-                await removePendingReport(report.id);
-                
-            } catch (error) {
-                console.error('Service Worker: Failed to sync report:', error);
+        for (const batch of syncBatches(pendingReports)) {
+            const resultados = await sendBatch(batch);
+            
+            for (const [index, resultado] of resultados.entries()) {
+                const item = batch[index];
+                if (resultado.status === 'erro') {
+                    item.erro = resultado.erro;
+                    await savePendingReport(item);
+                    continue;
+                }
+                // Keep only the photos that still have to be sent
+                const falhas = (resultado.fotos || []).filter(foto => foto.status === 'erro');
+                if (!falhas.length) {
+                    await removePendingReport(item.chave);
+                    continue;
+                }
+                const chaves = new Set(falhas.map(foto => foto.chave));
+                item.fotos = item.fotos.filter(foto => chaves.has(foto.chave));
+                item.erro = falhas[0].erro;
+                await savePendingReport(item);
             }
         }
     } catch (error) {
@@ -349,27 +476,9 @@ async function syncReports() {
     }
 }
 
-// Sync pending photos
+// Photos travel with their reports in the same batches
 async function syncPhotos() {
-    try {
-        console.log('Service Worker: Syncing pending photos...');
-        // Implementation for photo sync would go here
-    } catch (error) {
-        console.error('Service Worker: Sync photos failed:', error);
-        throw error;
-    }
-}
-
-// Get pending reports (placeholder - would use IndexedDB in production)
-async function getPendingReports() {
-    // This would retrieve pending reports from IndexedDB
-    return [];
-}
-
-// Remove pending report (placeholder)
-async function removePendingReport(reportId) {
-    // This would remove the report from IndexedDB
-    console.log('Service Worker: Removed pending report:', reportId);
+    return syncReports();
 }
 
 // Handle push notifications
@@ -455,6 +564,18 @@ self.addEventListener('message', (event) => {
                 cache.then(c => c.add(event.data.url));
                 break;
                 
+            case 'queueReport':
+                event.waitUntil(queueReport(event.data.item).then(() => {
+                    if (event.source) {
+                        event.source.postMessage({ action: 'reportQueued', chave: event.data.item.chave });
+                    }
+                }));
+                break;
+                
+            case 'syncNow':
+                event.waitUntil(syncReports().catch(() => null));
+                break;
+                
             case 'clearCache':
                 caches.keys().then(cacheNames => {
                     return Promise.all(
@@ -0,0 +1,185 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+
+from flask import current_app
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Arquivo, Foto
+import metrics
+
+# Content-addressed photo storage. Uploads are hashed while they stream to
+# disk and stored once per distinct content at <aa>/<bb>/<sha256>.<ext>
+# inside the upload folder; Arquivo rows count the photos that reference
+# each blob. Derivatives live next to their blob as <sha256>_<variante>.<ext>
+# and are shared by every photo of the same content. A blob keeps the path
+# of its first upload: later uploads of the same bytes reuse it whatever
+# their extension. Uploads are staged in UPLOAD_TMP_FOLDER, outside the
+# publicly served upload folder.
+#
+# A blob whose last photo is released keeps its row at zero references
+# until delete_files removes the row and the files in one transaction. The
+# uncommitted delete holds the row (the database on SQLite), so an upload
+# of the same bytes waits for it in _add_reference and then finds the blob
+# gone and moves its own copy into place.
+
+CHUNK_SIZE = 64 * 1024
+
+def blob_name(digest, extension):
+    return os.path.join(digest[:2], digest[2:4], f"{digest}.{extension}")
+
+def blob_hash(caminho):
+    """Return the content hash encoded in a stored path, or None for legacy flat names"""
+    if os.sep not in caminho and '/' not in caminho:
+        return None
+    # Derivatives are named <sha256>_<variante>.<ext>
+    return os.path.splitext(os.path.basename(caminho))[0].split('_')[0]
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+
+def _add_reference(digest, caminho, tamanho):
+    """Count one more reference to a blob, creating its row at caminho on first use; return its path"""
+    stmt = update(Arquivo).where(Arquivo.hash == digest).values(
+        referencias=Arquivo.referencias + 1).returning(Arquivo.caminho_arquivo)
+    existente = db.session.execute(stmt).scalar()
+    if existente:
+        return existente
+    try:
+        with db.session.begin_nested():
+            db.session.add(Arquivo(hash=digest, caminho_arquivo=caminho, tamanho=tamanho, referencias=1))
+        return caminho
+    except IntegrityError:
+        # Another request stored the same content first
+        return db.session.execute(stmt).scalar()
+
+def store_file(source, filename):
+    """Stream a file object into storage; return (caminho_arquivo, tamanho)"""
+    tmp_folder = current_app.config['UPLOAD_TMP_FOLDER']
+    os.makedirs(tmp_folder, exist_ok=True)
+    
+    digest = hashlib.sha256()
+    tamanho = 0
+    with metrics.timer('elp_photo_upload_seconds', etapa='arquivo'):
+        with tempfile.NamedTemporaryFile(dir=tmp_folder, delete=False) as tmp:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
+                tamanho += len(chunk)
+        metrics.inc('elp_photo_upload_bytes_total', tamanho, etapa='arquivo')
+        return _place(tmp.name, digest.hexdigest(), tamanho, filename)
+
+def store_assembled(path, filename):
+    """Move a fully received staged file into storage; return (caminho_arquivo, tamanho)"""
+    digest = hashlib.sha256()
+    tamanho = 0
+    with metrics.timer('elp_photo_upload_seconds', etapa='montagem'):
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                tamanho += len(chunk)
+        return _place(path, digest.hexdigest(), tamanho, filename)
+
+def _move(src, dst):
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Staging on another filesystem: copy next to dst, then rename into place
+        tmp_dst = f"{dst}.{os.getpid()}.tmp"
+        shutil.copyfile(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+        os.remove(src)
+
+def _place(tmp_path, digest, tamanho, filename):
+    # Content already stored keeps its recorded path, so dedup holds across extensions
+    caminho = _add_reference(digest, blob_name(digest, _extension(filename)), tamanho)
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], caminho)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _move(tmp_path, path)
+    return caminho, tamanho
+
+def store_upload(file):
+    """Store a werkzeug FileStorage; return (caminho_arquivo, tamanho)"""
+    return store_file(file.stream, file.filename)
+
+def release_photo(foto):
+    """Drop a photo's reference to its blob; return files to delete after commit"""
+    digest = blob_hash(foto.caminho_arquivo)
+    files = [foto.caminho_arquivo] + [d.caminho_arquivo for d in foto.derivados]
+    if digest is None:
+        # Legacy flat upload owned by this photo alone
+        return files
+    
+    arquivo = Arquivo.query.filter_by(hash=digest).with_for_update().first()
+    if arquivo is None:
+        return files
+    arquivo.referencias -= 1
+    return files if arquivo.referencias <= 0 else []
+
+def delete_files(caminhos):
+    """Delete released files, skipping blobs that were referenced again meanwhile"""
+    por_hash = {}
+    for caminho in caminhos:
+        por_hash.setdefault(blob_hash(caminho), []).append(caminho)
+    
+    _remove(por_hash.pop(None, []))
+    for digest, arquivos in por_hash.items():
+        # The row stays locked until the files are gone
+        removido = db.session.execute(delete(Arquivo).where(
+            Arquivo.hash == digest, Arquivo.referencias <= 0)).rowcount
+        if removido:
+            _remove(arquivos)
+        db.session.commit()
+
+def _remove(caminhos):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    for caminho in caminhos:
+        try:
+            os.remove(os.path.join(upload_folder, caminho))
+        except OSError:
+            pass
+
+def migrate_legacy_uploads(batch_size=200):
+    """Move flat uploads referenced by Foto rows into content-addressed storage"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    foto_ids = [foto_id for (foto_id,) in db.session.query(Foto.id).filter(
+        ~Foto.caminho_arquivo.contains('/')).order_by(Foto.id)]
+    migrated = 0
+    
+    for start in range(0, len(foto_ids), batch_size):
+        for foto in Foto.query.filter(Foto.id.in_(foto_ids[start:start + batch_size])):
+            legacy_path = os.path.join(upload_folder, foto.caminho_arquivo)
+            if not os.path.exists(legacy_path):
+                current_app.logger.warning(f"Upload not found, skipping: {foto.caminho_arquivo}")
+                continue
+            
+            with open(legacy_path, 'rb') as source:
+                caminho, tamanho = store_file(source, foto.caminho_arquivo)
+            os.remove(legacy_path)
+            
+            base = os.path.splitext(caminho)[0]
+            for derivado in foto.derivados:
+                new_name = f"{base}_{derivado.variante}.{_extension(derivado.caminho_arquivo)}"
+                old_path = os.path.join(upload_folder, derivado.caminho_arquivo)
+                new_path = os.path.join(upload_folder, new_name)
+                if os.path.exists(old_path):
+                    if os.path.exists(new_path):
+                        os.remove(old_path)
+                    else:
+                        os.replace(old_path, new_path)
+                derivado.caminho_arquivo = new_name
+            
+            foto.caminho_arquivo = caminho
+            foto.tamanho = tamanho
+            migrated += 1
+        db.session.commit()
+    
+    return migrated
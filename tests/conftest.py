@@ -0,0 +1,83 @@
+import itertools
+import logging
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+# The app reads its configuration at import. Tests get a throwaway SQLite
+# file unless TEST_DATABASE_URL points at an empty database (e.g. a local
+# Postgres, where the report numbering test exercises real row locks);
+# DATABASE_URL is never used, so a production database is never touched.
+# The SQLite timeout lets concurrent tests wait for its write lock.
+PASTA = tempfile.mkdtemp(prefix='elp-tests-')
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or \
+    'sqlite:///' + os.path.join(PASTA, 'tests.db') + '?timeout=60'
+os.environ['PDF_CACHE_FOLDER'] = os.path.join(PASTA, 'pdf_cache')
+os.environ['UPLOAD_TMP_FOLDER'] = os.path.join(PASTA, 'uploads_tmp')
+os.environ['METRICS_DIR'] = os.path.join(PASTA, 'metrics')
+os.environ['PROFILE_DIR'] = os.path.join(PASTA, 'profiles')
+os.environ['USER_CACHE_DIR'] = os.path.join(PASTA, 'user_cache')
+os.environ['EMAIL_BACKGROUND_SENDER'] = 'false'
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    import bootstrap
+
+    logging.disable(logging.WARNING)
+    app.config['UPLOAD_FOLDER'] = os.path.join(PASTA, 'uploads')
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with app.app_context():
+        bootstrap.run()
+    yield app
+    logging.disable(logging.NOTSET)
+
+@pytest.fixture(scope='session')
+def login(app):
+    """Return a function giving a test client logged in as a user"""
+    from seed_data import SENHA
+
+    def client_as(email, password=SENHA):
+        client = app.test_client()
+        response = client.post('/login', data={'email': email, 'password': password})
+        assert response.status_code == 302, f"login de {email} falhou"
+        return client
+    return client_as
+
+_numeros = itertools.count(1)
+
+@pytest.fixture(scope='session')
+def new_user(app):
+    """Return a function creating a user who logs in with seed_data.SENHA; it returns (id, email)"""
+    from werkzeug.security import generate_password_hash
+    from models import db, User
+    from seed_data import SENHA
+
+    senha_hash = generate_password_hash(SENHA)
+    def create(role='user'):
+        numero = next(_numeros)
+        with app.app_context():
+            user = User(nome=f'Usuário {numero}', email=f'teste{numero}@testes.elp', role=role, senha_hash=senha_hash)
+            db.session.add(user)
+            db.session.commit()
+            return user.id, user.email
+    return create
+
+@pytest.fixture(scope='session')
+def new_obra(app):
+    """Return a function creating an obra for a user; it returns the obra's id"""
+    from models import db, Obra
+
+    def create(responsavel_id, **campos):
+        with app.app_context():
+            obra = Obra(nome=f'Obra {next(_numeros)}', tipo='Residencial', responsavel_id=responsavel_id, **campos)
+            db.session.add(obra)
+            db.session.commit()
+            return obra.id
+    return create
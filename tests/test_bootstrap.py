@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Workers import the app without touching the database; the schema and the
+# default data come from 'flask bootstrap', run once per deploy. Both run in
+# a fresh interpreter against a database of their own.
+
+def run(tmp_path, *args):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + str(tmp_path / 'novo.db'), FLASK_APP='app')
+    resultado = subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True,
+                               timeout=120)
+    assert resultado.returncode == 0, resultado.stderr
+    return resultado.stdout
+
+def tables(tmp_path):
+    path = tmp_path / 'novo.db'
+    if not path.exists():
+        return set()
+    with sqlite3.connect(path) as conn:
+        return {nome for (nome,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def test_importing_the_app_leaves_the_database_alone(tmp_path):
+    run(tmp_path, '-c', 'import main')
+    assert tables(tmp_path) == set()
+
+def test_bootstrap_migrates_and_seeds_once(tmp_path):
+    assert 'Admin user created' in run(tmp_path, '-m', 'flask', 'bootstrap')
+    assert {'users', 'obras', 'checklists', 'schema_migrations'} <= tables(tmp_path)
+    assert 'Admin user created' not in run(tmp_path, '-m', 'flask', 'bootstrap')
+    with sqlite3.connect(tmp_path / 'novo.db') as conn:
+        assert conn.execute("SELECT count(*) FROM users WHERE role = 'admin'").fetchone() == (1,)
+        assert conn.execute("SELECT count(*) FROM obras").fetchone() == (1,)
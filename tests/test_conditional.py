@@ -0,0 +1,68 @@
+import pytest
+
+import conditional
+from models import db, Contador, Contato, Obra, Relatorio
+
+def versao(tabela):
+    contador = db.session.get(Contador, f'versao_{tabela}', populate_existing=True)
+    return contador.valor if contador else 0
+
+def test_versions_are_bumped_by_the_writing_commit_not_by_flushes(app):
+    with app.app_context():
+        antes = versao('contatos')
+        db.session.add(Contato(nome='Fornecedor', obra_id=Obra.query.first().id))
+        db.session.flush()
+        assert versao('contatos') == antes
+        db.session.commit()
+        assert versao('contatos') == antes + 1
+
+        db.session.add(Contato(nome='Descartado', obra_id=Obra.query.first().id))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert versao('contatos') == antes + 1
+
+def test_a_rolled_back_savepoint_keeps_earlier_changes_pending(app):
+    with app.app_context():
+        antes = versao('contatos')
+        db.session.add(Contato(nome='Antes do savepoint', obra_id=Obra.query.first().id))
+        db.session.flush()
+        savepoint = db.session.begin_nested()
+        savepoint.rollback()
+        db.session.commit()
+        assert versao('contatos') == antes + 1
+
+def test_a_failed_bump_fails_the_commit(app, monkeypatch):
+    def falha(conn, tabelas, agora=None):
+        raise RuntimeError('contadores indisponíveis')
+
+    with app.app_context():
+        antes = Contato.query.count()
+        monkeypatch.setattr(conditional, 'bump_versions', falha)
+        db.session.add(Contato(nome='Não gravado', obra_id=Obra.query.first().id))
+        with pytest.raises(RuntimeError):
+            db.session.commit()
+        db.session.rollback()
+        monkeypatch.undo()
+        assert Contato.query.count() == antes
+
+def test_a_rendered_pdf_changes_the_admin_reports_etag(app, login):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    client = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    with app.app_context():
+        obra_id = Obra.query.first().id
+    assert client.post('/reports/create', data={'obra_id': obra_id, 'atividades': 'Com PDF'}).status_code == 302
+    url = '/admin/reports?status=all'
+    client.get(url)  # shows the creation's flash message, which is never cached
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        relatorio = Relatorio.query.filter_by(obra_id=obra_id).order_by(Relatorio.id.desc()).first()
+        relatorio.pdf_path = 'relatorio.pdf'
+        db.session.commit()
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
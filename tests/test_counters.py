@@ -0,0 +1,32 @@
+from sqlalchemy import func, select
+
+from models import db, Contador, Relatorio
+import counters
+
+def test_every_counter_has_a_row_after_migrating(app):
+    with app.app_context():
+        chaves = set(db.session.execute(select(Contador.chave)).scalars())
+    assert set(counters.COUNTERS) <= chaves
+
+def test_created_reports_are_counted(app, login):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    client = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    with app.app_context():
+        antes = counters.get_counters('relatorios', 'relatorios_pendente')
+    for _ in range(3):
+        assert client.post('/reports/create', data={'obra_id': 1, 'atividades': 'Contagem'}).status_code == 302
+    with app.app_context():
+        depois = counters.get_counters('relatorios', 'relatorios_pendente')
+        total = db.session.execute(select(func.count()).select_from(Relatorio)).scalar()
+    assert depois['relatorios'] == antes['relatorios'] + 3 == total
+    assert depois['relatorios_pendente'] == antes['relatorios_pendente'] + 3
+
+def test_reading_counters_leaves_the_transaction_alone(app):
+    with app.app_context():
+        db.session.delete(db.session.get(Contador, 'checklists'))
+        db.session.flush()
+        assert counters.get_counters('checklists')['checklists'] >= 1
+        # Still the caller's to commit or roll back
+        db.session.rollback()
+        assert db.session.get(Contador, 'checklists') is not None
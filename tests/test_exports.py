@@ -0,0 +1,53 @@
+import io
+import zipfile
+from datetime import date
+
+import pdf_cache
+from models import db, Relatorio
+
+def add_reports(app, usuario_id, obra_id, relatorios):
+    with app.app_context():
+        db.session.add_all(Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=i,
+                                     codigo_relatorio=f'ELP-Z-{i:03d}-v1', atividades=f'Etapa {i}',
+                                     status=status, data=data)
+                           for i, (status, data) in enumerate(relatorios, 1))
+        db.session.commit()
+
+def export(client, obra_id, **filtros):
+    response = client.get(f'/obras/{obra_id}/relatorios.zip', query_string=filtros, buffered=False)
+    assert response.status_code == 200 and response.is_streamed
+    partes = list(response.response)
+    response.close()
+    return zipfile.ZipFile(io.BytesIO(b''.join(partes))), len(partes)
+
+def test_an_obra_is_exported_as_a_streamed_zip_of_pdfs(app, login, new_user, new_obra, monkeypatch):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    usuario_id, email = new_user()
+    obra_id = new_obra(usuario_id)
+    add_reports(app, usuario_id, obra_id, [('aprovado', date(2026, 2, dia)) for dia in range(1, 8)])
+    with app.app_context():
+        # One report already cached, the rest rendered by the pool, at most two queued ahead
+        pdf_cache.render(Relatorio.query.filter_by(obra_id=obra_id, numero_seq=3).one())
+    monkeypatch.setitem(app.config, 'PDF_WORKERS', 1)
+
+    arquivo, partes = export(login(ADMIN_EMAIL, ADMIN_PASSWORD), obra_id)
+    assert arquivo.testzip() is None
+    assert arquivo.namelist() == [f'relatorio_{i:03d}_v1.pdf' for i in range(1, 8)]
+    assert all(arquivo.read(nome).startswith(b'%PDF') for nome in arquivo.namelist())
+    assert partes > 7
+
+    assert login(email).get(f'/obras/{obra_id}/relatorios.zip').status_code == 302
+
+def test_the_export_follows_its_status_and_date_filters(app, login, new_user, new_obra):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    usuario_id, _ = new_user()
+    obra_id = new_obra(usuario_id)
+    add_reports(app, usuario_id, obra_id, [('aprovado', date(2026, 3, 1)), ('pendente', date(2026, 3, 2)),
+                                           ('aprovado', date(2026, 3, 10)), ('aprovado', date(2026, 4, 1))])
+    admin = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+
+    arquivo, _ = export(admin, obra_id, status='aprovado', data_inicio='2026-03-01', data_fim='2026-03-31')
+    assert arquivo.namelist() == ['relatorio_001_v1.pdf', 'relatorio_003_v1.pdf']
+    assert admin.get(f'/obras/{obra_id}/relatorios.zip?data_inicio=01/03/2026').status_code == 302
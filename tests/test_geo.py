@@ -0,0 +1,33 @@
+import geo
+from models import db, Obra, User
+
+def test_locate_obra_checks_each_candidate_against_its_own_fence(app):
+    from bootstrap import ADMIN_EMAIL
+
+    # In the open Atlantic, away from any seeded obra
+    lat, lon = 0.0, -30.0
+    with app.app_context():
+        admin = User.query.filter_by(email=ADMIN_EMAIL).one()
+        pequena = Obra(nome='Cerca pequena', tipo='Residencial', responsavel_id=admin.id,
+                       latitude_obra=lat, longitude_obra=lon, raio_geofence=20)
+        grande = Obra(nome='Cerca grande', tipo='Residencial', responsavel_id=admin.id,
+                      latitude_obra=lat + 0.0009, longitude_obra=lon, raio_geofence=500)
+        db.session.add_all([pequena, grande])
+        db.session.commit()
+        geo.invalidate()
+
+        # About 33 m from the small fence's center and 67 m from the large one's
+        encontrada = geo.locate_obra(lat + 0.0003, lon)
+        assert encontrada is not None and encontrada[0] == grande.id
+        assert geo.locate_obra(lat + 0.0003, lon, {pequena.id}) is None
+        assert geo.locate_obra(lat + 0.0001, lon)[0] == pequena.id
+
+def test_an_obra_written_elsewhere_is_found_without_invalidating_the_index(app, new_user, new_obra):
+    lat, lon = 2.0, -28.0
+    with app.app_context():
+        assert geo.locate_obra(lat, lon) is None
+    # Committed without geo.invalidate(), as by another worker
+    usuario_id, _ = new_user()
+    obra_id = new_obra(usuario_id, latitude_obra=lat, longitude_obra=lon)
+    with app.app_context():
+        assert geo.locate_obra(lat, lon)[0] == obra_id
@@ -0,0 +1,72 @@
+import io
+import os
+
+from PIL import Image
+
+from images import VARIANTS, process_photo
+from models import db, Foto, FotoDerivado, Relatorio
+from storage import store_file
+
+def jpeg(largura, altura, orientacao=None):
+    imagem = io.BytesIO()
+    exif = Image.Exif()
+    if orientacao:
+        exif[0x0112] = orientacao
+    Image.new('RGB', (largura, altura), 'steelblue').save(imagem, 'JPEG', exif=exif)
+    imagem.seek(0)
+    return imagem
+
+def new_photo(app, usuario_id, obra_id, arquivo, nome='foto.jpg'):
+    with app.test_request_context():
+        relatorio = Relatorio.query.filter_by(obra_id=obra_id).first()
+        if relatorio is None:
+            relatorio = Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=1,
+                                  codigo_relatorio='ELP-I-001-v1')
+            db.session.add(relatorio)
+            db.session.flush()
+        caminho, tamanho = store_file(arquivo, nome)
+        foto = Foto(relatorio_id=relatorio.id, tipo_servico='Geral', caminho_arquivo=caminho,
+                    tamanho=tamanho, status_processamento='pendente')
+        db.session.add(foto)
+        db.session.commit()
+        return foto.id
+
+def derivatives(app, foto_id):
+    with app.app_context():
+        foto = db.session.get(Foto, foto_id)
+        return foto.status_processamento, {d.variante: (d.caminho_arquivo, d.largura, d.altura)
+                                           for d in foto.derivados}
+
+def test_every_variant_is_written_within_its_bounds(app, new_user, new_obra):
+    usuario_id, _ = new_user()
+    # Orientation 6: the camera was turned, so the photo is displayed portrait
+    foto_id = new_photo(app, usuario_id, new_obra(usuario_id), jpeg(4000, 3000, orientacao=6))
+    process_photo(foto_id)
+
+    status, variantes = derivatives(app, foto_id)
+    assert status == 'concluido' and set(variantes) == {variante for variante, *_ in VARIANTS}
+    for variante, (largura_max, altura_max), formato, _ in VARIANTS:
+        caminho, largura, altura = variantes[variante]
+        assert largura <= largura_max and altura <= altura_max and altura > largura
+        with Image.open(os.path.join(app.config['UPLOAD_FOLDER'], caminho)) as imagem:
+            assert (imagem.format, imagem.size) == (formato, (largura, altura))
+
+def test_a_photo_of_stored_content_reuses_its_derivatives(app, new_user, new_obra):
+    usuario_id, _ = new_user()
+    obra_id = new_obra(usuario_id)
+    conteudo = jpeg(800, 600).getvalue()
+    primeira = new_photo(app, usuario_id, obra_id, io.BytesIO(conteudo))
+    process_photo(primeira)
+    segunda = new_photo(app, usuario_id, obra_id, io.BytesIO(conteudo), 'copia.jpg')
+    process_photo(segunda)
+
+    assert derivatives(app, segunda) == derivatives(app, primeira)
+    with app.app_context():
+        caminhos = [caminho for caminho, *_ in derivatives(app, primeira)[1].values()]
+        assert FotoDerivado.query.filter(FotoDerivado.caminho_arquivo.in_(caminhos)).count() == 2 * len(VARIANTS)
+
+def test_an_unreadable_upload_is_marked_as_failed(app, new_user, new_obra):
+    usuario_id, _ = new_user()
+    foto_id = new_photo(app, usuario_id, new_obra(usuario_id), io.BytesIO(b'nao e uma imagem'))
+    process_photo(foto_id)
+    assert derivatives(app, foto_id) == ('erro', {})
@@ -0,0 +1,97 @@
+import os
+import re
+import zlib
+from datetime import date, timedelta
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from models import db, Relatorio
+from pdf_concat import PdfConcat
+import pdf_renderer  # sets ReportLab to write binary streams
+
+def objects(pdf):
+    """Return {number: bytes of the object} after checking every xref offset"""
+    startxref = int(re.search(rb'startxref\s+(\d+)\s+%%EOF\s*$', pdf).group(1))
+    assert pdf[startxref:].startswith(b'xref\n')
+    secao = pdf[startxref:pdf.index(b'trailer', startxref)].split(b'\n')
+    primeiro, total = map(int, secao[1].split())
+    entradas = secao[2:2 + total]
+    assert primeiro == 0 and len(entradas) == total and entradas[0].endswith(b' f ')
+
+    inicios = {numero: int(entrada[:10]) for numero, entrada in enumerate(entradas) if numero}
+    fins = sorted(inicios.values()) + [startxref]
+    corpo = {}
+    for numero, inicio in inicios.items():
+        assert pdf[inicio:].startswith(b'%d 0 obj' % numero), f'offset errado para o objeto {numero}'
+        corpo[numero] = pdf[inicio:fins[fins.index(inicio) + 1]]
+    trailer = pdf[pdf.index(b'trailer', startxref):]
+    assert int(re.search(rb'/Size (\d+)', trailer).group(1)) == total
+    return corpo, int(re.search(rb'/Root (\d+) 0 R', trailer).group(1))
+
+def pages(pdf):
+    """Return the content of each page in page tree order, checking every reference resolves"""
+    corpo, raiz = objects(pdf)
+    for numero, dados in corpo.items():
+        dicionario = dados.split(b'stream', 1)[0]
+        for referencia in re.findall(rb'(\d+) 0 R', dicionario):
+            assert int(referencia) in corpo, f'objeto {numero} aponta para {int(referencia)}'
+
+    arvore = int(re.search(rb'/Pages (\d+) 0 R', corpo[raiz]).group(1))
+    kids = [int(kid) for kid in re.findall(rb'(\d+) 0 R', re.search(rb'/Kids \[([^\]]*)\]', corpo[arvore]).group(1))]
+    assert int(re.search(rb'/Count (\d+)', corpo[arvore]).group(1)) == len(kids)
+    conteudos = []
+    for kid in kids:
+        assert re.search(rb'/Type /Page\b', corpo[kid]) and b'/Parent %d 0 R' % arvore in corpo[kid]
+        stream = corpo[int(re.search(rb'/Contents (\d+) 0 R', corpo[kid]).group(1))]
+        dados = re.search(rb'stream\r?\n(.*)endstream', stream, re.S).group(1)
+        conteudos.append(zlib.decompress(dados) if b'FlateDecode' in stream else dados)
+    return conteudos
+
+def reportlab_pdf(path, paginas, rotulo):
+    documento = canvas.Canvas(path, pagesize=A4)
+    for pagina in range(paginas):
+        documento.drawString(72, 72, f'{rotulo} {pagina + 1}')
+        documento.showPage()
+    documento.save()
+
+def test_concatenated_files_keep_every_page_in_order(tmp_path):
+    livro = PdfConcat(str(tmp_path / 'livro.pdf'), title='Livro (teste)')
+    esperado = []
+    for indice, paginas in enumerate((1, 3, 2)):
+        path = str(tmp_path / f'parte{indice}.pdf')
+        reportlab_pdf(path, paginas, f'parte{indice}')
+        livro.append(path)
+        esperado += [f'parte{indice} {pagina + 1}'.encode() for pagina in range(paginas)]
+    assert livro.close() == 6
+
+    conteudos = pages((tmp_path / 'livro.pdf').read_bytes())
+    assert len(conteudos) == len(esperado)
+    assert all(rotulo in conteudo for rotulo, conteudo in zip(esperado, conteudos))
+
+def test_a_multi_section_livro_is_one_valid_numbered_pdf(app, new_user, new_obra, monkeypatch, tmp_path):
+    from livro_layout import TOC_ROWS, build_livro
+
+    usuario_id, _ = new_user()
+    obra_id = new_obra(usuario_id)
+    relatorios = TOC_ROWS + 2  # a table of contents of two pages
+    monkeypatch.setitem(app.config, 'LIVRO_SECTION_REPORTS', 10)
+    with app.app_context():
+        inicio = date(2026, 1, 5)
+        db.session.add_all(Relatorio(
+            obra_id=obra_id, usuario_id=usuario_id, numero_seq=i, codigo_relatorio=f'ELP-L-{i:03d}-v1',
+            status='aprovado', data=inicio + timedelta(days=i),
+            atividades='Concretagem e armação do pavimento. ' * (20 * (i % 3))
+        ) for i in range(1, relatorios + 1))
+        db.session.commit()
+
+        destino = str(tmp_path / 'livro.pdf')
+        total, paginas = build_livro(obra_id, destino)
+
+    assert total == relatorios
+    conteudos = pages(open(destino, 'rb').read())
+    assert len(conteudos) == paginas > 1 + 2 + relatorios
+    # Every page's footer carries its final position in the book ('á' is written as \341)
+    for numero, conteudo in enumerate(conteudos, 1):
+        assert b'(P\\341gina %d)' % numero in conteudo, f'página {numero} numerada errado'
+    assert not [nome for nome in os.listdir(tmp_path) if nome != 'livro.pdf']
@@ -0,0 +1,122 @@
+from collections import Counter
+
+from sqlalchemy import func, select
+
+import map_clusters
+from map_clusters import MAX_CLUSTER_ZOOM, cell
+from models import db, ClusterMapa, ClusterMapaPendente, Obra, Relatorio
+
+# Each test places its points in its own patch of the Southern Ocean, away
+# from the seeded obras and from each other.
+
+def bbox(lat, lon):
+    return f'{lon - 1},{lat - 1},{lon + 1},{lat + 1}'
+
+def folded_total(camada, zoom):
+    return db.session.execute(select(func.coalesce(func.sum(ClusterMapa.total), 0)).where(
+        ClusterMapa.camada == camada, ClusterMapa.zoom == zoom)).scalar()
+
+def pending():
+    return db.session.execute(select(func.count()).select_from(ClusterMapaPendente)).scalar()
+
+def add_reports(obra_id, usuario_id, pontos):
+    db.session.add_all(Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=i,
+                                 codigo_relatorio=f'ELP-T-{i:03d}-v1', latitude=lat, longitude=lon)
+                       for i, (lat, lon) in enumerate(pontos, 1))
+    db.session.commit()
+
+def map_totals(client, lat, lon, zoom):
+    response = client.get(f'/api/map?bbox={bbox(lat, lon)}&zoom={zoom}')
+    assert response.status_code == 200
+    totais = Counter()
+    for feature in response.get_json()['features']:
+        totais[feature['properties']['camada']] += feature['properties']['total']
+    return totais
+
+def test_shallower_cells_are_the_deepest_cell_divided():
+    for lat, lon in [(-23.5505, -46.6333), (0.0, 0.0), (51.5, -0.12), (89.0, 180.0), (-89.0, -180.0)]:
+        x, y = cell(lat, lon, MAX_CLUSTER_ZOOM)
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            escala = MAX_CLUSTER_ZOOM - zoom
+            assert cell(lat, lon, zoom) == (x >> escala, y >> escala)
+
+def test_writes_queue_changes_and_their_commit_folds_them(app, new_user):
+    usuario_id, _ = new_user()
+    with app.app_context():
+        antes = [folded_total('obras', zoom) for zoom in range(MAX_CLUSTER_ZOOM + 1)]
+        obra = Obra(nome='Obra no mapa', tipo='Residencial', responsavel_id=usuario_id,
+                    latitude_obra=-60.0, longitude_obra=100.0)
+        db.session.add(obra)
+        db.session.flush()
+        # The writer's transaction leaves the shared cells alone
+        assert folded_total('obras', 0) == antes[0]
+        assert pending() == 1
+        assert (obra.celula_x, obra.celula_y) == cell(-60.0, 100.0, MAX_CLUSTER_ZOOM)
+
+        db.session.commit()
+        assert pending() == 0
+        assert [folded_total('obras', zoom) for zoom in range(MAX_CLUSTER_ZOOM + 1)] == [n + 1 for n in antes]
+
+def test_changes_left_pending_by_a_failed_fold_are_still_counted(app, login, new_user, new_obra, monkeypatch):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    lat, lon = -62.0, 110.0
+    usuario_id, _ = new_user()
+    obra_id = new_obra(usuario_id, latitude_obra=lat, longitude_obra=lon)
+
+    def falha(conn, limit=map_clusters.FOLD_BATCH):
+        raise RuntimeError('fold indisponível')
+
+    monkeypatch.setattr(map_clusters, 'fold', falha)
+    with app.app_context():
+        add_reports(obra_id, usuario_id, [(lat + i / 1000, lon) for i in range(12)])
+        assert pending() == 12
+    monkeypatch.undo()
+
+    admin = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    for zoom in (6, 8, 14):
+        assert map_totals(admin, lat, lon, zoom) == {'obras': 1, 'relatorios': 12}
+    with app.app_context():
+        with db.engine.begin() as conn:
+            assert map_clusters.fold(conn) == 12
+        assert pending() == 0
+    assert map_totals(admin, lat, lon, 8) == {'obras': 1, 'relatorios': 12}
+
+def test_user_clusters_are_grouped_in_sql_without_a_point_limit(app, login, new_user, new_obra):
+    lat, lon = -64.0, 120.0
+    usuario_id, email = new_user()
+    obra_id = new_obra(usuario_id, latitude_obra=lat, longitude_obra=lon)
+    pontos = [(lat + (i % 50) / 100, lon + (i // 50) / 100) for i in range(map_clusters.MAX_POINTS + 100)]
+    with app.app_context():
+        add_reports(obra_id, usuario_id, pontos)
+
+    client = login(email)
+    zoom = 9
+    response = client.get(f'/api/map?bbox={bbox(lat + 0.5, lon + 0.5)}&zoom={zoom}&camadas=relatorios')
+    clusters = Counter()
+    for feature in response.get_json()['features']:
+        longitude, latitude = feature['geometry']['coordinates']
+        clusters[cell(latitude, longitude, zoom)] += feature['properties']['total']
+    assert sum(clusters.values()) == len(pontos)
+    assert clusters == Counter(cell(p_lat, p_lon, zoom) for p_lat, p_lon in pontos)
+
+def test_an_unchanged_map_answers_304_without_building_the_payload(app, login, new_user, new_obra, monkeypatch):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    lat, lon = -66.0, 130.0
+    admin = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    url = f'/api/map?bbox={bbox(lat, lon)}&zoom=6'
+    etag = admin.get(url).headers['ETag']
+
+    def sem_consulta(*args, **kwargs):
+        raise AssertionError('payload montado para uma resposta 304')
+
+    monkeypatch.setattr(map_clusters, 'precomputed_clusters', sem_consulta)
+    assert admin.get(url, headers={'If-None-Match': etag}).status_code == 304
+    monkeypatch.undo()
+
+    usuario_id, _ = new_user()
+    new_obra(usuario_id, latitude_obra=lat, longitude_obra=lon)
+    response = admin.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert [f['properties']['total'] for f in response.get_json()['features']] == [1]
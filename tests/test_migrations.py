@@ -0,0 +1,89 @@
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from models import db
+import map_clusters
+import migrations
+
+# Migrations build the schema from their own frozen table definitions, so
+# these check that a fresh database still ends up with every column the
+# models declare, and that the backfills of migrations 9-12 fill the tables
+# they introduce from data written before them.
+
+@pytest.fixture
+def fresh_app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp_path, 'migracoes.db')
+    db.init_app(app)
+    with app.app_context():
+        yield app
+
+def test_fresh_schema_has_every_model_column(fresh_app):
+    migrations.upgrade()
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        colunas = {c['name'] for c in inspector.get_columns(table.name)}
+        assert {c.name for c in table.columns} <= colunas, table.name
+
+def test_backfills_fill_tables_from_earlier_data(fresh_app):
+    migrations.upgrade(target=8)
+    agora = datetime(2024, 5, 10, 14, 30)
+    campos = ['Equipamentos de Segurança (EPIs)', 'Sinalização de Segurança']
+    with db.engine.begin() as conn:
+        conn.execute(migrations.users_v1.insert().values(
+            id=1, nome='Ana', email='ana@elp.com', senha_hash='x', role='user'))
+        conn.execute(migrations.checklists_v1.insert().values(id=1, nome='Auditoria', campos_json=json.dumps(campos)))
+        conn.execute(migrations.obras_v1.insert().values(
+            id=1, nome='Edifício Fundação', tipo='Residencial', responsavel_id=1, status='ativa',
+            endereco='Rua das Flores, 10', latitude_obra=-23.5505, longitude_obra=-46.6333))
+        conn.execute(migrations.relatorios_v1.insert().values(
+            id=1, obra_id=1, usuario_id=1, numero_seq=1, codigo_relatorio='ELP-2024-001-v1', data=date(2024, 5, 10),
+            atividades='Concretagem da laje', checklist_json=json.dumps({'Equipamentos_de_Segurança_(EPIs)': 'on'}),
+            latitude=-23.5507, longitude=-46.6335, data_criacao=agora))
+        conn.execute(migrations.fotos_v1.insert().values(
+            id=1, relatorio_id=1, tipo_servico='Estrutura', caminho_arquivo='a.jpg', descricao='Armação da viga'))
+
+    # The fence backfill uses its own frozen radius, not this environment's
+    fresh_app.config['GEOFENCE_RADIUS'] = 10
+    migrations.upgrade()
+    with db.engine.begin() as conn:
+        respostas = conn.execute(text(
+            "SELECT campo, conforme, checklist_id FROM respostas_checklist ORDER BY id")).all()
+        assert [(r.campo, bool(r.conforme), r.checklist_id) for r in respostas] == \
+            [(campos[0], True, 1), (campos[1], False, 1)]
+
+        encontrados = conn.execute(text(
+            "SELECT rowid FROM busca_relatorios WHERE busca_relatorios MATCH 'fundacao AND armacao'")).all()
+        assert [r[0] for r in encontrados] == [1]
+
+        distancia, fora = conn.execute(text("SELECT distancia_obra, fora_da_cerca FROM relatorios")).one()
+        assert 0 < distancia < 100 and not fora
+
+        periodos = conn.execute(text(
+            "SELECT camada, periodo, total FROM clusters_mapa WHERE zoom = 0 ORDER BY camada")).all()
+        assert [tuple(r) for r in periodos] == [('obras', '', 1), ('relatorios', '2024-05', 1)]
+
+        celulas = conn.execute(text("SELECT celula_x, celula_y FROM relatorios")).one()
+        assert tuple(celulas) == map_clusters.cell(-23.5507, -46.6335, map_clusters.MAX_CLUSTER_ZOOM)
+
+def test_reports_without_creation_date_are_backfilled(fresh_app):
+    migrations.upgrade(target=16)
+    with db.engine.begin() as conn:
+        conn.execute(migrations.users_v1.insert().values(id=1, nome='Ana', email='ana@elp.com', senha_hash='x'))
+        conn.execute(migrations.obras_v1.insert().values(id=1, nome='Obra', tipo='Residencial', responsavel_id=1))
+        conn.execute(migrations.relatorios_v1.insert(), [
+            {'id': 1, 'obra_id': 1, 'usuario_id': 1, 'numero_seq': 1, 'codigo_relatorio': 'ELP-2020-001-v1',
+             'data': date(2020, 5, 1), 'data_aprovacao': None},
+            {'id': 2, 'obra_id': 1, 'usuario_id': 1, 'numero_seq': 2, 'codigo_relatorio': 'ELP-2020-002-v1',
+             'data': date(2020, 5, 1), 'data_aprovacao': datetime(2020, 5, 3, 9, 0)},
+        ])
+
+    migrations.upgrade()
+    with db.engine.begin() as conn:
+        datas = conn.execute(migrations.relatorios_v1.select().order_by(migrations.relatorios_v1.c.id)).all()
+    assert [r.data_criacao for r in datas] == [datetime(2020, 5, 1), datetime(2020, 5, 3, 9, 0)]
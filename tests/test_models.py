@@ -0,0 +1,10 @@
+from models import Checklist, Relatorio
+
+def test_parsed_json_is_not_shared_between_accesses():
+    relatorio = Relatorio(checklist_json='{"EPIs": "on"}')
+    relatorio.checklist_data['Sinalizacao'] = 'on'
+    assert relatorio.checklist_data == {'EPIs': 'on'}
+
+    checklist = Checklist(campos_json='["EPIs"]')
+    checklist.campos.append('Sinalizacao')
+    assert checklist.campos == ['EPIs']
@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+import outbox
+from models import db, EmailOutbox
+from smtp_sink import SMTPSink
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    """An in-process SMTP sink the app's mail settings point at"""
+    sink = SMTPSink(port=0).start()
+    estado = app.extensions['mail']
+    for atributo, valor in {'server': '127.0.0.1', 'port': sink.port, 'use_tls': False, 'use_ssl': False,
+                            'username': 'elp', 'password': 'senha'}.items():
+        monkeypatch.setattr(estado, atributo, valor)
+    monkeypatch.setitem(app.config, 'MAIL_USERNAME', 'elp')
+    yield sink
+    sink.stop()
+
+def closed_port():
+    sink = SMTPSink(port=0)
+    sink.server.server_close()
+    return sink.port
+
+def queue(*destinatarios):
+    emails = [outbox.queue_email(destinatario, 'Relatório aprovado') for destinatario in destinatarios]
+    db.session.commit()
+    return [email.id for email in emails]
+
+def delivered_to(sink, destinatario):
+    return [m for m in sink.messages if any(destinatario in rcpt for rcpt in m['to'])]
+
+def test_failed_deliveries_back_off_exponentially_then_succeed(app, smtp, monkeypatch):
+    monkeypatch.setitem(app.config, 'EMAIL_RETRY_BASE', 60)
+    monkeypatch.setattr(app.extensions['mail'], 'port', closed_port())
+    with app.app_context():
+        email_id, = queue('backoff@testes.elp')
+        for tentativa, espera in ((1, 60), (2, 120)):
+            antes = datetime.utcnow()
+            outbox.drain()
+            email = db.session.get(EmailOutbox, email_id, populate_existing=True)
+            assert (email.status, email.tentativas) == ('pendente', tentativa)
+            assert antes + timedelta(seconds=espera) <= email.proxima_tentativa <= \
+                datetime.utcnow() + timedelta(seconds=espera)
+            # Not retried before its time
+            outbox.drain()
+            assert db.session.get(EmailOutbox, email_id, populate_existing=True).tentativas == tentativa
+            email.proxima_tentativa = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+
+        monkeypatch.setattr(app.extensions['mail'], 'port', smtp.port)
+        outbox.drain()
+        email = db.session.get(EmailOutbox, email_id, populate_existing=True)
+        assert email.status == 'enviado' and email.data_envio is not None
+    assert len(delivered_to(smtp, 'backoff@testes.elp')) == 1
+
+def test_an_email_fails_for_good_after_max_attempts(app, smtp, monkeypatch):
+    monkeypatch.setitem(app.config, 'EMAIL_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(app.extensions['mail'], 'port', closed_port())
+    with app.app_context():
+        email_id, = queue('desiste@testes.elp')
+        for _ in range(2):
+            email = db.session.get(EmailOutbox, email_id, populate_existing=True)
+            email.proxima_tentativa = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            outbox.drain()
+        email = db.session.get(EmailOutbox, email_id, populate_existing=True)
+        assert (email.status, email.tentativas) == ('erro', 2)
+
+def test_concurrent_senders_claim_disjoint_batches(app):
+    with app.app_context():
+        nossos = set(queue(*(f'lote{i}@testes.elp' for i in range(40))))
+
+    def claim(_):
+        with app.app_context():
+            try:
+                return [email.id for email in outbox.claim_batch(25)]
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(4) as pool:
+        reservados = [email_id for lote in pool.map(claim, range(4)) for email_id in lote]
+    assert len(reservados) == len(set(reservados))
+    assert nossos <= set(reservados)
+
+def test_a_request_starts_the_sender_that_delivers_pending_email(app, smtp, monkeypatch):
+    with app.app_context():
+        queue('reinicio@testes.elp')
+    monkeypatch.setitem(app.config, 'EMAIL_BACKGROUND_SENDER', True)
+    try:
+        assert app.test_client().get('/login').status_code == 200
+        prazo = time.monotonic() + 10
+        while not delivered_to(smtp, 'reinicio@testes.elp') and time.monotonic() < prazo:
+            time.sleep(0.05)
+        assert delivered_to(smtp, 'reinicio@testes.elp')
+    finally:
+        # Stop the sender before the mail settings are restored
+        app.config['EMAIL_BACKGROUND_SENDER'] = False
+        outbox._wake.set()
+        if outbox._sender is not None:
+            outbox._sender.join(timeout=10)
@@ -0,0 +1,48 @@
+import os
+
+import pdf_cache
+from models import db, Relatorio
+
+def new_report(app, usuario_id, obra_id, atividades='Armação das vigas'):
+    with app.app_context():
+        numero = Relatorio.query.filter_by(obra_id=obra_id).count() + 1
+        relatorio = Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=numero,
+                              codigo_relatorio=f'ELP-P-{numero:03d}-v1', atividades=atividades)
+        db.session.add(relatorio)
+        db.session.commit()
+        return relatorio.id
+
+def test_an_unchanged_report_is_served_from_the_cache(app, login, new_user, new_obra, monkeypatch):
+    usuario_id, email = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    renders = []
+    gerar = pdf_cache.generate_pdf_report
+
+    def contado(relatorio, path):
+        renders.append(relatorio.id)
+        return gerar(relatorio, path)
+
+    monkeypatch.setattr(pdf_cache, 'generate_pdf_report', contado)
+    with app.app_context():
+        relatorio = db.session.get(Relatorio, relatorio_id)
+        nome = pdf_cache.render(relatorio)
+        assert pdf_cache.render(relatorio) == nome and renders == [relatorio_id]
+
+    client = login(email)
+    cached = client.post(f'/reports/pdf/{relatorio_id}/jobs')
+    assert cached.status_code == 200 and cached.get_json()['status'] == 'concluido'
+    assert client.get(f'/reports/pdf/{relatorio_id}').data == \
+        open(os.path.join(app.config['PDF_CACHE_FOLDER'], nome), 'rb').read()
+    assert renders == [relatorio_id]
+
+def test_the_cache_key_follows_what_the_pdf_shows(app, new_user, new_obra):
+    usuario_id, _ = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    with app.app_context():
+        relatorio = db.session.get(Relatorio, relatorio_id)
+        chave = pdf_cache.cache_key(relatorio)
+        relatorio.pdf_path = 'outro.pdf'
+        assert pdf_cache.cache_key(relatorio) == chave
+        relatorio.atividades = 'Armação das vigas e pilares'
+        assert pdf_cache.cache_key(relatorio) != chave
+        db.session.rollback()
@@ -0,0 +1,53 @@
+import time
+
+from models import db, Relatorio
+
+def new_report(app, usuario_id, obra_id, atividades='Armação das vigas'):
+    with app.app_context():
+        numero = Relatorio.query.filter_by(obra_id=obra_id).count() + 1
+        relatorio = Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=numero,
+                              codigo_relatorio=f'ELP-P-{numero:03d}-v1', atividades=atividades)
+        db.session.add(relatorio)
+        db.session.commit()
+        return relatorio.id
+
+def wait_for(client, status_url, prazo=60):
+    fim = time.monotonic() + prazo
+    while time.monotonic() < fim:
+        job = client.get(status_url).get_json()
+        if job['status'] not in ('pendente', 'processando'):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f'job ainda ativo após {prazo}s')
+
+def test_a_queued_pdf_is_rendered_in_the_background_and_downloaded(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    client = login(email)
+
+    response = client.post(f'/reports/pdf/{relatorio_id}/jobs')
+    assert response.status_code == 202
+    job = response.get_json()
+    # A second request while it renders joins the same job
+    repetido = client.post(f'/reports/pdf/{relatorio_id}/jobs').get_json()
+    assert repetido.get('id', job['id']) == job['id']
+
+    job = wait_for(client, job['status_url'])
+    assert job['status'] == 'concluido'
+    download = client.get(job['download_url'])
+    assert download.status_code == 200 and download.data.startswith(b'%PDF')
+
+def test_a_full_queue_answers_503_and_jobs_are_private(app, login, new_user, new_obra, monkeypatch):
+    usuario_id, email = new_user()
+    _, outro_email = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    client = login(email)
+
+    monkeypatch.setitem(app.config, 'PDF_MAX_QUEUED', 0)
+    cheia = client.post(f'/reports/pdf/{relatorio_id}/jobs')
+    assert cheia.status_code == 503 and cheia.headers['Retry-After']
+    monkeypatch.undo()
+
+    job = client.post(f'/reports/pdf/{relatorio_id}/jobs').get_json()
+    assert login(outro_email).get(job['status_url']).status_code == 403
+    wait_for(client, job['status_url'])
@@ -0,0 +1,56 @@
+import os
+
+from PIL import Image
+
+from models import db, Foto, FotoDerivado, Relatorio
+from pdf_renderer import get_renderer
+from utils import generate_pdf_report
+
+def new_report(app, usuario_id, obra_id):
+    with app.app_context():
+        relatorio = Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=1,
+                              codigo_relatorio='ELP-R-001-v1', atividades='Reboco externo')
+        db.session.add(relatorio)
+        db.session.commit()
+        return relatorio.id
+
+def uploads(app):
+    return {os.path.join(pasta, nome) for pasta, _, nomes in os.walk(app.config['UPLOAD_FOLDER']) for nome in nomes}
+
+def test_a_report_renders_into_a_rewound_buffer_without_touching_uploads(app, new_user, new_obra):
+    usuario_id, _ = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    antes = uploads(app)
+    with app.app_context():
+        buffer = generate_pdf_report(db.session.get(Relatorio, relatorio_id))
+    with buffer:
+        pdf = buffer.read()
+    assert pdf.startswith(b'%PDF') and pdf.rstrip().endswith(b'%%EOF')
+    # Streams are raw bytes, not ASCII85 text
+    assert b'/ASCII85Decode' not in pdf
+    assert uploads(app) == antes
+
+def test_the_renderer_is_shared_and_prefers_the_pdf_derivative(app, new_user, new_obra, tmp_path):
+    usuario_id, _ = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    pasta = os.path.join(app.config['UPLOAD_FOLDER'], 'renderer')
+    os.makedirs(pasta, exist_ok=True)
+    Image.new('RGB', (4000, 3000), 'gray').save(os.path.join(pasta, 'original.jpg'))
+    Image.new('RGB', (1200, 900), 'gray').save(os.path.join(pasta, 'original_pdf.jpg'))
+    assert get_renderer() is get_renderer()
+
+    with app.app_context():
+        foto = Foto(relatorio_id=relatorio_id, tipo_servico='Fachada', caminho_arquivo='renderer/original.jpg',
+                    derivados=[FotoDerivado(variante='pdf', caminho_arquivo='renderer/original_pdf.jpg',
+                                            largura=1200, altura=900)])
+        ausente = Foto(relatorio_id=relatorio_id, tipo_servico='Cobertura', caminho_arquivo='renderer/ausente.jpg')
+        db.session.add_all([foto, ausente])
+        db.session.commit()
+
+        imagem = get_renderer().photo(foto, app.config['UPLOAD_FOLDER'])
+        assert imagem.filename == os.path.join(pasta, 'original_pdf.jpg')
+        assert get_renderer().photo(ausente, app.config['UPLOAD_FOLDER']) is None
+        # A missing photo is named in the PDF instead of failing it
+        destino = str(tmp_path / 'relatorio.pdf')
+        assert generate_pdf_report(db.session.get(Relatorio, relatorio_id), destino) == destino
+    assert open(destino, 'rb').read().startswith(b'%PDF')
@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, func, select
+
+import seed_data
+
+# The list views eager-load what their templates show, so the number of
+# statements a page issues must not grow with the rows it lists. Each view
+# is counted once with N reports and again with about 10×N.
+
+VIEWS = ['/reports?per_page=100', '/admin/reports?status=all&per_page=100',
+         '/admin/reports/pending?per_page=100', '/dashboard', '/contacts', '/projects']
+USER_VIEWS = ['/reports?per_page=100', '/dashboard', '/contacts', '/projects']
+
+# usuarios, obras, relatorios, imagens; the second batch brings the total to 10×
+LOTE_INICIAL = (6, 4, 8, 1)
+LOTE_ADICIONAL = (54, 36, 72, 1)
+
+def seed(app, volumes, rodada):
+    from models import db
+    import counters
+
+    usuarios, obras, relatorios, imagens = volumes
+    with app.app_context():
+        with db.engine.begin() as conn:
+            seed_data.seed(conn, app.config['UPLOAD_FOLDER'], usuarios=usuarios, obras=obras,
+                           relatorios=relatorios, imagens=imagens, seed=rodada)
+        counters.rebuild()
+
+def busiest_user(app):
+    """Email of the regular user with the most reports"""
+    from models import db, User, Relatorio
+
+    with app.app_context():
+        return db.session.execute(
+            select(User.email).join(Relatorio, Relatorio.usuario_id == User.id)
+            .where(User.role == 'user').group_by(User.id, User.email)
+            .order_by(func.count().desc(), User.id).limit(1)).scalar()
+
+@contextmanager
+def count_statements(app):
+    from models import db
+
+    contagem = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        contagem.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield contagem
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def measure(app, client, views):
+    resultado = {}
+    for url in views:
+        # The first request warms per-process caches (user, geofence index)
+        assert client.get(url).status_code == 200, url
+        with count_statements(app) as contagem:
+            assert client.get(url).status_code == 200, url
+        resultado[url] = len(contagem)
+    return resultado
+
+@pytest.fixture(scope='module')
+def contagens(app, login):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    seed(app, LOTE_INICIAL, rodada=1)
+    antes = {'admin': measure(app, login(ADMIN_EMAIL, ADMIN_PASSWORD), VIEWS),
+             'usuario': measure(app, login(busiest_user(app)), USER_VIEWS)}
+    seed(app, LOTE_ADICIONAL, rodada=2)
+    depois = {'admin': measure(app, login(ADMIN_EMAIL, ADMIN_PASSWORD), VIEWS),
+              'usuario': measure(app, login(busiest_user(app)), USER_VIEWS)}
+    return antes, depois
+
+@pytest.mark.parametrize('url', VIEWS)
+def test_admin_query_count_constant(contagens, url):
+    antes, depois = contagens
+    assert depois['admin'][url] == antes['admin'][url]
+
+@pytest.mark.parametrize('url', USER_VIEWS)
+def test_user_query_count_constant(contagens, url):
+    antes, depois = contagens
+    assert depois['usuario'][url] == antes['usuario'][url]
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from models import db, Obra, Relatorio, User
+
+# Report numbers come from a per-obra counter row updated in the creating
+# transaction. Parallel creates through the real route must still number an
+# obra's reports 1..N with no gaps and no duplicates. Against SQLite the
+# writers queue on its database lock; TEST_DATABASE_URL pointing at a
+# Postgres exercises the row lock itself.
+
+CREATES = 200
+THREADS = 16
+
+def new_obra(app, nome):
+    from bootstrap import ADMIN_EMAIL
+
+    with app.app_context():
+        admin = User.query.filter_by(email=ADMIN_EMAIL).one()
+        obra = Obra(nome=nome, tipo='Residencial', responsavel_id=admin.id)
+        db.session.add(obra)
+        db.session.commit()
+        return obra.id
+
+def numbering(app, obra_id):
+    with app.app_context():
+        rows = Relatorio.query.filter_by(obra_id=obra_id).with_entities(
+            Relatorio.numero_seq, Relatorio.codigo_relatorio).all()
+    return sorted(numero for numero, _ in rows), sorted(int(codigo.split('-')[2]) for _, codigo in rows)
+
+@pytest.fixture(scope='module')
+def admins(app, login):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    return [login(ADMIN_EMAIL, ADMIN_PASSWORD) for _ in range(THREADS)]
+
+def test_parallel_creates_leave_no_gaps_or_duplicates(app, admins):
+    obra_id = new_obra(app, 'Obra concorrente')
+
+    def create(i):
+        client = admins[i % THREADS]
+        return client.post('/reports/create', data={'obra_id': obra_id, 'atividades': f'Relatório {i}'}).status_code
+
+    # One client per thread: a test client is not meant to be shared
+    with ThreadPoolExecutor(THREADS) as pool:
+        por_cliente = [pool.submit(lambda t: [create(i) for i in range(t, CREATES, THREADS)], t)
+                       for t in range(THREADS)]
+        status = [codigo for futuro in por_cliente for codigo in futuro.result()]
+
+    assert status == [302] * CREATES
+    numeros, codigos = numbering(app, obra_id)
+    assert numeros == list(range(1, CREATES + 1))
+    assert codigos == list(range(1, CREATES + 1))
+
+def test_moving_a_report_renumbers_it_in_the_target_obra(app, admins):
+    client = admins[0]
+    origem, destino = new_obra(app, 'Obra de origem'), new_obra(app, 'Obra de destino')
+    for obra_id in (origem, destino):
+        client.post('/reports/create', data={'obra_id': obra_id, 'atividades': 'Primeiro relatório'})
+    with app.app_context():
+        relatorio = Relatorio.query.filter_by(obra_id=origem).one()
+        relatorio_id, numero_anterior = relatorio.id, relatorio.numero_seq
+
+    response = client.post(f'/reports/{relatorio_id}/edit', data={'obra_id': destino, 'atividades': 'Movido'})
+    assert response.status_code == 302
+
+    with app.app_context():
+        movido = db.session.get(Relatorio, relatorio_id)
+        assert movido.obra_id == destino
+        assert numero_anterior == 1 and movido.numero_seq == 2
+        assert movido.codigo_relatorio.endswith('-002-v1')
+    assert numbering(app, destino) == ([1, 2], [1, 2])
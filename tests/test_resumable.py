@@ -0,0 +1,96 @@
+import io
+import os
+
+from werkzeug.exceptions import ClientDisconnected
+
+import resumable
+from models import db, Foto, Relatorio, UploadParcial
+
+def new_report(app, usuario_id, obra_id):
+    with app.app_context():
+        relatorio = Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=1,
+                              codigo_relatorio='ELP-U-001-v1', atividades='Fotos em blocos')
+        db.session.add(relatorio)
+        db.session.commit()
+        return relatorio.id
+
+def open_upload(client, relatorio_id, conteudo):
+    response = client.post('/api/uploads', json={'relatorio_id': relatorio_id, 'nome': 'laje.jpg',
+                                                 'tamanho': len(conteudo), 'descricao': 'Laje'})
+    assert response.status_code == 201
+    return response.headers['Location']
+
+def put(client, url, offset, bloco):
+    return client.patch(url, data=bloco, headers={'Upload-Offset': str(offset)})
+
+def stored_bytes(app, foto_id):
+    with app.app_context():
+        foto = db.session.get(Foto, foto_id)
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], foto.caminho_arquivo), 'rb') as arquivo:
+            return arquivo.read()
+
+class DroppedStream:
+    """A request body whose connection drops after some bytes"""
+
+    def __init__(self, conteudo):
+        self.conteudo = io.BytesIO(conteudo)
+
+    def read(self, size=-1):
+        chunk = self.conteudo.read(size)
+        if not chunk:
+            raise ClientDisconnected()
+        return chunk
+
+def test_an_upload_resumes_from_the_reported_offset(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    conteudo = os.urandom(200_000)
+    client = login(email)
+    url = open_upload(client, relatorio_id, conteudo)
+
+    assert put(client, url, 0, conteudo[:80_000]).headers['Upload-Offset'] == '80000'
+    # A chunk resent from a stale offset is refused with the current one
+    conflito = put(client, url, 40_000, conteudo[40_000:120_000])
+    assert conflito.status_code == 409 and conflito.headers['Upload-Offset'] == '80000'
+
+    estado = client.head(url)
+    assert (estado.headers['Upload-Offset'], estado.headers['Upload-Length']) == ('80000', '200000')
+    final = put(client, url, 80_000, conteudo[80_000:]).get_json()
+    assert final['completo'] and final['recebido'] == len(conteudo)
+    assert stored_bytes(app, final['foto_id']) == conteudo
+
+    # A retried last chunk returns the same photo
+    retry = put(client, url, 200_000, b'').get_json()
+    assert retry['foto_id'] == final['foto_id']
+    with app.app_context():
+        assert Foto.query.filter_by(relatorio_id=relatorio_id).count() == 1
+
+def test_bytes_read_before_a_dropped_connection_are_kept(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    conteudo = os.urandom(150_000)
+    client = login(email)
+    url = open_upload(client, relatorio_id, conteudo)
+    upload_id = url.rsplit('/', 1)[1]
+
+    with app.test_request_context():
+        upload = db.session.get(UploadParcial, upload_id)
+        # The client meant to send everything but only 70000 bytes arrived
+        assert resumable.write_chunk(upload, 0, DroppedStream(conteudo[:70_000]), len(conteudo)) == 70_000
+
+    assert client.get(url).get_json()['recebido'] == 70_000
+    final = put(client, url, 70_000, conteudo[70_000:]).get_json()
+    assert final['completo']
+    assert stored_bytes(app, final['foto_id']) == conteudo
+
+def test_uploads_belong_to_the_user_who_opened_them(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    _, outro_email = new_user()
+    relatorio_id = new_report(app, usuario_id, new_obra(usuario_id))
+    url = open_upload(login(email), relatorio_id, b'x' * 10)
+
+    outro = login(outro_email)
+    assert outro.get(url).status_code == 404
+    assert put(outro, url, 0, b'x' * 10).status_code == 404
+    assert outro.post('/api/uploads', json={'relatorio_id': relatorio_id, 'nome': 'a.jpg',
+                                            'tamanho': 10}).status_code == 403
@@ -0,0 +1,82 @@
+from models import db, Foto, Obra, Relatorio
+
+# Each test searches for its own made-up words, which no seeded report uses.
+
+def add_report(obra_id, usuario_id, atividades='', fotos=(), **campos):
+    numero = db.session.query(db.func.count(Relatorio.id)).scalar() + 1
+    relatorio = Relatorio(obra_id=obra_id, usuario_id=usuario_id, numero_seq=numero,
+                          codigo_relatorio=f'ELP-B-{numero:03d}-v1', atividades=atividades, **campos)
+    db.session.add(relatorio)
+    db.session.flush()
+    db.session.add_all(Foto(relatorio_id=relatorio.id, tipo_servico='Geral', caminho_arquivo='busca.jpg',
+                            descricao=descricao)
+                       for descricao in fotos)
+    db.session.commit()
+    return relatorio.id
+
+def found(client, consulta, **params):
+    response = client.get('/api/search', query_string={'q': consulta, **params})
+    assert response.status_code == 200
+    return response.get_json()
+
+def ids(client, consulta, **params):
+    return [r['id'] for r in found(client, consulta, **params)['resultados']]
+
+def test_activities_outrank_photo_descriptions_and_notes(app, login, new_user, new_obra):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    usuario_id, _ = new_user()
+    obra_id = new_obra(usuario_id)
+    with app.app_context():
+        na_foto = add_report(obra_id, usuario_id, 'Limpeza do canteiro', fotos=['Vergalhão zurbite exposto'])
+        na_nota = add_report(obra_id, usuario_id, 'Pintura', observacoes_admin='Refazer zurbite')
+        nas_atividades = add_report(obra_id, usuario_id, 'Concretagem do zurbite da fachada')
+    assert ids(login(ADMIN_EMAIL, ADMIN_PASSWORD), 'zurbite') in (
+        [nas_atividades, na_foto, na_nota], [nas_atividades, na_nota, na_foto])
+
+def test_accents_and_plurals_match_their_folded_stem(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    obra_id = new_obra(usuario_id)
+    with app.app_context():
+        relatorio_id = add_report(obra_id, usuario_id, 'Impermeabilização das quordelajes')
+    client = login(email)
+    assert ids(client, 'impermeabilizacao quordelaje') == [relatorio_id]
+    assert ids(client, 'QUORDELAJES') == [relatorio_id]
+    assert ids(client, 'quordelaje inexistentissima') == []
+
+def test_users_only_find_reports_in_their_scope(app, login, new_user, new_obra):
+    dono_id, dono_email = new_user()
+    outro_id, outro_email = new_user()
+    with app.app_context():
+        do_dono = add_report(new_obra(dono_id), dono_id, 'Escoramento plintovar')
+        do_outro = add_report(new_obra(outro_id), outro_id, 'Escoramento plintovar')
+    assert ids(login(dono_email), 'plintovar') == [do_dono]
+    assert ids(login(outro_email), 'plintovar') == [do_outro]
+
+def test_results_are_paginated_with_has_more(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    obra_id = new_obra(usuario_id)
+    with app.app_context():
+        criados = [add_report(obra_id, usuario_id, f'Vistoria gralvimo {i}') for i in range(5)]
+    client = login(email)
+    primeira = found(client, 'gralvimo', per_page=2)
+    ultima = found(client, 'gralvimo', per_page=2, page=3)
+    assert primeira['has_more'] and not ultima['has_more']
+    paginas = [ids(client, 'gralvimo', per_page=2, page=pagina) for pagina in (1, 2, 3)]
+    assert [len(pagina) for pagina in paginas] == [2, 2, 1]
+    assert sorted(sum(paginas, [])) == sorted(criados)
+
+def test_renaming_an_obra_reindexes_its_reports(app, login, new_user, new_obra):
+    usuario_id, email = new_user()
+    obra_id = new_obra(usuario_id)
+    with app.app_context():
+        relatorio_id = add_report(obra_id, usuario_id, 'Alvenaria')
+        db.session.get(Obra, obra_id).nome = 'Edifício Trovancy'
+        db.session.commit()
+    client = login(email)
+    assert ids(client, 'trovancy') == [relatorio_id]
+
+    with app.app_context():
+        db.session.get(Obra, obra_id).nome = 'Edifício Renomeado'
+        db.session.commit()
+    assert ids(client, 'trovancy') == []
@@ -0,0 +1,71 @@
+import io
+import os
+import threading
+
+from sqlalchemy import select
+
+from models import db, Arquivo, Foto
+from storage import delete_files, release_photo, store_file
+
+def test_same_content_under_another_extension_reuses_the_blob(app):
+    conteudo = b'\xff\xd8\xff' + os.urandom(2048)
+    with app.test_request_context():
+        primeiro, _ = store_file(io.BytesIO(conteudo), 'fachada.jpg')
+        segundo, _ = store_file(io.BytesIO(conteudo), 'FACHADA.JPEG')
+        db.session.commit()
+
+        assert segundo == primeiro
+        arquivo = Arquivo.query.filter_by(caminho_arquivo=primeiro).one()
+        assert arquivo.referencias == 2
+        pasta = os.path.dirname(os.path.join(app.config['UPLOAD_FOLDER'], primeiro))
+        assert os.listdir(pasta) == [os.path.basename(primeiro)]
+
+def test_uploads_are_staged_outside_the_served_folder(app):
+    staging = os.path.abspath(app.config['UPLOAD_TMP_FOLDER'])
+    assert not staging.startswith(os.path.abspath(app.config['UPLOAD_FOLDER']) + os.sep)
+    with app.test_request_context():
+        store_file(io.BytesIO(os.urandom(1024)), 'foto.png')
+        db.session.commit()
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], '.tmp'))
+
+def test_a_released_blob_uploaded_again_before_its_deletion_is_kept(app):
+    conteudo = os.urandom(4096)
+    with app.test_request_context():
+        caminho, _ = store_file(io.BytesIO(conteudo), 'removida.jpg')
+        db.session.commit()
+        liberados = release_photo(Foto(caminho_arquivo=caminho))
+        db.session.commit()
+        assert liberados == [caminho]
+
+    colocada, confirmar = threading.Event(), threading.Event()
+
+    def reenvio():
+        with app.test_request_context():
+            try:
+                # Its staged copy is dropped: the blob is still on disk
+                assert store_file(io.BytesIO(conteudo), 'de_novo.jpg')[0] == caminho
+                colocada.set()
+                confirmar.wait(10)
+                db.session.commit()
+            finally:
+                db.session.remove()
+
+    upload = threading.Thread(target=reenvio)
+    upload.start()
+    assert colocada.wait(10)
+    threading.Timer(0.3, confirmar.set).start()
+    with app.test_request_context():
+        # Waits for the upload's reference, then keeps the blob
+        delete_files(liberados)
+        upload.join(10)
+        assert db.session.execute(select(Arquivo.referencias).where(
+            Arquivo.caminho_arquivo == caminho)).scalar() == 1
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], caminho))
+
+def test_deleting_a_released_blob_drops_its_row_and_files(app):
+    with app.test_request_context():
+        caminho, _ = store_file(io.BytesIO(os.urandom(1024)), 'apagada.png')
+        db.session.commit()
+        delete_files(release_photo(Foto(caminho_arquivo=caminho)))
+        assert Arquivo.query.filter_by(caminho_arquivo=caminho).first() is None
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], caminho))
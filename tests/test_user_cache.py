@@ -0,0 +1,47 @@
+from sqlalchemy import event
+
+import user_cache
+from models import db
+
+def loaded_role(app, user_id):
+    """Role of the user as the next request's user loader sees it, and the statements it issued"""
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.test_request_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            return user_cache.load_user(user_id).role, len(statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+def test_a_cached_user_is_loaded_without_a_query(app, new_user):
+    assert app.config['USER_CACHE_TTL'] > 0
+    user_id, _ = new_user()
+    assert loaded_role(app, user_id)[0] == 'user'
+    assert loaded_role(app, user_id) == ('user', 0)
+
+def test_deactivation_is_seen_on_the_next_request(app, login, new_user):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    user_id, _ = new_user()
+    loaded_role(app, user_id)
+    admin = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    assert admin.post(f'/admin/users/{user_id}/toggle-status').status_code == 302
+    assert loaded_role(app, user_id)[0] == 'inactive'
+
+def test_a_deactivation_committed_by_another_worker_drops_this_workers_entry(app, login, new_user):
+    from bootstrap import ADMIN_EMAIL, ADMIN_PASSWORD
+
+    user_id, _ = new_user()
+    loaded_role(app, user_id)
+    # This worker keeps its entries; only the shared marker tells it the user changed
+    entradas = dict(user_cache._cache)
+    admin = login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    assert admin.post(f'/admin/users/{user_id}/toggle-status').status_code == 302
+    user_cache._cache.update(entradas)
+
+    role, statements = loaded_role(app, user_id)
+    assert role == 'inactive' and statements > 0
@@ -0,0 +1,388 @@
+"""Fill a database with realistic synthetic data for load tests and benchmarks.
+
+Usage:
+    python tools/seed_data.py [--database-url URL] [--escala pequena|media|grande]
+                              [--usuarios N] [--obras N] [--relatorios N] [--imagens N]
+                              [--upload-folder PATH] [--seed N]
+
+Without --database-url (or DATABASE_URL) a throwaway SQLite file is used and
+its path printed. The schema is migrated first; data is added next to
+whatever is already there, so a database can be seeded more than once.
+
+Obras are spread around a few Brazilian capitals, each with contacts and
+alerts. Reports are numbered per obra in date order and carry checklist
+answers, GPS fixes near their site (some outside the geofence), photos and
+an approval history consistent with their status. Photos point at real
+JPEG files written to the upload folder in content-addressed storage with
+their derivatives; a small set of distinct images is shared by every photo,
+as identical uploads are in production. Checklist response rows are written
+with their reports; counters, the search index and the map clusters are
+rebuilt at the end.
+
+Every seeded user's password is SENHA; the first ADMINS users are admins.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, select, text, update
+from werkzeug.security import generate_password_hash
+
+from models import (db, User, Checklist, Obra, Relatorio, Contato, Foto, FotoDerivado, Alerta,
+                    HistoricoAprovacao, Arquivo, RespostaChecklist)
+from migrations import upgrade
+from checklist_responses import field_key, response_rows
+from conditional import bump_versions
+from images import VARIANTS
+from storage import blob_name
+import counters
+import geo
+import map_clusters
+import search
+
+SENHA = 'senha123'
+ADMINS = 3
+CHUNK = 5000
+
+ESCALAS = {
+    # usuarios, obras, relatorios, imagens
+    'pequena': (20, 50, 2000, 12),
+    'media': (200, 1000, 50000, 24),
+    'grande': (1000, 5000, 300000, 48),
+}
+
+CIDADES = [
+    ('São Paulo', -23.5505, -46.6333),
+    ('Rio de Janeiro', -22.9068, -43.1729),
+    ('Belo Horizonte', -19.9167, -43.9345),
+    ('Curitiba', -25.4284, -49.2733),
+    ('Porto Alegre', -30.0346, -51.2177),
+    ('Salvador', -12.9777, -38.5016),
+]
+TIPOS_OBRA = ['Residencial', 'Comercial', 'Industrial', 'Infraestrutura', 'Reforma', 'Manutenção']
+NOMES_OBRA = ['Edifício', 'Residencial', 'Condomínio', 'Galpão', 'Centro Logístico', 'Escola', 'Hospital',
+              'Ponte', 'Viaduto', 'Shopping', 'Torre']
+LOGRADOUROS = ['Rua das Flores', 'Avenida Brasil', 'Rua XV de Novembro', 'Avenida Paulista', 'Rua da Bahia',
+               'Avenida Atlântica', 'Rua Sete de Setembro', 'Avenida Getúlio Vargas']
+PRENOMES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Eduarda', 'Fernando', 'Gabriela', 'Henrique', 'Isabela',
+            'João', 'Larissa', 'Marcos', 'Natália', 'Otávio', 'Paula', 'Rafael', 'Sofia', 'Thiago']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Lima', 'Pereira', 'Costa', 'Almeida', 'Ribeiro',
+              'Carvalho', 'Gomes', 'Martins']
+CARGOS = ['Engenheiro Civil', 'Mestre de Obras', 'Técnico de Segurança', 'Arquiteto', 'Fiscal', 'Cliente']
+SERVICOS = ['Fundação', 'Estrutura', 'Alvenaria', 'Instalações Elétricas', 'Instalações Hidráulicas',
+            'Revestimento', 'Cobertura', 'Pintura', 'Geral']
+ATIVIDADES = [
+    'Concretagem da laje do {n}º pavimento', 'Montagem de formas e armaduras dos pilares',
+    'Execução de alvenaria de vedação no {n}º pavimento', 'Escavação e preparo das sapatas',
+    'Impermeabilização da cobertura', 'Passagem de eletrodutos e caixas de tomada',
+    'Instalação das prumadas hidráulicas', 'Chapisco e reboco das fachadas',
+    'Recebimento e conferência de aço CA-50', 'Desforma e escoramento da laje',
+    'Assentamento de piso cerâmico', 'Limpeza e organização do canteiro',
+]
+OCORRENCIAS = [
+    'Chuva interrompeu os serviços por duas horas.', 'Equipe completa, sem ocorrências.',
+    'Atraso na entrega de concreto usinado.', 'Vistoria do corpo de bombeiros realizada.',
+    'Falta de EPI identificada e corrigida no local.', 'Material rejeitado no recebimento.',
+]
+REPROVACOES = ['Fotos insuficientes das armaduras.', 'Checklist de segurança incompleto.',
+               'Descrever o volume de concreto lançado.', 'Localização fora do canteiro.']
+ALERTAS = ['Vencimento do alvará', 'Vistoria técnica agendada', 'Entrega de materiais', 'Prazo de revisão',
+           'Renovação do seguro da obra', 'Reunião com o cliente']
+CAMPOS_PADRAO = ['Equipamentos de Segurança (EPIs)', 'Sinalização de Segurança', 'Andaimes e Proteções',
+                 'Estado dos Equipamentos', 'Organização do Canteiro', 'Gestão de Resíduos']
+# Photos per report, weighted to about two on average
+FOTOS_PESOS = [25, 20, 20, 15, 10, 6, 4]
+
+def create_app(database_url, upload_folder):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['UPLOAD_FOLDER'] = upload_folder
+    db.init_app(app)
+    return app
+
+def insert_chunked(conn, table, rows, chunk=CHUNK):
+    for start in range(0, len(rows), chunk):
+        conn.execute(table.insert(), rows[start:start + chunk])
+
+def _next_id(conn, model):
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def _near(rng, lat, lon, metros):
+    # About 111 km per degree; longitude shrinks with latitude but this is close enough
+    return lat + rng.uniform(-metros, metros) / 111000, lon + rng.uniform(-metros, metros) / 111000
+
+def write_images(rng, upload_folder, imagens):
+    """Write distinct JPEG photos and their derivatives; return one dict per image"""
+    from PIL import Image, ImageDraw
+
+    resultado = []
+    for i in range(imagens):
+        largura, altura = rng.choice([(2048, 1536), (1536, 2048), (1920, 1080)])
+        imagem = Image.effect_noise((largura // 4, altura // 4), 30).convert('RGB')
+        imagem = imagem.resize((largura, altura))
+        desenho = ImageDraw.Draw(imagem)
+        for _ in range(12):
+            x, y = rng.randrange(largura), rng.randrange(altura)
+            cor = tuple(rng.randrange(256) for _ in range(3))
+            desenho.rectangle([x, y, x + rng.randrange(50, 600), y + rng.randrange(50, 600)], fill=cor)
+        buffer = io.BytesIO()
+        imagem.save(buffer, 'JPEG', quality=85)
+        dados = buffer.getvalue()
+
+        digest = hashlib.sha256(dados).hexdigest()
+        caminho = blob_name(digest, 'jpg')
+        path = os.path.join(upload_folder, caminho)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(dados)
+
+        derivados = []
+        base = os.path.splitext(caminho)[0]
+        for variante, size, image_format, extension in VARIANTS:
+            imagem = imagem.copy()
+            imagem.thumbnail(size, Image.Resampling.LANCZOS)
+            nome = f"{base}_{variante}.{extension}"
+            imagem.save(os.path.join(upload_folder, nome), image_format, quality=85)
+            derivados.append({'variante': variante, 'caminho_arquivo': nome, 'largura': imagem.width,
+                              'altura': imagem.height,
+                              'tamanho': os.path.getsize(os.path.join(upload_folder, nome))})
+        resultado.append({'hash': digest, 'caminho_arquivo': caminho, 'tamanho': len(dados),
+                          'derivados': derivados})
+    return resultado
+
+def _checklist(conn):
+    """(id, campos) of the first active checklist, creating one if there is none"""
+    row = conn.execute(select(Checklist.id, Checklist.campos_json).where(Checklist.ativo == True)
+                       .order_by(Checklist.id).limit(1)).first()
+    if row is not None:
+        return row.id, json.loads(row.campos_json)
+    checklist_id = conn.execute(Checklist.__table__.insert().values(
+        nome='Checklist sintético', campos_json=json.dumps(CAMPOS_PADRAO), obrigatorios_json='[]', ativo=True,
+        data_criacao=datetime.utcnow(), data_atualizacao=datetime.utcnow())).inserted_primary_key[0]
+    return checklist_id, CAMPOS_PADRAO
+
+def _status(rng, idade_dias):
+    if idade_dias < 7:
+        return rng.choices(('pendente', 'aprovado', 'reprovado'), (70, 25, 5))[0]
+    return rng.choices(('pendente', 'aprovado', 'reprovado'), (5, 85, 10))[0]
+
+def seed(conn, upload_folder, usuarios, obras, relatorios, imagens, seed=42):
+    """Insert synthetic rows and files; return the number of rows per table"""
+    rng = random.Random(seed)
+    agora = datetime.utcnow()
+    total = Counter()
+    inicio_usuarios, inicio_obras = _next_id(conn, User), _next_id(conn, Obra)
+    relatorio_id, foto_id = _next_id(conn, Relatorio), _next_id(conn, Foto)
+    checklist_id, campos = _checklist(conn)
+
+    # One hash for everyone: computing it per user would dominate small runs
+    senha_hash = generate_password_hash(SENHA)
+    usuario_ids = list(range(inicio_usuarios, inicio_usuarios + usuarios))
+    admin_ids = usuario_ids[:ADMINS]
+    rows = []
+    for i, usuario_id in enumerate(usuario_ids):
+        role = 'admin' if i < ADMINS else rng.choices(('user', 'inactive'), (95, 5))[0]
+        rows.append({'id': usuario_id, 'nome': f'{rng.choice(PRENOMES)} {rng.choice(SOBRENOMES)}',
+                     'email': f'usuario{usuario_id}@seed.elp', 'senha_hash': senha_hash, 'role': role,
+                     'data_criacao': agora - timedelta(days=rng.randint(30, 1500))})
+    insert_chunked(conn, User.__table__, rows)
+    total['usuarios'] = len(rows)
+    responsaveis = [row['id'] for row in rows if row['role'] == 'user'] or admin_ids
+
+    arquivos = write_images(rng, upload_folder, imagens)
+    referencias = Counter()
+
+    # Busy obras get many more reports than quiet ones
+    pesos = [rng.lognormvariate(0, 0.8) for _ in range(obras)]
+    soma = sum(pesos)
+    por_obra = [int(relatorios * peso / soma) for peso in pesos]
+    por_obra[-1] += relatorios - sum(por_obra)
+
+    pendentes = {name: [] for name in ('relatorios', 'fotos', 'derivados', 'historico', 'respostas')}
+    tabelas = {'relatorios': Relatorio.__table__, 'fotos': Foto.__table__, 'derivados': FotoDerivado.__table__,
+               'historico': HistoricoAprovacao.__table__, 'respostas': RespostaChecklist.__table__}
+
+    def flush(force=False):
+        # Parents first, so foreign keys hold on Postgres
+        if force or len(pendentes['relatorios']) >= CHUNK:
+            for name in ('relatorios', 'fotos', 'derivados', 'historico', 'respostas'):
+                insert_chunked(conn, tabelas[name], pendentes[name])
+                total[name] += len(pendentes[name])
+                pendentes[name].clear()
+
+    obra_rows, contatos, alertas = [], [], []
+    for indice, quantidade in enumerate(por_obra):
+        obra_id = inicio_obras + indice
+        cidade, lat_cidade, lon_cidade = rng.choice(CIDADES)
+        lat_obra, lon_obra = _near(rng, lat_cidade, lon_cidade, 15000)
+        inicio = (agora - timedelta(days=rng.randint(60, 900))).date()
+        status_obra = rng.choices(('ativa', 'pausada', 'concluida'), (75, 5, 20))[0]
+        raio = rng.choice([None, None, None, 150, 300])
+        obra = {'id': obra_id, 'nome': f'{rng.choice(NOMES_OBRA)} {rng.choice(SOBRENOMES)} {obra_id}',
+                'tipo': rng.choice(TIPOS_OBRA), 'responsavel_id': rng.choice(responsaveis),
+                'status': status_obra, 'data_inicio': inicio,
+                'data_fim': inicio + timedelta(days=rng.randint(180, 1000)),
+                'endereco': f'{rng.choice(LOGRADOUROS)}, {rng.randint(1, 3000)} - {cidade}',
+                'latitude_obra': lat_obra, 'longitude_obra': lon_obra, 'raio_geofence': raio,
+                'descricao': f'Obra {rng.choice(TIPOS_OBRA).lower()} em {cidade}',
+                'data_criacao': datetime.combine(inicio, datetime.min.time())}
+        obra_rows.append(obra)
+        contatos += [{'nome': f'{rng.choice(PRENOMES)} {rng.choice(SOBRENOMES)}',
+                      'email': f'contato{obra_id}.{n}@seed.elp',
+                      'telefone': f'(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}',
+                      'obra_id': obra_id, 'cargo': rng.choice(CARGOS), 'data_criacao': obra['data_criacao']}
+                     for n in range(rng.randint(1, 5))]
+        alertas += [{'obra_id': obra_id, 'descricao': rng.choice(ALERTAS),
+                     'data_alerta': agora + timedelta(days=rng.randint(-90, 60), hours=rng.randint(8, 18)),
+                     'status': rng.choice(('pendente', 'pendente', 'resolvido')), 'data_criacao': agora}
+                    for _ in range(rng.randint(0, 6))]
+        if len(obra_rows) >= CHUNK:
+            insert_chunked(conn, Obra.__table__, obra_rows)
+            total['obras'] += len(obra_rows)
+            obra_rows.clear()
+
+        dias = max((agora.date() - inicio).days, 1)
+        criacoes = sorted(agora - timedelta(days=rng.uniform(0, dias)) for _ in range(quantidade))
+        codigos = Counter()
+        for numero_seq, criado in enumerate(criacoes, start=1):
+            codigos[criado.year] += 1
+            status = _status(rng, (agora - criado).days)
+            autor = obra['responsavel_id'] if rng.random() < 0.8 else rng.choice(responsaveis)
+            lat, lon = _near(rng, lat_obra, lon_obra, 600 if rng.random() < 0.05 else 60)
+            distancia, fora = geo.fence_status(lat, lon, lat_obra, lon_obra, raio)
+
+            marcados = [campo for campo in campos if rng.random() < 0.85]
+            respostas = {field_key(campo): 'on' for campo in marcados}
+            pendentes['respostas'] += [
+                {'relatorio_id': relatorio_id, 'checklist_id': checklist_id, 'campo': campo, 'valor': valor,
+                 'conforme': conforme, 'obra_id': obra_id, 'usuario_id': autor, 'data': criado.date()}
+                for campo, valor, conforme in response_rows(respostas, campos)]
+
+            historico, versao, atualizado = [], 1, criado
+            aprovador_id = data_aprovacao = prazo = observacoes = None
+            if status != 'pendente':
+                if status == 'aprovado' and rng.random() < 0.15:
+                    # Rejected once, then fixed and approved
+                    atualizado += timedelta(hours=rng.randint(2, 48))
+                    historico.append(('reprovado', rng.choice(admin_ids), rng.choice(REPROVACOES), atualizado))
+                    versao = 2
+                atualizado += timedelta(hours=rng.randint(2, 72))
+                aprovador_id = rng.choice(admin_ids)
+                observacoes = rng.choice(REPROVACOES) if status == 'reprovado' else None
+                historico.append((status, aprovador_id, observacoes, atualizado))
+                if status == 'aprovado':
+                    data_aprovacao = atualizado
+                else:
+                    prazo = atualizado + timedelta(days=7)
+            pendentes['historico'] += [
+                {'relatorio_id': relatorio_id, 'aprovador_id': quem, 'acao': acao, 'observacoes': nota,
+                 'data_acao': quando} for acao, quem, nota, quando in historico]
+
+            atividades = '. '.join(rng.choice(ATIVIDADES).format(n=rng.randint(1, 20))
+                                   for _ in range(rng.randint(1, 4)))
+            pendentes['relatorios'].append({
+                'id': relatorio_id, 'obra_id': obra_id, 'usuario_id': autor, 'numero_seq': numero_seq,
+                'codigo_relatorio': f'ELP-{criado.year}-{codigos[criado.year]:03d}-v{versao}', 'versao': versao,
+                'data': criado.date(), 'atividades': f'{atividades}. {rng.choice(OCORRENCIAS)}',
+                'checklist_json': json.dumps(respostas) if respostas else None,
+                'aprovador_id': aprovador_id, 'status': status, 'observacoes_admin': observacoes,
+                'prazo_revisao': prazo, 'data_aprovacao': data_aprovacao, 'latitude': lat, 'longitude': lon,
+                'distancia_obra': distancia, 'fora_da_cerca': fora, 'data_criacao': criado,
+                'data_atualizacao': atualizado})
+
+            for n in range(rng.choices(range(len(FOTOS_PESOS)), FOTOS_PESOS)[0]):
+                arquivo = rng.choice(arquivos)
+                referencias[arquivo['hash']] += 1
+                pendentes['fotos'].append({
+                    'id': foto_id, 'relatorio_id': relatorio_id, 'tipo_servico': rng.choice(SERVICOS),
+                    'caminho_arquivo': arquivo['caminho_arquivo'], 'tamanho': arquivo['tamanho'],
+                    'descricao': f'Foto {n + 1} do relatório {numero_seq}',
+                    'data_upload': criado + timedelta(minutes=rng.randint(1, 120)),
+                    'status_processamento': 'concluido'})
+                pendentes['derivados'] += [dict(derivado, foto_id=foto_id) for derivado in arquivo['derivados']]
+                foto_id += 1
+            relatorio_id += 1
+        # Reports need their obra row on Postgres
+        if len(pendentes['relatorios']) >= CHUNK:
+            insert_chunked(conn, Obra.__table__, obra_rows)
+            total['obras'] += len(obra_rows)
+            obra_rows.clear()
+            flush()
+
+    insert_chunked(conn, Obra.__table__, obra_rows)
+    total['obras'] += len(obra_rows)
+    flush(force=True)
+    insert_chunked(conn, Contato.__table__, contatos)
+    insert_chunked(conn, Alerta.__table__, alertas)
+    total['contatos'], total['alertas'] = len(contatos), len(alertas)
+
+    # Photos of the same content share one blob row, which counts them
+    existentes = set(conn.execute(select(Arquivo.hash).where(Arquivo.hash.in_(list(referencias)))).scalars())
+    for arquivo in arquivos:
+        quantidade = referencias[arquivo['hash']]
+        if not quantidade:
+            continue
+        if arquivo['hash'] in existentes:
+            conn.execute(update(Arquivo).where(Arquivo.hash == arquivo['hash'])
+                         .values(referencias=Arquivo.referencias + quantidade))
+        else:
+            conn.execute(Arquivo.__table__.insert().values(
+                hash=arquivo['hash'], caminho_arquivo=arquivo['caminho_arquivo'], tamanho=arquivo['tamanho'],
+                referencias=quantidade, data_criacao=agora))
+
+    if conn.dialect.name == 'postgresql':
+        # Rows were inserted with explicit ids
+        for model in (User, Obra, Relatorio, Foto):
+            tabela = model.__tablename__
+            conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), "
+                              f"(SELECT MAX(id) FROM {tabela}))"))
+
+    # Derived data the write paths normally maintain
+    search.reindex(conn, obra_ids=list(range(inicio_obras, inicio_obras + obras)))
+    map_clusters.rebuild(conn)
+    bump_versions(conn, ('usuarios', 'obras', 'relatorios', 'contatos', 'checklists'))
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--escala', choices=ESCALAS, default='pequena')
+    parser.add_argument('--usuarios', type=int)
+    parser.add_argument('--obras', type=int)
+    parser.add_argument('--relatorios', type=int)
+    parser.add_argument('--imagens', type=int, help='distinct photo files shared by every Foto')
+    parser.add_argument('--upload-folder', default='static/uploads')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    padrao = dict(zip(('usuarios', 'obras', 'relatorios', 'imagens'), ESCALAS[args.escala]))
+    volumes = {nome: getattr(args, nome) or valor for nome, valor in padrao.items()}
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'seed.db')
+    os.makedirs(args.upload_folder, exist_ok=True)
+    app = create_app(database_url, args.upload_folder)
+
+    with app.app_context():
+        upgrade()
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            total = seed(conn, args.upload_folder, seed=args.seed, **volumes)
+        counters.rebuild()
+
+    print(f"Seeded {database_url} in {time.perf_counter() - start:.1f}s")
+    for nome, quantidade in total.items():
+        print(f"{quantidade:>10} {nome}")
+    print(f"Senha de todos os usuários: {SENHA}")
+
+if __name__ == '__main__':
+    main()
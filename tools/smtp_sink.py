@@ -0,0 +1,114 @@
+"""Local SMTP stand-in that accepts and records every message.
+
+Usage:
+    python tools/smtp_sink.py [--port 1025]
+
+Point the app at it with MAIL_SERVER=localhost MAIL_PORT=1025
+MAIL_USE_TLS=false and any MAIL_USERNAME/MAIL_PASSWORD; it accepts every
+login. Tests can also start it in-process:
+
+    sink = SMTPSink(port=0).start()
+    ...  # sink.port, sink.messages
+    sink.stop()
+"""
+import argparse
+import socketserver
+import threading
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        sink = self.server.sink
+        envelope = {'from': None, 'to': []}
+        self.reply('220 elp-smtp-sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.wfile.write(b'250-elp-smtp-sink\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n')
+            elif verb == 'HELO':
+                self.reply('250 elp-smtp-sink')
+            elif verb == 'AUTH':
+                # Only PLAIN is advertised; credentials are not checked
+                if len(command.split()) == 2:
+                    self.reply('334 ')
+                    self.rfile.readline()
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                envelope = {'from': command.split(':', 1)[1].strip(), 'to': []}
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                envelope['to'].append(command.split(':', 1)[1].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b'.\r\n', b'.\n', b''):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                with sink.lock:
+                    sink.messages.append({
+                        'from': envelope['from'],
+                        'to': envelope['to'],
+                        'data': b''.join(data).decode('utf-8', 'replace'),
+                    })
+                sink.on_message(sink.messages[-1])
+                self.reply('250 OK: queued')
+            elif verb in ('RSET', 'NOOP'):
+                envelope = {'from': None, 'to': []}
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=1025, on_message=None):
+        self.messages = []
+        self.lock = threading.Lock()
+        self.on_message = on_message or (lambda message: None)
+        self.server = _Server((host, port), _SMTPHandler)
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+
+    def show(message):
+        print(f"--- {message['from']} -> {', '.join(message['to'])}\n{message['data']}", flush=True)
+
+    sink = SMTPSink(args.host, args.port, on_message=show)
+    print(f"SMTP sink listening on {args.host}:{sink.port}")
+    try:
+        sink.server.serve_forever()
+    except KeyboardInterrupt:
+        sink.server.server_close()
+
+if __name__ == '__main__':
+    main()
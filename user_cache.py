@@ -0,0 +1,94 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+# Short-lived cache for Flask-Login's user loader, so authenticated requests
+# skip the primary-key lookup of their user. Each worker keeps an LRU of
+# users' column values for USER_CACHE_TTL seconds. Workers share one
+# invalidation marker, a file in USER_CACHE_DIR that is replaced whenever a
+# transaction that changed a user commits (registration, activation,
+# deactivation, role changes); every worker compares it with a stat() per
+# request, so a deactivated account is logged out on its next request to
+# any worker rather than after the TTL.
+
+MARKER = 'versao'
+
+_cache = OrderedDict()  # user id -> (expires, marker version, column values)
+_lock = threading.Lock()
+_config = {'ttl': 0, 'size': 0, 'path': None}
+
+def _version():
+    try:
+        stat = os.stat(_config['path'])
+    except (OSError, TypeError):
+        return None
+    # Replacing the file gives it a new inode, even within one mtime tick
+    return stat.st_ino, stat.st_mtime_ns
+
+def invalidate():
+    """Drop every cached user in every worker"""
+    with _lock:
+        _cache.clear()
+    path = _config['path']
+    if path:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(secrets.token_hex(8))
+        os.replace(tmp_path, path)
+
+def _snapshot(user):
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+def load_user(user_id):
+    """The user with user_id attached to the current session, or None"""
+    if not _config['ttl']:
+        return db.session.get(User, user_id)
+
+    versao = _version()
+    agora = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        valores = None
+        if entry and entry[0] > agora and entry[1] == versao:
+            _cache.move_to_end(user_id)
+            valores = entry[2]
+    if valores is not None:
+        user = User(**valores)
+        make_transient_to_detached(user)
+        # Attached without a query; relationships still lazy-load
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        with _lock:
+            _cache[user_id] = (agora + _config['ttl'], versao, _snapshot(user))
+            _cache.move_to_end(user_id)
+            while len(_cache) > _config['size']:
+                _cache.popitem(last=False)
+    return user
+
+@event.listens_for(db.session, 'after_flush')
+def _users_changed(session, flush_context):
+    if any(isinstance(obj, User) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['usuarios_alterados'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    # Only once committed, so no worker can cache the old row again
+    if session.info.pop('usuarios_alterados', False):
+        invalidate()
+
+def init_app(app):
+    """Cache the users loaded for app's requests"""
+    _config['ttl'] = app.config['USER_CACHE_TTL']
+    _config['size'] = app.config['USER_CACHE_SIZE']
+    os.makedirs(app.config['USER_CACHE_DIR'], exist_ok=True)
+    _config['path'] = os.path.join(app.config['USER_CACHE_DIR'], MARKER)
@@ -0,0 +1,36 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from models import db
+
+# Process pools for CPU-bound work (PDF rendering, image processing). Each
+# pool is created lazily in the process that first uses it, so gunicorn
+# workers forked from a preloaded master never share a pool.
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _init_worker():
+    # Connections inherited from the parent must not be shared with it
+    from app import app
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def get_pool(name, max_workers):
+    with _pools_lock:
+        pool, pid = _pools.get(name, (None, None))
+        if pool is None or pid != os.getpid():
+            pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+            _pools[name] = (pool, os.getpid())
+        return pool
+
+def submit(name, max_workers, fn, *args):
+    """Run fn(*args) in the named pool, replacing the pool if it has broken"""
+    try:
+        return get_pool(name, max_workers).submit(fn, *args)
+    except BrokenProcessPool:
+        with _pools_lock:
+            _pools.pop(name, None)
+        return get_pool(name, max_workers).submit(fn, *args)